@@ -4,5 +4,6 @@
 """
 
 from .base_agent import BaseAgent
+from .conversation_history import ConversationHistory
 
-__all__ = ['BaseAgent']
+__all__ = ['BaseAgent', 'ConversationHistory']
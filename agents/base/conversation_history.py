@@ -0,0 +1,138 @@
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+
+class _UserHistory:
+    """单个用户的对话记录：定长环形缓冲区和已用预算"""
+    __slots__ = ('messages', 'size')
+
+    def __init__(self, max_messages: int):
+        self.messages: Deque[Dict[str, Any]] = deque(maxlen=max_messages)
+        self.size = 0
+
+
+class ConversationHistory:
+    """按用户索引的有界对话历史
+
+    - 每个用户一个环形缓冲区，最多保留 max_messages 条，超出时丢弃最旧的消息
+    - 每个用户的内容总量不超过 max_size_per_user（按 size_fn 计量，默认字符数，可换成 token 计数）
+    - 用户按最近访问排序，超过 max_users 或总量超过 max_total_size 时淘汰最久未访问的用户
+    """
+
+    def __init__(self, max_messages: int = 100, max_size_per_user: int = 20000,
+                 max_users: int = 10000, max_total_size: int = 5000000,
+                 size_fn: Callable[[str], int] = len):
+        self.max_messages = max(1, max_messages)
+        self.max_size_per_user = max(1, max_size_per_user)
+        self.max_users = max(1, max_users)
+        self.max_total_size = max(1, max_total_size)
+        self.size_fn = size_fn
+
+        self._users: "OrderedDict[str, _UserHistory]" = OrderedDict()
+        self.total_size = 0
+        self.total_messages = 0
+
+        self.evicted_messages = 0
+        self.evicted_users = 0
+
+    def __len__(self) -> int:
+        return self.total_messages
+
+    def append(self, user_id: str, role: str, content: str) -> None:
+        """
+        记录一条消息
+
+        Args:
+            user_id: 用户 ID
+            role: user / assistant
+            content: 消息内容
+        """
+        history = self._users.get(user_id)
+        if history is None:
+            history = self._users[user_id] = _UserHistory(self.max_messages)
+        else:
+            self._users.move_to_end(user_id)
+
+        if len(history.messages) == history.messages.maxlen:
+            self._drop_oldest(history)
+        size = self.size_fn(content)
+        history.messages.append({"role": role, "content": content, "user_id": user_id, "size": size})
+        history.size += size
+        self.total_size += size
+        self.total_messages += 1
+
+        # 单个用户超出预算时从最旧的消息开始丢弃，至少保留刚写入的一条
+        while history.size > self.max_size_per_user and len(history.messages) > 1:
+            self._drop_oldest(history)
+
+        # 用户数或总量超限时淘汰最久未访问的其他用户
+        while len(self._users) > 1 and (len(self._users) > self.max_users or self.total_size > self.max_total_size):
+            oldest = next(iter(self._users))
+            if oldest == user_id:
+                break
+            self._evict_user(oldest)
+
+    def _drop_oldest(self, history: _UserHistory) -> None:
+        message = history.messages.popleft()
+        history.size -= message["size"]
+        self.total_size -= message["size"]
+        self.total_messages -= 1
+        self.evicted_messages += 1
+
+    def _evict_user(self, user_id: str) -> None:
+        history = self._users.pop(user_id)
+        self.total_size -= history.size
+        self.total_messages -= len(history.messages)
+        self.evicted_messages += len(history.messages)
+        self.evicted_users += 1
+
+    def get(self, user_id: str, budget: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        获取用户的对话历史（从旧到新）
+
+        Args:
+            user_id: 用户 ID
+            budget: 只返回总量不超过该值的最近若干条消息，为空时返回全部
+
+        Returns:
+            List[Dict[str, Any]]: 消息列表，每条包含 role / content / user_id
+        """
+        history = self._users.get(user_id)
+        if history is None:
+            return []
+        self._users.move_to_end(user_id)
+
+        if budget is None:
+            messages = list(history.messages)
+        else:
+            messages = []
+            used = 0
+            for message in reversed(history.messages):
+                used += message["size"]
+                if used > budget:
+                    break
+                messages.append(message)
+            messages.reverse()
+        return [{"role": m["role"], "content": m["content"], "user_id": m["user_id"]} for m in messages]
+
+    def clear(self, user_id: Optional[str] = None) -> None:
+        """清除指定用户的对话历史，user_id 为空时清除全部"""
+        if user_id is None:
+            self._users.clear()
+            self.total_size = 0
+            self.total_messages = 0
+        elif user_id in self._users:
+            history = self._users.pop(user_id)
+            self.total_size -= history.size
+            self.total_messages -= len(history.messages)
+
+    def stats(self) -> Dict[str, int]:
+        """用户数、消息数、内容总量和淘汰统计"""
+        return {
+            "users": len(self._users),
+            "messages": self.total_messages,
+            "size": self.total_size,
+            "max_total_size": self.max_total_size,
+            "evicted_messages": self.evicted_messages,
+            "evicted_users": self.evicted_users
+        }
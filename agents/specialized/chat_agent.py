@@ -1,13 +1,16 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from ..base.base_agent import BaseAgent
+from ..base.conversation_history import ConversationHistory
 
 class ChatAgent(BaseAgent):
     """聊天代理，负责处理对话交互"""
 
-    def __init__(self, agent_id: str, model_name: str = "gpt-3.5-turbo"):
+    def __init__(self, agent_id: str, model_name: str = "gpt-3.5-turbo",
+                 conversation_history: Optional[ConversationHistory] = None):
         super().__init__(agent_id=agent_id, name="Chat Agent")
         self.model_name = model_name
-        self.conversation_history = []
+        # 按用户索引的有界对话历史
+        self.conversation_history = conversation_history if conversation_history is not None else ConversationHistory()
 
     async def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -33,14 +36,10 @@ class ChatAgent(BaseAgent):
                 raise ValueError("Message and user_id are required")
 
             if input_data.get("clear_history"):
-                self.conversation_history = []
+                self.conversation_history.clear(user_id)
 
             # 记录用户消息
-            self.conversation_history.append({
-                "role": "user",
-                "content": message,
-                "user_id": user_id
-            })
+            self.conversation_history.append(user_id, "user", message)
 
             # TODO: 实现实际的模型调用
             # 这里是一个简单的回显示例
@@ -51,11 +50,7 @@ class ChatAgent(BaseAgent):
             }
 
             # 记录助手回复
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": response["message"],
-                "user_id": user_id
-            })
+            self.conversation_history.append(user_id, "assistant", response["message"])
 
             return response
         except Exception as e:
@@ -63,9 +58,6 @@ class ChatAgent(BaseAgent):
         finally:
             self.status = "initialized"
 
-    def get_conversation_history(self, user_id: str) -> list:
-        """获取指定用户的对话历史"""
-        return [
-            msg for msg in self.conversation_history
-            if msg["user_id"] == user_id
-        ]
+    def get_conversation_history(self, user_id: str, budget: Optional[int] = None) -> list:
+        """获取指定用户的对话历史，budget 限制返回的最近消息总量"""
+        return self.conversation_history.get(user_id, budget=budget)
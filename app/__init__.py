@@ -1,23 +1,51 @@
 from flask import Flask
 from flask_cors import CORS
-from .models import db
+from sqlalchemy import inspect, text
+from .models import db, ChatRoom, ChatMessage
+from .models.base import engine_options, install_sqlite_pragmas, sqlite_pragmas
 from .api import init_app
-from .models.agents import RepeaterAgent, WeatherAgent
+from .models.agents import agent_registry
+from .core.message_writer import message_writer
+from .core.retention import retention_manager
+from config.settings import Config
+
+def add_missing_columns(table) -> None:
+    """为已存在的表补充模型中新增的可空列"""
+    existing = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+    with db.engine.begin() as conn:
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
 
 def create_app(config=None):
+    """
+    创建 Flask 应用
+
+    Args:
+        config: 覆盖 config/settings.py 中 Config 的配置项；DATABASE_URI 为 SQLALCHEMY_DATABASE_URI 的简写
+    """
     app = Flask(__name__)
 
-    # 使用默认配置
-    if config is None:
-        config = {}
+    # 加载配置：先读取 Config，再用传入的配置覆盖
+    app.config.from_object(Config)
+    if config:
+        app.config.update(config)
+        if 'DATABASE_URI' in config:
+            app.config['SQLALCHEMY_DATABASE_URI'] = config['DATABASE_URI']
 
-    # 配置数据库
-    app.config['SQLALCHEMY_DATABASE_URI'] = config.get('DATABASE_URI', 'sqlite:///multiagent.db')
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # 数据库引擎参数：连接池，SQLite 另外在每个连接上设置 WAL、同步级别、busy_timeout 和 mmap_size
+    app.config.setdefault(
+        'SQLALCHEMY_ENGINE_OPTIONS',
+        engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config)
+    )
 
     # 初始化扩展
     CORS(app)
     db.init_app(app)
+    with app.app_context():
+        install_sqlite_pragmas(db.engine, sqlite_pragmas(app.config))
+    message_writer.init_app(app)
 
     # 注册路由
     init_app(app)
@@ -25,8 +53,19 @@ def create_app(config=None):
     # 创建数据库表
     with app.app_context():
         db.create_all()
-        # 初始化 agents
-        RepeaterAgent.init_app(app)
-        WeatherAgent.init_app(app)
+        # create_all 不会为已存在的表补建索引和新增的列
+        for index in ChatMessage.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+        add_missing_columns(ChatRoom.__table__)
+        add_missing_columns(ChatMessage.__table__)
+        # 初始化 agents：只批量写入缺少的记录，不导入实现模块
+        created = agent_registry.seed()
+        if created:
+            print(f"已创建 agent: {', '.join(created)}")
+
+    agent_registry.ensure_loaded(app.config['AGENT_PRELOAD'])
+
+    # 消息保留：后台清理和分批删除房间，继续执行上次未完成的删除
+    retention_manager.init_app(app)
 
     return app
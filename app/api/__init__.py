@@ -5,7 +5,7 @@ from app.api import room
 bp = Blueprint('api', __name__, url_prefix='/api')
 
 from .health import health
-from .chat import chat
+from .chat import chat, transcript
 
 def init_app(app):
     # 注册所有路由后再注册蓝图
@@ -13,4 +13,5 @@ def init_app(app):
     room.init_app(app)
     health.init_routes(bp)
     chat.init_routes(bp)
+    transcript.init_routes(bp)
     app.register_blueprint(bp)
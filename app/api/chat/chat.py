@@ -1,10 +1,21 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, abort, jsonify, request
 from flask_sock import Sock
-from app.models import ChatRoom, ChatMessage, Agent, chat_room_manager, db
+from app.models import ChatRoom, ChatMessage, Agent, chat_room_manager, db, room_cache
+from app.models.agents import agent_registry
+from app.core.message_writer import message_writer
+from app.core.archive import message_archive
+from app.core.retention import retention_manager
 from datetime import datetime
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+import base64
 import json
 from uuid import uuid4
 
+# 历史消息分页大小
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
 def create_room():
     """创建新的聊天室"""
     data = request.get_json()
@@ -13,77 +24,199 @@ def create_room():
     if not agent_type:
         return jsonify({'error': '缺少 agent_type 参数'}), 400
 
-    # 检查 agent 是否存在
+    # 检查 agent 是否存在，查询前先导入对应的实现类
+    if not agent_registry.is_declared(agent_type):
+        return jsonify({'error': f'不支持的 agent 类型: {agent_type}'}), 400
+    agent_registry.get_class(agent_type)
     agent = Agent.query.filter_by(type=agent_type).first()
     if not agent:
         return jsonify({'error': f'不支持的 agent 类型: {agent_type}'}), 400
 
+    room_id = str(uuid4())
+    agent_id = agent.id
+    created_at = datetime.utcnow()
     room = ChatRoom(
-        id=str(uuid4()),
+        id=room_id,
         agent_type=agent_type,
-        agent_id=agent.id
+        agent_id=agent_id,
+        created_at=created_at
     )
     db.session.add(room)
     db.session.commit()
 
-    return jsonify({'roomId': room.id}), 201
+    # 写入房间缓存，连接和消息不需要再读取数据库
+    room_cache.put(room_id, agent_type, agent_id, created_at)
+
+    # 预热房间所需的 agent 资源，避免第一条消息承担冷启动开销
+    agent.prepare_room(room_id)
+
+    return jsonify({'roomId': room_id}), 201
+
+def _load_room_with_agent(room_id: str) -> ChatRoom:
+    """读取房间并一起加载 agent（一次查询），房间不存在或已标记删除时返回 404
+
+    按 type 加载 agent 子类前需要先导入实现类，房间的 agent 类型取自房间缓存。
+    """
+    cached = room_cache.get(room_id)
+    if cached is None:
+        abort(404)
+    agent_registry.get_class(cached.agent_type)
+    return ChatRoom.query.options(joinedload(ChatRoom.agent)).filter(
+        ChatRoom.id == room_id, ChatRoom.deleted_at.is_(None)
+    ).first_or_404()
 
 def get_room(room_id):
     """获取聊天室信息"""
-    room = ChatRoom.query.get_or_404(room_id)
+    room = _load_room_with_agent(room_id)
     return jsonify(room.to_dict())
 
 def delete_room(room_id):
-    """删除聊天室"""
-    room = ChatRoom.query.get_or_404(room_id)
+    """删除聊天室
+
+    只把房间标记为已删除并立即对外不可见，消息、房间和归档由后台任务分批删除，
+    不在请求中长时间占用数据库写锁。返回 202 和删除任务的状态。
+    """
+    room = _load_room_with_agent(room_id)
 
     # 关闭所有WebSocket连接
     chat_room_manager.close_room(room_id)
 
-    # 删除相关消息
-    ChatMessage.query.filter_by(room_id=room_id).delete()
+    # 释放房间占用的 agent 资源
+    if room.agent:
+        room.agent.release_room(room_id)
 
-    # 删除房间
-    db.session.delete(room)
+    # 标记删除，提交后再移出房间缓存，避免并发的连接把删除前的房间重新写入缓存
+    room.deleted_at = datetime.utcnow()
     db.session.commit()
-
-    return jsonify({'success': True})
+    room_cache.invalidate(room_id)
+
+    job = retention_manager.delete_room(room_id)
+    return jsonify({'success': True, 'deletion': job}), 202
+
+def get_room_deletion(room_id):
+    """房间删除任务的状态"""
+    job = retention_manager.deletion_status(room_id)
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+def _encode_cursor(message: dict) -> str:
+    """把消息（to_dict 格式）的 (timestamp, id) 编码为不透明的游标"""
+    raw = f"{message['timestamp']}|{message['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor: str) -> tuple:
+    """解析游标，返回 (timestamp, id)"""
+    raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    timestamp, msg_id = raw.split('|', 1)
+    return datetime.fromisoformat(timestamp), msg_id
+
+def get_room_messages(room_id):
+    """按游标分页获取聊天室历史消息
+
+    超出保留期或行数上限的消息已移入归档，读到数据库中最旧的消息之后从归档继续分页，
+    归档中的消息都早于数据库中的消息，游标在两者之间通用。
+
+    查询参数：
+        limit: 每页数量，默认 50，最大 200
+        cursor: 上一页返回的 next_cursor
+        direction: backward（从新到旧，默认）或 forward（从旧到新）
+        type: 消息类型过滤，多个类型用逗号分隔
+    """
+    ChatRoom.query.filter(ChatRoom.id == room_id, ChatRoom.deleted_at.is_(None)).first_or_404()
+
+    direction = request.args.get('direction', 'backward')
+    if direction not in ('backward', 'forward'):
+        return jsonify({'error': f'无效的 direction 参数: {direction}'}), 400
+
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'limit 参数必须是整数'}), 400
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    # 保证能读到刚写入（可能仍在写入队列中）的消息
+    message_writer.flush(room_id)
+
+    query = ChatMessage.query.filter(ChatMessage.room_id == room_id)
+
+    msg_types = request.args.get('type')
+    types = [t for t in msg_types.split(',') if t] if msg_types else None
+    if types:
+        query = query.filter(ChatMessage.type.in_(types))
+
+    cursor_key = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_key = _decode_cursor(cursor)
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({'error': '无效的 cursor 参数'}), 400
+        cursor_ts, cursor_id = cursor_key
+        # 基于 (timestamp, id) 的 keyset 分页，命中 (room_id, timestamp, id) 复合索引；
+        # 冗余的 timestamp 范围条件让索引扫描从游标处开始，只有 OR 条件时会从房间一端扫描到游标
+        if direction == 'backward':
+            query = query.filter(ChatMessage.timestamp <= cursor_ts, or_(
+                ChatMessage.timestamp < cursor_ts,
+                and_(ChatMessage.timestamp == cursor_ts, ChatMessage.id < cursor_id)
+            ))
+        else:
+            query = query.filter(ChatMessage.timestamp >= cursor_ts, or_(
+                ChatMessage.timestamp > cursor_ts,
+                and_(ChatMessage.timestamp == cursor_ts, ChatMessage.id > cursor_id)
+            ))
+
+    if direction == 'backward':
+        query = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+    else:
+        query = query.order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+
+    # 多取一条用于判断是否还有下一页
+    archived = message_archive.has(room_id)
+    if direction == 'backward':
+        messages = [message.to_dict() for message in query.limit(limit + 1).all()]
+        if len(messages) <= limit and archived:
+            messages += message_archive.page(room_id, direction, cursor_key, limit + 1 - len(messages), types)
+    else:
+        messages = message_archive.page(room_id, direction, cursor_key, limit + 1, types) if archived else []
+        if len(messages) <= limit:
+            messages += [message.to_dict() for message in query.limit(limit + 1 - len(messages)).all()]
+
+    if archived:
+        # 归档后、删除数据库行之前读取时同一条消息可能出现两次
+        seen = set()
+        messages = [message for message in messages if not (message['id'] in seen or seen.add(message['id']))]
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    return jsonify({
+        'messages': messages,
+        'next_cursor': _encode_cursor(messages[-1]) if has_more else None,
+        'has_more': has_more,
+        'direction': direction
+    })
 
 def get_agent(agent_type):
     """获取指定类型的Agent信息"""
+    if not agent_registry.is_declared(agent_type):
+        return jsonify({'error': f'不支持的 agent 类型: {agent_type}'}), 404
+    agent_registry.get_class(agent_type)
     agent = Agent.query.filter_by(type=agent_type).first_or_404()
     return jsonify(agent.to_dict())
 
 def get_all_agents():
     """获取所有可用的Agent列表"""
-    agents = Agent.query.all()
-    return jsonify([agent.to_dict() for agent in agents])
-
-def create_message(room_id: str, msg_type: str, content: str, role: str) -> dict:
-    """创建标准格式的消息"""
-    message = ChatMessage(
-        id=str(uuid4()),
-        room_id=room_id,
-        type=msg_type,
-        content=content,
-        role=role,
-        timestamp=datetime.utcnow()
-    )
-    db.session.add(message)
-    db.session.commit()
-
-    return {
-        'id': message.id,
-        'type': msg_type,
-        'content': content,
-        'role': role,
-        'timestamp': message.timestamp.isoformat()
-    }
+    # 只读取列，不需要导入各 agent 的实现模块
+    rows = db.session.query(Agent.id, Agent.name, Agent.type, Agent.description, Agent.capabilities).all()
+    return jsonify([row._asdict() for row in rows])
 
 def init_routes(bp):
     """注册聊天相关路由"""
     bp.add_url_rule('/chat/rooms', 'create_room', create_room, methods=['POST'])
     bp.add_url_rule('/chat/rooms/<room_id>', 'get_room', get_room, methods=['GET'])
     bp.add_url_rule('/chat/rooms/<room_id>', 'delete_room', delete_room, methods=['DELETE'])
+    bp.add_url_rule('/chat/rooms/<room_id>/deletion', 'get_room_deletion', get_room_deletion, methods=['GET'])
+    bp.add_url_rule('/chat/rooms/<room_id>/messages', 'get_room_messages', get_room_messages, methods=['GET'])
     bp.add_url_rule('/chat/agents/<agent_type>', 'get_agent', get_agent, methods=['GET'])
     bp.add_url_rule('/chat/agents', 'get_all_agents', get_all_agents, methods=['GET'])
@@ -0,0 +1,464 @@
+"""
+聊天记录的流式导出与导入
+
+导出格式为 NDJSON（可选 gzip），每个房间先输出一行房间信息 {"room": {...}}，
+之后每行一条消息：ChatMessage.to_dict() 加上 room_id。先输出归档中的消息，再按 (timestamp, id)
+keyset 分批读取数据库中的消息，每批是一次独立的短查询，内存占用与房间大小无关，
+也不会长时间持有读事务（SQLite WAL 下长时间的读事务会阻止检查点）。
+
+导入接受同样的格式（自动识别 gzip），边读取请求体边分步解压和解析，每 IMPORT_BATCH_SIZE 条提交一次。
+单行长度和解压后的总大小分别受 IMPORT_MAX_LINE_BYTES 和 IMPORT_MAX_BYTES 限制，内存占用有上界。
+已存在的消息 id 和早于房间归档末尾的消息会被跳过，重复导入同一份导出不会产生重复消息。
+导入到另一个房间时消息 id 按目标房间重新生成（uuid5，重复导入仍然得到相同的 id）。
+"""
+import itertools
+import json
+import uuid
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from flask import Response, abort, current_app, jsonify, request, stream_with_context
+from sqlalchemy import and_, or_
+
+from app.models import Agent, ChatMessage, ChatRoom, db
+from app.models.agents import agent_registry
+from app.core.archive import message_archive, record_key, to_message
+from app.core.message_writer import message_writer
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+GZIP_MIMETYPE = 'application/gzip'
+GZIP_MAGIC = b'\x1f\x8b'
+READ_CHUNK_BYTES = 64 * 1024
+
+# 导入时每条消息必须包含的字段
+REQUIRED_FIELDS = ('id', 'type', 'content', 'role', 'timestamp')
+
+
+class TranscriptError(ValueError):
+    """导入数据中的错误行"""
+
+
+class TranscriptConflict(TranscriptError):
+    """导入的消息 id 已属于其他房间"""
+
+
+def _is_uuid(value) -> bool:
+    """房间和消息 id 都由服务端以 uuid4 生成，导入时只接受标准格式的 UUID
+
+    房间 id 会用作归档目录名，不能包含路径分隔符或 ..
+    """
+    if not isinstance(value, str):
+        return False
+    try:
+        return str(uuid.UUID(value)) == value
+    except ValueError:
+        return False
+
+
+def _room_header(room_id: str, agent_type: str, created_at: Optional[datetime]) -> dict:
+    return {'room': {
+        'id': room_id,
+        'agent_type': agent_type,
+        'created_at': created_at.isoformat() if created_at else None
+    }}
+
+
+def _iter_room_messages(room_id: str, batch_size: int) -> Iterator[dict]:
+    """按时间顺序产出房间的全部消息：先读归档，再按 keyset 分批读数据库"""
+    message_writer.flush(room_id)
+    last_record = None
+    for last_record in message_archive.iter_records(room_id):
+        yield dict(to_message(last_record), room_id=room_id)
+    last_key = record_key(last_record) if last_record is not None else None
+
+    while True:
+        query = ChatMessage.query.filter(ChatMessage.room_id == room_id)
+        if last_key is not None:
+            # 归档后、删除数据库行之前的消息同时存在于两处，从归档末尾之后继续；
+            # 冗余的 timestamp >= 条件让索引范围从游标处开始，否则每批都从房间第一条消息扫描
+            last_ts, last_id = last_key
+            query = query.filter(ChatMessage.timestamp >= last_ts, or_(
+                ChatMessage.timestamp > last_ts,
+                and_(ChatMessage.timestamp == last_ts, ChatMessage.id > last_id)
+            ))
+        messages = query.order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc()).limit(batch_size).all()
+        if messages:
+            last_key = (messages[-1].timestamp, messages[-1].id)
+        rows = [dict(message.to_dict(), room_id=room_id) for message in messages]
+        # 每批结束读事务，不长时间持有快照
+        db.session.commit()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+
+
+def _iter_rooms(room_ids: Optional[List[str]], agent_type: Optional[str], batch_size: int) -> Iterator[tuple]:
+    """按 id 分批读取要导出的房间 (id, agent_type, created_at)，不包括已标记删除的房间"""
+    last_id = None
+    while True:
+        query = db.session.query(ChatRoom.id, ChatRoom.agent_type, ChatRoom.created_at).filter(
+            ChatRoom.deleted_at.is_(None)
+        )
+        if room_ids is not None:
+            query = query.filter(ChatRoom.id.in_(room_ids))
+        if agent_type:
+            query = query.filter(ChatRoom.agent_type == agent_type)
+        if last_id is not None:
+            query = query.filter(ChatRoom.id > last_id)
+        rows = query.order_by(ChatRoom.id.asc()).limit(batch_size).all()
+        db.session.commit()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1].id
+
+
+def _ndjson_chunks(rooms: Iterable[tuple], batch_size: int, chunk_bytes: int) -> Iterator[bytes]:
+    """把房间和消息序列化为 NDJSON，攒够 chunk_bytes 后产出一块"""
+    buffer: List[bytes] = []
+    size = 0
+    for room_id, agent_type, created_at in rooms:
+        header = _room_header(room_id, agent_type, created_at)
+        for item in itertools.chain([header], _iter_room_messages(room_id, batch_size)):
+            line = (json.dumps(item, ensure_ascii=False) + '\n').encode('utf-8')
+            buffer.append(line)
+            size += len(line)
+            if size >= chunk_bytes:
+                yield b''.join(buffer)
+                buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _gzip_chunks(chunks: Iterable[bytes], level: int) -> Iterator[bytes]:
+    """增量 gzip 压缩"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _wants_gzip() -> bool:
+    return request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+
+def _stream_export(rooms: Iterable[tuple], filename: str) -> Response:
+    settings = current_app.config
+    chunks = _ndjson_chunks(rooms, max(1, settings['EXPORT_BATCH_SIZE']), settings['EXPORT_CHUNK_BYTES'])
+    if _wants_gzip():
+        chunks = _gzip_chunks(chunks, settings['EXPORT_GZIP_LEVEL'])
+        filename += '.gz'
+        mimetype = GZIP_MIMETYPE
+    else:
+        mimetype = NDJSON_MIMETYPE
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def export_room(room_id):
+    """流式导出一个房间的聊天记录
+
+    查询参数：
+        gzip: 为 1 / true 时输出 gzip 压缩的 NDJSON
+    """
+    room = db.session.query(ChatRoom.id, ChatRoom.agent_type, ChatRoom.created_at).filter(
+        ChatRoom.id == room_id, ChatRoom.deleted_at.is_(None)
+    ).first()
+    if room is None:
+        abort(404)
+    return _stream_export([tuple(room)], f'room-{room_id}.ndjson')
+
+
+def export_rooms():
+    """流式导出多个房间的聊天记录
+
+    查询参数：
+        rooms: 房间 id，多个用逗号分隔；不指定时导出全部房间
+        agent_type: 只导出该 agent 类型的房间
+        gzip: 为 1 / true 时输出 gzip 压缩的 NDJSON
+    """
+    room_ids = request.args.get('rooms')
+    room_ids = [room_id for room_id in room_ids.split(',') if room_id] if room_ids else None
+    rooms = _iter_rooms(room_ids, request.args.get('agent_type'), max(1, current_app.config['EXPORT_BATCH_SIZE']))
+    return _stream_export(rooms, 'rooms.ndjson')
+
+
+def _iter_request_chunks(stream) -> Iterator[bytes]:
+    """分块读取请求体，首块以 gzip 魔数开头时边读边解压，每次解压输出不超过 READ_CHUNK_BYTES"""
+    decompressor = None
+    first = True
+    while True:
+        chunk = stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        if first:
+            first = False
+            if chunk.startswith(GZIP_MAGIC):
+                decompressor = zlib.decompressobj(31)
+        if decompressor is None:
+            yield chunk
+            continue
+        while True:
+            data = decompressor.decompress(chunk, READ_CHUNK_BYTES)
+            if data:
+                yield data
+            chunk = decompressor.unconsumed_tail
+            # 输出达到上限时解压器中可能还有数据，继续取出
+            if not chunk and len(data) < READ_CHUNK_BYTES:
+                break
+    if decompressor is not None:
+        data = decompressor.flush()
+        if data:
+            yield data
+
+
+def _iter_request_lines(stream, max_line_bytes: int, max_bytes: int) -> Iterator[bytes]:
+    """
+    逐行读取请求体
+
+    未结束的行以分片列表保存，不重复拼接。单行超过 max_line_bytes
+    或解压后的总大小超过 max_bytes（0 表示不限制）时抛出 TranscriptError。
+    """
+    pieces: List[bytes] = []  # 当前行已读到的部分
+    pending = 0
+    total = 0
+    for chunk in _iter_request_chunks(stream):
+        total += len(chunk)
+        if max_bytes and total > max_bytes:
+            raise TranscriptError(f'导入数据超过 {max_bytes} 字节')
+        start = 0
+        while True:
+            end = chunk.find(b'\n', start)
+            if end < 0:
+                break
+            pending += end - start
+            if pending > max_line_bytes:
+                raise TranscriptError(f'单行超过 {max_line_bytes} 字节')
+            if pieces:
+                pieces.append(chunk[start:end])
+                yield b''.join(pieces)
+                pieces = []
+            else:
+                yield chunk[start:end]
+            pending = 0
+            start = end + 1
+        if start < len(chunk):
+            pending += len(chunk) - start
+            if pending > max_line_bytes:
+                raise TranscriptError(f'单行超过 {max_line_bytes} 字节')
+            pieces.append(chunk[start:])
+    if pieces:
+        yield b''.join(pieces)
+
+
+class _Importer:
+    """按批写入导入的消息
+
+    room_id 不为空时所有消息写入该房间，数据中的房间信息只用于判断消息的来源房间：
+    来源是其他房间的消息按目标房间重新生成 id（消息 id 是全局主键，原 id 已被来源房间占用）。
+    否则按房间信息行和消息的 room_id 写入，不存在的房间按房间信息行创建。
+    消息 id 已属于其他房间时抛出 TranscriptConflict，不会当作已导入跳过。
+    """
+
+    def __init__(self, room_id: Optional[str], batch_size: int):
+        self.room_id = room_id
+        self.batch_size = max(1, batch_size)
+        self.current_room: Optional[str] = None
+        # 已确认存在的房间 -> 归档末尾的 (timestamp, id)
+        self.rooms: Dict[str, Optional[Tuple[datetime, str]]] = {}
+        self.batch: List[dict] = []
+
+        self.lines = 0
+        self.imported = 0
+        self.skipped = 0
+        self.rooms_created = 0
+
+    def _known_room(self, room_id: str) -> bool:
+        if room_id in self.rooms:
+            return True
+        exists = db.session.query(ChatRoom.id).filter(
+            ChatRoom.id == room_id, ChatRoom.deleted_at.is_(None)
+        ).first() is not None
+        if exists:
+            self.rooms[room_id] = message_archive.last_key(room_id)
+        return exists
+
+    def add_room(self, data: dict) -> None:
+        if self.room_id is not None:
+            # 只记录来源房间，消息都写入目标房间
+            source = data.get('id')
+            self.current_room = source if _is_uuid(source) else None
+            return
+        room_id = data.get('id')
+        if not isinstance(room_id, str) or not room_id:
+            raise TranscriptError('房间信息缺少 id')
+        if not _is_uuid(room_id):
+            raise TranscriptError(f'无效的房间 id: {room_id}')
+        self.current_room = room_id
+        if self._known_room(room_id):
+            return
+        if db.session.get(ChatRoom, room_id) is not None:
+            raise TranscriptError(f'房间 {room_id} 正在删除')
+
+        agent_type = data.get('agent_type')
+        if not agent_registry.is_declared(agent_type):
+            raise TranscriptError(f'不支持的 agent 类型: {agent_type}')
+        agent_registry.get_class(agent_type)
+        agent = Agent.query.filter_by(type=agent_type).first()
+        if agent is None:
+            raise TranscriptError(f'不支持的 agent 类型: {agent_type}')
+        created_at = data.get('created_at')
+        db.session.add(ChatRoom(
+            id=room_id,
+            agent_type=agent_type,
+            agent_id=agent.id,
+            created_at=datetime.fromisoformat(created_at) if created_at else datetime.utcnow()
+        ))
+        db.session.commit()
+        self.rooms[room_id] = None
+        self.rooms_created += 1
+
+    def add_message(self, data: dict) -> None:
+        missing = [field for field in REQUIRED_FIELDS if not isinstance(data.get(field), str)]
+        if missing:
+            raise TranscriptError(f'消息缺少字段: {", ".join(missing)}')
+        if not _is_uuid(data['id']):
+            raise TranscriptError(f'无效的消息 id: {data["id"]}')
+        source = data.get('room_id') or self.current_room
+        room_id = self.room_id or source
+        if room_id and not _is_uuid(room_id):
+            raise TranscriptError(f'无效的房间 id: {room_id}')
+        if not room_id or not self._known_room(room_id):
+            raise TranscriptError(f'房间 {room_id} 不存在')
+        timestamp = datetime.fromisoformat(data['timestamp'])
+        msg_id = data['id']
+        if self.room_id is not None and source and source != self.room_id:
+            # 导入到其他房间：按目标房间生成确定的新 id，同一份导出重复导入时仍会被识别为已存在
+            msg_id = str(uuid.uuid5(uuid.UUID(self.room_id), msg_id))
+
+        # 归档中的消息都早于数据库中的消息，早于归档末尾的消息无法再插入（通常是已归档的消息）
+        archived_until = self.rooms[room_id]
+        if archived_until is not None and (timestamp, msg_id) <= archived_until:
+            self.skipped += 1
+            return
+
+        self.batch.append({
+            'id': msg_id,
+            'room_id': room_id,
+            'type': data['type'],
+            'content': data['content'],
+            'role': data['role'],
+            'timestamp': timestamp,
+            'stop_reason': data.get('stop_reason')
+        })
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """写入当前批次，跳过同一房间中已存在的消息 id；id 属于其他房间时抛出 TranscriptConflict"""
+        if not self.batch:
+            return
+        rows, self.batch = self.batch, []
+        existing = dict(db.session.query(ChatMessage.id, ChatMessage.room_id).filter(
+            ChatMessage.id.in_([row['id'] for row in rows])
+        ).all())
+        new_rows = []
+        for row in rows:
+            owner = existing.get(row['id'])
+            if owner is not None and owner != row['room_id']:
+                raise TranscriptConflict(f'消息 {row["id"]} 已属于房间 {owner}')
+            if owner is not None:
+                continue
+            existing[row['id']] = row['room_id']
+            new_rows.append(row)
+        if new_rows:
+            db.session.execute(ChatMessage.__table__.insert(), new_rows)
+        db.session.commit()
+        self.imported += len(new_rows)
+        self.skipped += len(rows) - len(new_rows)
+
+    def feed(self, lines: Iterable[bytes]) -> None:
+        lines = iter(lines)
+        while True:
+            try:
+                line = next(lines)
+            except StopIteration:
+                break
+            except TranscriptError as e:
+                # 读取时超过长度限制，之前的消息照常写入
+                self._flush_before_error()
+                raise TranscriptError(f'第 {self.lines + 1} 行: {e}') from e
+            self.lines += 1
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+                if not isinstance(data, dict):
+                    raise TranscriptError('每行必须是 JSON 对象')
+                if 'room' in data:
+                    self.add_room(data['room'] if isinstance(data['room'], dict) else {})
+                else:
+                    self.add_message(data)
+            except TranscriptConflict as e:
+                self._flush_before_error()
+                raise TranscriptConflict(f'第 {self.lines} 行: {e}') from e
+            except (ValueError, TypeError) as e:
+                self._flush_before_error()
+                raise TranscriptError(f'第 {self.lines} 行: {e}') from e
+        self.flush()
+
+    def _flush_before_error(self) -> None:
+        """出错行之前的消息照常写入；批次中有冲突的 id 时整批放弃"""
+        db.session.rollback()
+        try:
+            self.flush()
+        except TranscriptConflict:
+            db.session.rollback()
+
+    def result(self) -> dict:
+        return {
+            'lines': self.lines,
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'rooms_created': self.rooms_created
+        }
+
+
+def _run_import(room_id: Optional[str]):
+    importer = _Importer(room_id, current_app.config['IMPORT_BATCH_SIZE'])
+    lines = _iter_request_lines(request.stream, current_app.config['IMPORT_MAX_LINE_BYTES'],
+                                current_app.config['IMPORT_MAX_BYTES'])
+    try:
+        importer.feed(lines)
+    except TranscriptConflict as e:
+        return jsonify(dict(importer.result(), error=str(e))), 409
+    except TranscriptError as e:
+        return jsonify(dict(importer.result(), error=str(e))), 400
+    return jsonify(importer.result())
+
+
+def import_room(room_id):
+    """流式导入聊天记录到指定房间（NDJSON，可 gzip 压缩）
+
+    数据来自其他房间的导出时消息 id 按目标房间重新生成，房间信息行不会创建房间。
+    """
+    if db.session.query(ChatRoom.id).filter(ChatRoom.id == room_id, ChatRoom.deleted_at.is_(None)).first() is None:
+        abort(404)
+    return _run_import(room_id)
+
+
+def import_rooms():
+    """流式导入多个房间的聊天记录，房间不存在时按房间信息行创建"""
+    return _run_import(None)
+
+
+def init_routes(bp):
+    """注册聊天记录导出和导入路由"""
+    bp.add_url_rule('/chat/rooms/<room_id>/export', 'export_room', export_room, methods=['GET'])
+    bp.add_url_rule('/chat/rooms/<room_id>/import', 'import_room', import_room, methods=['POST'])
+    bp.add_url_rule('/chat/export', 'export_rooms', export_rooms, methods=['GET'])
+    bp.add_url_rule('/chat/import', 'import_rooms', import_rooms, methods=['POST'])
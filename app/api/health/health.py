@@ -1,4 +1,12 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, Response, jsonify, request
+from app.models import chat_room_manager, room_cache
+from app.models.agents import agent_registry
+from app.api.room.room import get_scheduler
+from app.core.metrics import metrics
+from app.core.response_cache import response_cache
+from app.core.env_cache import environment_cache
+from app.core.replay import replay_buffer
+from app.core.retention import retention_manager
 
 def health_check():
     return jsonify({
@@ -6,6 +14,84 @@ def health_check():
         'message': '服务正常运行'
     })
 
+def _queue_depth_by_type() -> dict:
+    agent_scheduler = get_scheduler()
+    if agent_scheduler is None:
+        return {}
+    return {(agent_type,): depth for agent_type, depth in agent_scheduler.stats()['queued_by_type'].items()}
+
+def _connections_by_room() -> dict:
+    return {(room_id,): count for room_id, count in chat_room_manager.connection_counts().items()}
+
+# 采集时计算的指标
+metrics.gauge('agent_queue_depth', '调度器中排队的 agent 任务数', ['agent_type'], callback=_queue_depth_by_type)
+metrics.gauge('room_open_connections', '房间当前打开的 WebSocket 连接数', ['room_id'], callback=_connections_by_room)
+metrics.gauge('room_memory_chars', '房间环境记忆中的字符数', ['room_id'],
+              callback=lambda: {(room_id,): usage['chars'] for room_id, usage in environment_cache.memory_usage().items()})
+
+def metrics_endpoint():
+    """流式管道的直方图和计数器，format=prometheus 时输出 Prometheus 文本格式"""
+    if request.args.get('format') == 'prometheus':
+        return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+    return jsonify(metrics.snapshot())
+
+def connection_stats():
+    """各房间 WebSocket 连接的发送队列统计"""
+    return jsonify(chat_room_manager.stats())
+
+def broker_stats():
+    """房间消息广播后端的状态"""
+    return jsonify(chat_room_manager.broker.stats())
+
+def cache_stats():
+    """agent 回复缓存的命中、未命中和淘汰统计"""
+    return jsonify(response_cache.stats())
+
+def memory_stats():
+    """各房间 MetaGPT 环境的记忆占用和压缩统计"""
+    return jsonify({
+        'cache': environment_cache.stats(),
+        'rooms': environment_cache.memory_usage()
+    })
+
+def room_cache_stats():
+    """房间 -> agent 解析缓存的命中和失效统计"""
+    return jsonify(room_cache.stats())
+
+def replay_stats():
+    """流式回复重放缓冲区的占用和续传统计"""
+    return jsonify(replay_buffer.stats())
+
+def retention_stats():
+    """消息保留策略、清理和归档统计，以及房间删除任务"""
+    return jsonify(retention_manager.stats())
+
+def agent_stats():
+    """agent 注册表：已声明和已导入的类型及导入耗时，以及已导入类型的运行状态"""
+    report = agent_registry.report()
+    runtime = {}
+    for agent_type in report['loaded']:
+        runtime_stats = getattr(agent_registry.get_class(agent_type), 'runtime_stats', None)
+        if runtime_stats is not None:
+            runtime[agent_type] = runtime_stats()
+    report['runtime'] = runtime
+    return jsonify(report)
+
+def scheduler_stats():
+    """agent 调度器的排队和并发统计"""
+    agent_scheduler = get_scheduler()
+    return jsonify(agent_scheduler.stats() if agent_scheduler else {})
+
 def init_routes(bp):
     """注册健康检查路由"""
     bp.add_url_rule('/health', 'health_check', health_check, methods=['GET'])
+    bp.add_url_rule('/metrics', 'metrics', metrics_endpoint, methods=['GET'])
+    bp.add_url_rule('/health/connections', 'connection_stats', connection_stats, methods=['GET'])
+    bp.add_url_rule('/health/scheduler', 'scheduler_stats', scheduler_stats, methods=['GET'])
+    bp.add_url_rule('/health/broker', 'broker_stats', broker_stats, methods=['GET'])
+    bp.add_url_rule('/health/cache', 'cache_stats', cache_stats, methods=['GET'])
+    bp.add_url_rule('/health/agents', 'agent_stats', agent_stats, methods=['GET'])
+    bp.add_url_rule('/health/memory', 'memory_stats', memory_stats, methods=['GET'])
+    bp.add_url_rule('/health/replay', 'replay_stats', replay_stats, methods=['GET'])
+    bp.add_url_rule('/health/rooms', 'room_cache_stats', room_cache_stats, methods=['GET'])
+    bp.add_url_rule('/health/retention', 'retention_stats', retention_stats, methods=['GET'])
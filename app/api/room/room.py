@@ -1,49 +1,72 @@
 import logging
 from flask_sock import Sock
-from app.models import ChatRoom, ChatMessage, Agent, chat_room_manager, db
+from app.models import Agent, chat_room_manager, db, room_cache
+from app.core.runtime import get_agent_runtime
+from app.core.cancellation import CANCEL_CLIENT, CANCEL_DISCONNECT, CancelToken
+from app.core.stream import StreamEvent, StreamEventType, coalesce_stream
+from app.core.env_cache import environment_cache
+from app.core.response_cache import response_cache
+from app.core.metrics import (
+    AGENT_CANCELLATIONS,
+    AGENT_RESPONSE_DURATION,
+    AGENT_TIME_TO_FIRST_CHUNK,
+    RESPONSE_BYTES,
+    RESPONSE_CHUNKS
+)
+from app.core.message_writer import message_writer, create_message
+from app.core.retention import retention_manager
+from app.core.protocol import negotiate_protocol, hello_frame
+from app.core.replay import MIN_ID_PREFIX, parse_last_seen, replay_buffer
+from app.core.scheduler import AgentScheduler, SchedulerRejected
 from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+import functools
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import json
 from uuid import uuid4
 import time
 import threading
-from concurrent.futures import ThreadPoolExecutor
-from queue import Queue
-from flask import current_app
+from flask import current_app, request
+from config.settings import config
 import atexit
 import signal
 
 logger = logging.getLogger(__name__)
 
 sock = Sock()
-# 创建线程池和状态标志
-thread_pool = None
-thread_pool_lock = threading.Lock()
+# 创建调度器和状态标志
+scheduler = None
+scheduler_lock = threading.Lock()
 is_shutting_down = threading.Event()
 
-def get_thread_pool():
-    """获取线程池实例，如果不存在则创建"""
-    global thread_pool
+def get_scheduler():
+    """获取 agent 调度器实例，如果不存在则创建"""
+    global scheduler
     if is_shutting_down.is_set():
         return None
 
-    with thread_pool_lock:
-        if thread_pool is None and not is_shutting_down.is_set():
-            thread_pool = ThreadPoolExecutor(max_workers=10, thread_name_prefix="agent_worker")
-        return thread_pool
+    with scheduler_lock:
+        if scheduler is None and not is_shutting_down.is_set():
+            scheduler = AgentScheduler(
+                max_workers=config.MAX_AGENTS,
+                max_queue=config.SCHEDULER_MAX_QUEUE,
+                type_limits=config.AGENT_CONCURRENCY
+            )
+        return scheduler
 
-def shutdown_thread_pool():
-    """关闭线程池"""
-    global thread_pool
+def shutdown_scheduler():
+    """关闭调度器"""
+    global scheduler
     if is_shutting_down.is_set():
         return
 
     is_shutting_down.set()  # 设置关闭标志
-    with thread_pool_lock:
-        if thread_pool is not None:
-            logger.info("正在关闭线程池...")
+    with scheduler_lock:
+        if scheduler is not None:
+            logger.info("正在关闭调度器...")
             try:
                 # 通知所有房间服务器正在关闭
-                for room_id in chat_room_manager.rooms:
+                for room_id in list(chat_room_manager.room_connections):
                     try:
                         shutdown_msg = {
                             'type': 'system',
@@ -56,48 +79,41 @@ def shutdown_thread_pool():
                         logger.error(f"发送关闭通知到房间 {room_id} 失败: {e}")
 
                 # 等待现有任务完成
-                thread_pool.shutdown(wait=True, cancel_futures=True)
-                thread_pool = None
-                logger.info("线程池已关闭")
+                scheduler.shutdown(wait=True, cancel_futures=True)
+                scheduler = None
+                logger.info("调度器已关闭")
             except Exception as e:
-                logger.error(f"关闭线程池时出错: {e}")
+                logger.error(f"关闭调度器时出错: {e}")
+
+    # 停止 agent 共享事件循环和环境构建线程
+    get_agent_runtime().shutdown()
+    environment_cache.shutdown()
+
+    # 最后写入所有排队中的消息
+    message_writer.shutdown()
+
+    # 停止消息清理和房间删除，未完成的删除在下次启动时继续
+    retention_manager.shutdown()
+
+    # 断开消息广播后端
+    chat_room_manager.broker.close()
 
 # 注册信号处理
 def signal_handler(signum, frame):
     """处理进程信号"""
     logger.info(f"收到信号 {signum}，开始关闭服务...")
-    shutdown_thread_pool()
+    shutdown_scheduler()
 
 signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
 # 注册应用退出时的清理函数
-atexit.register(shutdown_thread_pool)
-
-def create_message(room_id: str, msg_id: str, msg_type: str, content: str, role: str) -> dict:
-    """创建标准格式的消息"""
-    message = ChatMessage(
-        id=msg_id,
-        room_id=room_id,
-        type=msg_type,
-        content=content,
-        role=role,
-        timestamp=datetime.utcnow()
-    )
-    db.session.add(message)
-    db.session.commit()
-
-    return {
-        'id': message.id,
-        'type': msg_type,
-        'content': content,
-        'role': role,
-        'timestamp': message.timestamp.isoformat()
-    }
+atexit.register(shutdown_scheduler)
 
-def create_stream_message(msg_id: str, msg_type: str, content: str, role: str, is_end: bool = False, is_thinking: bool = False) -> dict:
-    """创建流式消息格式"""
-    return {
+def create_stream_message(msg_id: str, msg_type: str, content: str, role: str, is_end: bool = False, is_thinking: bool = False, seq: int = 0,
+                          stop_reason: Optional[str] = None) -> dict:
+    """创建流式消息格式，seq 为该流内的帧序号；stop_reason 标记被截断的回复（只用于结束帧）"""
+    message = {
         'id': msg_id,
         'type': msg_type,
         'content': content,
@@ -105,15 +121,179 @@ def create_stream_message(msg_id: str, msg_type: str, content: str, role: str, i
         'timestamp': datetime.utcnow().isoformat(),
         'is_stream': True,
         'is_end': is_end,
-        'is_thinking': is_thinking
+        'is_thinking': is_thinking,
+        'seq': seq
     }
+    if stop_reason:
+        message['truncated'] = True
+        message['stop_reason'] = stop_reason
+    return message
+
+def agent_event_stream(agent: Agent, message_content: str, room_id: str, bypass_cache: bool = False):
+    """agent 的异步事件流（经过回复缓存），开启合并窗口时合并细碎的分片"""
+    transform = None
+    if config.STREAM_COALESCE_WINDOW > 0:
+        transform = functools.partial(
+            coalesce_stream,
+            window=config.STREAM_COALESCE_WINDOW,
+            max_bytes=config.STREAM_COALESCE_MAX_BYTES
+        )
+    return agent.acached_response_stream(
+        message_content,
+        room_id=room_id,
+        bypass_cache=bypass_cache,
+        transform=transform
+    )
+
+def iter_agent_stream(agent: Agent, message_content: str, room_id: str, bypass_cache: bool = False,
+                      cancel_token: Optional[CancelToken] = None):
+    """同步迭代 agent 的流式回复
+
+    需要合并分片、使用回复缓存或支持取消时在共享事件循环上处理，
+    令牌被取消后迭代提前结束，只产出取消前的部分结果。
+    """
+    if cancel_token is None and config.STREAM_COALESCE_WINDOW <= 0 and not response_cache.enabled_for(agent.type):
+        return agent.generate_response_stream(message_content, room_id=room_id)
+    return get_agent_runtime().iterate(
+        agent_event_stream(agent, message_content, room_id, bypass_cache=bypass_cache),
+        key=room_id,
+        cancel_token=cancel_token
+    )
 
-def process_agent_response(app, room_id: str, agent: Agent, message_content: str, msg_id: str):
-    """在线程池中处理 agent 响应"""
+class ResponseStream:
+    """一次 agent 回复的流式状态：帧序号、累积的结果内容和耗时统计
+
+    广播的帧同时记录到重放缓冲区，断线重连的客户端可以从最后收到的帧续传。
+    """
+
+    def __init__(self, room_id: str, msg_id: str, agent_type: str = ''):
+        self.room_id = room_id
+        self.msg_id = msg_id
+        self.agent_type = agent_type
+        self.replay = replay_buffer.open(room_id, msg_id)
+        self._send = functools.partial(chat_room_manager.broadcast_to_room, room_id)
+        self.seq = 0
+        self.full_response = []
+        self.bytes = 0
+        self.started_at = time.perf_counter()
+
+    def publish(self, chunk) -> bool:
+        """处理 agent 产出的一个分片并广播，遇到结束事件时返回 False"""
+        if not isinstance(chunk, StreamEvent):
+            # 普通字符串按结果内容处理
+            chunk = StreamEvent.result(str(chunk))
+
+        # 根据事件类型处理
+        if chunk.type == StreamEventType.END:
+            return False
+        if chunk.type == StreamEventType.ERROR:
+            raise RuntimeError(chunk.content)
+
+        if chunk.type == StreamEventType.RESULT:
+            # 只将结果消息添加到最终响应
+            self.full_response.append(chunk.content)
+
+        # 开始消息和思考过程消息标记为 is_thinking
+        stream_msg = create_stream_message(
+            msg_id=self.msg_id,
+            msg_type='response',
+            content=chunk.content,
+            role='assistant',
+            is_end=False,
+            is_thinking=chunk.type in (StreamEventType.START, StreamEventType.THINKING),
+            seq=self.seq
+        )
+        if self.seq == 0:
+            AGENT_TIME_TO_FIRST_CHUNK.observe(time.perf_counter() - self.started_at, self.agent_type)
+        self.seq += 1
+        self.bytes += len(chunk.content.encode('utf-8'))
+        self.broadcast(stream_msg)
+        return True
+
+    def broadcast(self, message: dict) -> None:
+        """记录到重放缓冲区并广播给房间"""
+        self.replay.publish(message, self._send)
+
+    def finish(self, stop_reason: Optional[str] = None) -> str:
+        """发送流式响应结束标记，返回完整的回复内容；stop_reason 不为空时标记为被截断"""
+        final_content = ''.join(self.full_response)
+        end_msg = create_stream_message(
+            msg_id=self.msg_id,
+            msg_type='response',
+            content=final_content,
+            role='assistant',
+            is_end=True,
+            is_thinking=False,
+            seq=self.seq,
+            stop_reason=stop_reason
+        )
+        self.broadcast(end_msg)
+        if stop_reason:
+            AGENT_CANCELLATIONS.inc(self.agent_type, stop_reason)
+
+        AGENT_RESPONSE_DURATION.observe(time.perf_counter() - self.started_at, self.agent_type)
+        RESPONSE_CHUNKS.observe(self.seq, self.agent_type)
+        RESPONSE_BYTES.observe(self.bytes, self.agent_type)
+        return final_content
+
+# 本进程中正在运行的回复：回复 id -> (房间 id, 取消令牌)，续传的连接据此接管回复
+active_runs: Dict[str, Tuple[str, CancelToken]] = {}
+
+def adopt_runs(runs: Dict[str, CancelToken], room_id: str, msg_id: str) -> None:
+    """续传时接管房间内仍在运行的回复，重连后的客户端可以取消它，断开时也按它的连接处理"""
+    if len(msg_id) < MIN_ID_PREFIX:
+        return
+    for run_id, (run_room_id, token) in list(active_runs.items()):
+        if run_room_id == room_id and run_id.startswith(msg_id):
+            runs[run_id] = token
+
+def cancel_abandoned_runs(room_id: str, runs: Dict[str, CancelToken],
+                          call_later: Optional[Callable[[float, Callable[[], None]], Any]] = None) -> None:
+    """连接断开后，房间内没有其他连接时取消该连接发起的运行
+
+    等待 RESUME_GRACE 秒再检查：期间有客户端重新连入房间时不取消，重连的客户端续传回复。
+    call_later 为空时用定时器线程等待。
+    """
+    runs = dict(runs)
+    if not runs or chat_room_manager.get_connections(room_id):
+        return
+
+    def check():
+        if not chat_room_manager.get_connections(room_id):
+            cancel_runs(runs, None, CANCEL_DISCONNECT)
+
+    if config.RESUME_GRACE <= 0:
+        check()
+    elif call_later is not None:
+        call_later(config.RESUME_GRACE, check)
+    else:
+        timer = threading.Timer(config.RESUME_GRACE, check)
+        timer.daemon = True
+        timer.start()
+
+def cancel_runs(runs: Dict[str, CancelToken], msg_id: Optional[str], reason: str) -> int:
+    """取消连接发起的运行，msg_id 为空时取消全部（支持增量协议中的短 id），返回取消的数量"""
+    cancelled = 0
+    for run_id, token in list(runs.items()):
+        if msg_id and not run_id.startswith(msg_id):
+            continue
+        if token.cancel(reason):
+            cancelled += 1
+    return cancelled
+
+def process_agent_response(app, room_id: str, agent: Agent, message_content: str, msg_id: str,
+                           bypass_cache: bool = False, cancel_token: Optional[CancelToken] = None):
+    """在调度器的工作线程中处理 agent 响应
+
+    cancel_token 被取消或运行超过 AGENT_TIMEOUT 时，agent 协程被取消，
+    已生成的部分作为回复保存并标记截断原因。
+    """
+    if cancel_token is None:
+        cancel_token = CancelToken()
+    cancel_token.set_timeout(config.AGENT_TIMEOUT)
+    response = None
     with app.app_context():
         try:
-            full_response = []
-
             # 创建并保存用户消息
             user_message = create_message(
                 room_id=room_id,
@@ -125,91 +305,23 @@ def process_agent_response(app, room_id: str, agent: Agent, message_content: str
             # 广播用户消息给所有客户端
             chat_room_manager.broadcast_to_room(room_id, user_message)
 
-            # 使用流式生成回复
-            for chunk in agent.generate_response_stream(message_content):
-                try:
-                    # 解析 JSON 消息
-                    msg_data = json.loads(chunk)
-                    msg_type = msg_data.get('type', '')
-                    msg_content = msg_data.get('content', '')
-
-                    # 根据消息类型处理
-                    if msg_type == 'thinking':
-                        # 思考过程消息
-                        stream_msg = create_stream_message(
-                            msg_id=msg_id,
-                            msg_type='response',
-                            content=msg_content,
-                            role='assistant',
-                            is_end=False,
-                            is_thinking=True
-                        )
-                    elif msg_type == 'result':
-                        # 最终结果消息
-                        stream_msg = create_stream_message(
-                            msg_id=msg_id,
-                            msg_type='response',
-                            content=msg_content,
-                            role='assistant',
-                            is_end=False,
-                            is_thinking=False
-                        )
-                        # 只将结果消息添加到最终响应
-                        full_response.append(msg_content)
-                    elif msg_type == 'start':
-                        # 开始消息
-                        stream_msg = create_stream_message(
-                            msg_id=msg_id,
-                            msg_type='response',
-                            content=msg_content,
-                            role='assistant',
-                            is_end=False,
-                            is_thinking=True
-                        )
-                    else:
-                        # 未知类型消息，保持原样发送
-                        stream_msg = create_stream_message(
-                            msg_id=msg_id,
-                            msg_type='response',
-                            content=chunk,
-                            role='assistant',
-                            is_end=False,
-                            is_thinking=False
-                        )
+            # 使用流式生成回复，agent 产出字符串或类型化的 StreamEvent
+            response = ResponseStream(room_id, msg_id, agent.type)
+            for chunk in iter_agent_stream(agent, message_content, room_id, bypass_cache=bypass_cache,
+                                           cancel_token=cancel_token):
+                if not response.publish(chunk):
+                    break
+            stop_reason = cancel_token.complete()
+            final_content = response.finish(stop_reason)
 
-                    chat_room_manager.broadcast_to_room(room_id, stream_msg)
-                except json.JSONDecodeError:
-                    # 如果不是 JSON 格式，按普通消息处理
-                    stream_msg = create_stream_message(
-                        msg_id=msg_id,
-                        msg_type='response',
-                        content=chunk,
-                        role='assistant',
-                        is_end=False,
-                        is_thinking=False
-                    )
-                    full_response.append(chunk)
-                    chat_room_manager.broadcast_to_room(room_id, stream_msg)
-
-            # 发送流式响应结束标记
-            final_content = ''.join(full_response)
-            end_msg = create_stream_message(
-                msg_id=msg_id,
-                msg_type='response',
-                content=final_content,
-                role='assistant',
-                is_end=True,
-                is_thinking=False
-            )
-            chat_room_manager.broadcast_to_room(room_id, end_msg)
-
-            # 保存完整的响应到数据库
+            # 保存响应到数据库，被取消的回复保存已生成的部分
             create_message(
                 msg_id=msg_id,
                 room_id=room_id,
                 msg_type='response',
                 content=final_content,
-                role='assistant'
+                role='assistant',
+                stop_reason=stop_reason
             )
         except Exception as e:
             logger.error(f"处理 agent 响应时出错: {e}")
@@ -220,15 +332,21 @@ def process_agent_response(app, room_id: str, agent: Agent, message_content: str
                 content=str(e),
                 role='system'
             )
-            chat_room_manager.broadcast_to_room(room_id, error_msg)
+            # 错误消息同样记录到重放缓冲区，续传的客户端能得知回复失败
+            if response is not None:
+                response.broadcast(error_msg)
+            else:
+                chat_room_manager.broadcast_to_room(room_id, error_msg)
         finally:
+            cancel_token.complete()
             # 清理数据库会话
             db.session.remove()
 
 @sock.route('/chat/<room_id>')
 def chat_socket(ws, room_id):
     """WebSocket 聊天处理"""
-    room = ChatRoom.query.get(room_id)
+    # 房间和 agent 从房间缓存解析，命中时不访问数据库
+    room = room_cache.get(room_id)
     if not room:
         ws.send(json.dumps({
             'type': 'error',
@@ -238,9 +356,23 @@ def chat_socket(ws, room_id):
         }))
         return
 
-    # 添加连接到房间
-    chat_room_manager.add_connection(room_id, ws)
+    # 协商传输协议：默认 JSON，客户端可通过 ?protocol=2 选择紧凑的增量协议
+    protocol = negotiate_protocol(request.args.get('protocol'))
+    # 断线重连时携带 ?last_seen={"msg_id": ..., "seq": ...}，补发之后错过的帧
+    last_seen = parse_last_seen(request.args.get('last_seen'))
+
+    # 添加连接到房间，之后对该连接的所有发送都经过其发送队列
+    connection = chat_room_manager.add_connection(
+        room_id,
+        ws,
+        protocol=protocol,
+        greeting=hello_frame(protocol),
+        last_seen=last_seen
+    )
     futures = []  # 存储所有提交的任务
+    runs: Dict[str, CancelToken] = {}  # 本连接发起的运行：回复 id -> 取消令牌
+    if last_seen:
+        adopt_runs(runs, room_id, last_seen[0])
 
     try:
         # 发送欢迎消息
@@ -251,7 +383,7 @@ def chat_socket(ws, room_id):
             content=f'欢迎加入聊天室 {room_id}',
             role='system'
         )
-        ws.send(json.dumps(welcome_msg))
+        connection.send(welcome_msg)
 
         while True:
             data = ws.receive()
@@ -260,80 +392,115 @@ def chat_socket(ws, room_id):
 
                 # 处理心跳消息
                 if message_data.get('type') == 'system' and message_data.get('content') == 'ping':
-                    ws.send(json.dumps({
+                    connection.send({
                         'type': 'system',
                         'content': 'pong',
                         'role': 'system',
                         'timestamp': datetime.utcnow().isoformat()
-                    }))
+                    })
                     logger.info(f"收到心跳消息 room_id: {room_id} : {message_data}")
                     continue
 
+                # 取消本连接发起的回复，可以用 id 指定某一个回复
+                if message_data.get('type') == 'cancel':
+                    cancel_runs(runs, message_data.get('id'), CANCEL_CLIENT)
+                    continue
+
                 if message_data.get('type') == 'message':
 
                     try:
-                        # 获取线程池实例
-                        pool = get_thread_pool()
-                        if pool is None or pool._shutdown:
-                            raise RuntimeError("服务器正在维护中")
-
-                        # 获取agent并在线程池中处理响应
-                        agent = Agent.query.get(room.agent_id)
+                        # 获取调度器实例
+                        agent_scheduler = get_scheduler()
+                        if agent_scheduler is None or agent_scheduler.is_shutdown:
+                            raise SchedulerRejected("服务器正在关闭，无法处理新消息")
+
+                        # 获取agent并交给调度器处理响应；房间已被删除时不再处理
+                        room = room_cache.get(room_id)
+                        if room is None:
+                            connection.send({
+                                'type': 'error',
+                                'content': '聊天室不存在',
+                                'role': 'system',
+                                'timestamp': datetime.utcnow().isoformat()
+                            })
+                            continue
+                        agent = room.agent
                         msg_id = str(uuid4())
 
-                        # 提交任务到线程池
-                        future = pool.submit(
+                        # 按房间和 agent 类型提交任务，取消令牌随任务传给 agent 协程
+                        token = CancelToken()
+                        future = agent_scheduler.submit(
+                            room_id,
+                            room.agent_type,
                             process_agent_response,
                             current_app._get_current_object(),
                             room_id,
                             agent,
                             message_data['content'],
-                            msg_id
+                            msg_id,
+                            bypass_cache=bool(message_data.get('bypass_cache')),
+                            cancel_token=token
                         )
+                        runs[msg_id] = token
+                        active_runs[msg_id] = (room_id, token)
+
+                        def forget_run(_future, msg_id=msg_id):
+                            runs.pop(msg_id, None)
+                            active_runs.pop(msg_id, None)
+
+                        future.add_done_callback(forget_run)
                         futures.append(future)
 
                         # 清理已完成的任务
                         futures = [f for f in futures if not f.done()]
-                    except RuntimeError as e:
+                    except SchedulerRejected as e:
                         logger.error(f"提交任务失败: {e}")
                         error_msg = create_message(
-                            msg_id=msg_id,
+                            msg_id=str(uuid4()),
                             room_id=room_id,
                             msg_type='error',
-                            content="服务器正在关闭，无法处理新消息",
+                            content=str(e),
                             role='system'
                         )
-                        ws.send(json.dumps(error_msg))
+                        connection.send(error_msg)
 
             except json.JSONDecodeError:
                 error_msg = create_message(
-                    msg_id=msg_id,
+                    msg_id=str(uuid4()),
                     room_id=room_id,
                     msg_type='error',
                     content='无效的消息格式',
                     role='system'
                 )
-                ws.send(json.dumps(error_msg))
+                connection.send(error_msg)
             except Exception as e:
                 error_msg = create_message(
-                    msg_id=msg_id,
+                    msg_id=str(uuid4()),
                     room_id=room_id,
                     msg_type='error',
                     content=str(e),
                     role='system'
                 )
-                ws.send(json.dumps(error_msg))
+                connection.send(error_msg)
 
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
     finally:
-        # 等待所有正在进行的任务完成
+        connection.close()
+        chat_room_manager.remove_connection(room_id, ws)
+        # 房间内没有其他连接、也没有客户端及时重连时，没有人再接收回复，取消本连接发起的运行
+        cancel_abandoned_runs(room_id, runs)
+        # 等待所有正在进行的任务完成（已取消的任务会很快保存部分回复并结束）
         for future in futures:
+            if future.cancelled():
+                continue
             try:
                 future.result(timeout=1)  # 等待任务完成，最多等待1秒
+            except FutureTimeoutError:
+                # 回复仍在运行，等待客户端重连续传
+                pass
             except Exception as e:
                 logger.error(f"等待任务完成时出错: {e}")
-        chat_room_manager.remove_connection(room_id, ws)
 
 def init_app(app):
     """初始化 WebSocket"""
@@ -0,0 +1,319 @@
+"""
+ASGI 服务入口
+
+REST 接口沿用 Flask 路由（以 WSGI 方式挂载），`/chat/<room_id>` WebSocket 由原生协程处理：
+接收和发送都是异步的，agent 的流式回复作为异步迭代器消费，
+空闲连接只占用一个协程而不是一个线程。
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Optional
+from uuid import uuid4
+
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from a2wsgi import WSGIMiddleware
+
+from app import create_app
+from app.api.room.room import (
+    ResponseStream,
+    active_runs,
+    adopt_runs,
+    agent_event_stream,
+    cancel_abandoned_runs,
+    cancel_runs,
+    shutdown_scheduler
+)
+from app.core.cancellation import CANCEL_CLIENT, CancelToken
+from app.core.message_writer import create_message
+from app.core.metrics import metrics
+from app.core.protocol import hello_frame, negotiate_protocol
+from app.core.replay import parse_last_seen
+from app.core.runtime import get_agent_runtime
+from app.core.scheduler import AsyncAgentGate, SchedulerRejected
+from app.models import Agent, chat_room_manager, db, room_cache
+from app.models.chat import AsyncRoomConnection
+from app.models.room_cache import CachedRoom
+from config.settings import config
+
+logger = logging.getLogger(__name__)
+
+
+async def run_in_app_context(flask_app, fn, *args, **kwargs):
+    """在线程中带 Flask 应用上下文执行阻塞的数据库操作"""
+    def call():
+        with flask_app.app_context():
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                db.session.remove()
+
+    return await asyncio.to_thread(call)
+
+
+async def resolve_room(flask_app, room_id: str) -> Optional[CachedRoom]:
+    """从房间缓存解析房间和 agent，命中时不切换线程也不访问数据库"""
+    room = room_cache.peek(room_id)
+    if room is None:
+        room = await run_in_app_context(flask_app, room_cache.get, room_id)
+    return room
+
+
+async def process_agent_response_async(flask_app, room_id: str, agent: Agent, message_content: str, msg_id: str,
+                                       bypass_cache: bool = False, cancel_token: Optional[CancelToken] = None):
+    """在事件循环中处理 agent 响应，agent 的流式回复作为异步迭代器消费
+
+    cancel_token 被取消或运行超过 AGENT_TIMEOUT 时保存已生成的部分并标记截断原因。
+    """
+    if cancel_token is None:
+        cancel_token = CancelToken()
+    cancel_token.set_timeout(config.AGENT_TIMEOUT)
+    response = None
+    try:
+        # 创建并保存用户消息
+        user_message = await run_in_app_context(
+            flask_app,
+            create_message,
+            room_id=room_id,
+            msg_type='message',
+            msg_id=str(uuid4()),
+            content=message_content,
+            role='user'
+        )
+        # 广播用户消息给所有客户端
+        chat_room_manager.broadcast_to_room(room_id, user_message)
+
+        response = ResponseStream(room_id, msg_id, agent.type)
+        stream = agent_event_stream(agent, message_content, room_id, bypass_cache=bypass_cache)
+        async for chunk in get_agent_runtime().aiterate(stream, key=room_id, cancel_token=cancel_token):
+            if not response.publish(chunk):
+                break
+        stop_reason = cancel_token.complete()
+        final_content = response.finish(stop_reason)
+
+        # 保存响应到数据库，被取消的回复保存已生成的部分
+        await run_in_app_context(
+            flask_app,
+            create_message,
+            msg_id=msg_id,
+            room_id=room_id,
+            msg_type='response',
+            content=final_content,
+            role='assistant',
+            stop_reason=stop_reason
+        )
+    except Exception as e:
+        logger.error(f"处理 agent 响应时出错: {e}")
+        error_msg = await run_in_app_context(
+            flask_app,
+            create_message,
+            msg_id=msg_id,
+            room_id=room_id,
+            msg_type='error',
+            content=str(e),
+            role='system'
+        )
+        if response is not None:
+            response.broadcast(error_msg)
+        else:
+            chat_room_manager.broadcast_to_room(room_id, error_msg)
+
+
+def create_asgi_app(flask_app=None) -> FastAPI:
+    """创建 ASGI 应用"""
+    if flask_app is None:
+        flask_app = create_app()
+
+    gate = AsyncAgentGate(
+        max_workers=config.MAX_AGENTS,
+        max_queue=config.SCHEDULER_MAX_QUEUE,
+        type_limits=config.AGENT_CONCURRENCY
+    )
+
+    metrics.gauge(
+        'agent_gate_queue_depth',
+        'ASGI 模式下等待执行名额的 agent 任务数',
+        callback=lambda: {(): gate.stats()['queued']}
+    )
+
+    api = FastAPI(on_shutdown=[shutdown_scheduler])
+    api.state.flask_app = flask_app
+    api.state.agent_gate = gate
+
+    async def run_agent(room_id: str, agent_type: str, agent: Agent, content: str, msg_id: str, slot,
+                        cancel_token: CancelToken, bypass_cache: bool = False):
+        # 等待执行名额期间被取消时直接放弃任务，开始执行后由运行时取消 agent 协程
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+
+        def cancel_waiting():
+            loop.call_soon_threadsafe(task.cancel)
+
+        cancel_token.add_callback(cancel_waiting)
+        try:
+            async with slot:
+                cancel_token.remove_callback(cancel_waiting)
+                await process_agent_response_async(flask_app, room_id, agent, content, msg_id, bypass_cache,
+                                                   cancel_token=cancel_token)
+        except asyncio.CancelledError:
+            if not cancel_token.cancelled:
+                raise
+        finally:
+            cancel_token.complete()
+
+    @api.websocket('/chat/{room_id}')
+    async def chat_socket(ws: WebSocket, room_id: str):
+        """WebSocket 聊天处理"""
+        await ws.accept()
+
+        room = await resolve_room(flask_app, room_id)
+        if not room:
+            await ws.send_text(json.dumps({
+                'type': 'error',
+                'content': '聊天室不存在',
+                'role': 'system',
+                'timestamp': datetime.utcnow().isoformat()
+            }))
+            await ws.close()
+            return
+        agent_type = room.agent_type
+
+        # 协商传输协议，断线重连时补发 last_seen 之后错过的帧
+        protocol = negotiate_protocol(ws.query_params.get('protocol'))
+        last_seen = parse_last_seen(ws.query_params.get('last_seen'))
+
+        # 添加连接到房间，发送由连接自己的写协程完成
+        loop = asyncio.get_running_loop()
+        connection = chat_room_manager.add_connection(
+            room_id,
+            ws,
+            protocol=protocol,
+            connection_class=AsyncRoomConnection,
+            greeting=hello_frame(protocol),
+            last_seen=last_seen,
+            loop=loop
+        )
+        writer = asyncio.create_task(connection.run_writer())
+        tasks = set()
+        runs = {}  # 本连接发起的运行：回复 id -> 取消令牌
+        if last_seen:
+            adopt_runs(runs, room_id, last_seen[0])
+
+        try:
+            # 发送欢迎消息
+            welcome_msg = await run_in_app_context(
+                flask_app,
+                create_message,
+                msg_id=str(uuid4()),
+                room_id=room_id,
+                msg_type='system',
+                content=f'欢迎加入聊天室 {room_id}',
+                role='system'
+            )
+            connection.send(welcome_msg)
+
+            while True:
+                data = await ws.receive_text()
+                try:
+                    message_data = json.loads(data)
+
+                    # 处理心跳消息
+                    if message_data.get('type') == 'system' and message_data.get('content') == 'ping':
+                        connection.send({
+                            'type': 'system',
+                            'content': 'pong',
+                            'role': 'system',
+                            'timestamp': datetime.utcnow().isoformat()
+                        })
+                        continue
+
+                    # 取消本连接发起的回复，可以用 id 指定某一个回复
+                    if message_data.get('type') == 'cancel':
+                        cancel_runs(runs, message_data.get('id'), CANCEL_CLIENT)
+                        continue
+
+                    if message_data.get('type') == 'message':
+                        # 房间已被删除时不再处理
+                        room = await resolve_room(flask_app, room_id)
+                        if room is None:
+                            connection.send({
+                                'type': 'error',
+                                'content': '聊天室不存在',
+                                'role': 'system',
+                                'timestamp': datetime.utcnow().isoformat()
+                            })
+                            continue
+
+                        try:
+                            slot = gate.admit(room_id, agent_type)
+                        except SchedulerRejected as e:
+                            error_msg = await run_in_app_context(
+                                flask_app,
+                                create_message,
+                                msg_id=str(uuid4()),
+                                room_id=room_id,
+                                msg_type='error',
+                                content=str(e),
+                                role='system'
+                            )
+                            connection.send(error_msg)
+                            continue
+
+                        agent = room.agent
+                        msg_id = str(uuid4())
+                        token = CancelToken()
+                        task = asyncio.create_task(run_agent(
+                            room_id, agent_type, agent, message_data['content'], msg_id, slot, token,
+                            bypass_cache=bool(message_data.get('bypass_cache'))
+                        ))
+                        runs[msg_id] = token
+                        active_runs[msg_id] = (room_id, token)
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+
+                        def forget_run(_task, msg_id=msg_id):
+                            runs.pop(msg_id, None)
+                            active_runs.pop(msg_id, None)
+
+                        task.add_done_callback(forget_run)
+
+                except json.JSONDecodeError:
+                    error_msg = await run_in_app_context(
+                        flask_app,
+                        create_message,
+                        msg_id=str(uuid4()),
+                        room_id=room_id,
+                        msg_type='error',
+                        content='无效的消息格式',
+                        role='system'
+                    )
+                    connection.send(error_msg)
+                except Exception as e:
+                    # 缺少字段或格式不对的消息只回复错误，不断开连接
+                    error_msg = await run_in_app_context(
+                        flask_app,
+                        create_message,
+                        msg_id=str(uuid4()),
+                        room_id=room_id,
+                        msg_type='error',
+                        content=str(e),
+                        role='system'
+                    )
+                    connection.send(error_msg)
+
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.error(f"WebSocket error: {e}")
+        finally:
+            connection.close()
+            chat_room_manager.remove_connection(room_id, ws)
+            writer.cancel()
+            # 房间内没有其他连接、也没有客户端及时重连时，取消本连接发起的运行
+            cancel_abandoned_runs(room_id, runs, call_later=loop.call_later)
+
+    # 其余 HTTP 请求交给 Flask 处理：a2wsgi 边读边传请求体，响应经有界队列发送，
+    # 流式导入导出在 ASGI 模式下同样保持内存平稳，慢客户端会反压 Flask 的生成器
+    api.mount('/', WSGIMiddleware(flask_app, workers=config.ASGI_WSGI_WORKERS))
+    return api
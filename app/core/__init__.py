@@ -0,0 +1,55 @@
+"""
+核心运行时模块
+包含 agent 共享事件循环、协作式取消、流式事件通道、流式回复重放缓冲区、房间环境缓存、消息持久化、消息归档与保留、任务调度、传输协议、消息广播、回复缓存、运行指标等基础设施
+"""
+
+from .runtime import AgentRuntime, agent_runtime, get_agent_runtime
+from .cancellation import CancelToken, CANCEL_CLIENT, CANCEL_DISCONNECT, CANCEL_TIMEOUT
+from .replay import ReplayBuffer, replay_buffer, parse_last_seen
+from .archive import MessageArchive, message_archive
+from .stream import StreamEvent, StreamEventType, StreamChannel, ChannelClosed, coalesce_stream
+from .env_cache import EnvironmentCache, environment_cache
+from .scheduler import AgentScheduler, SchedulerRejected
+from .protocol import PROTOCOL_JSON, PROTOCOL_DELTA, negotiate_protocol, encode_message
+from .broker import Broker, LocalBroker, UnixSocketBroker, create_broker
+from .response_cache import ResponseCache, response_cache, normalize_message
+from .metrics import MetricsRegistry, metrics
+
+# message_writer 和 retention 依赖 app.models，而 app.models 又依赖本包，需直接从子模块导入
+
+__all__ = [
+    'CancelToken',
+    'CANCEL_CLIENT',
+    'CANCEL_DISCONNECT',
+    'CANCEL_TIMEOUT',
+    'ReplayBuffer',
+    'replay_buffer',
+    'parse_last_seen',
+    'MessageArchive',
+    'message_archive',
+    'StreamEvent',
+    'StreamEventType',
+    'StreamChannel',
+    'ChannelClosed',
+    'coalesce_stream',
+    'EnvironmentCache',
+    'environment_cache',
+    'AgentScheduler',
+    'SchedulerRejected',
+    'PROTOCOL_JSON',
+    'PROTOCOL_DELTA',
+    'negotiate_protocol',
+    'encode_message',
+    'Broker',
+    'LocalBroker',
+    'UnixSocketBroker',
+    'create_broker',
+    'ResponseCache',
+    'response_cache',
+    'normalize_message',
+    'MetricsRegistry',
+    'metrics',
+    'AgentRuntime',
+    'agent_runtime',
+    'get_agent_runtime'
+]
@@ -0,0 +1,315 @@
+import fcntl
+import gzip
+import json
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from config.settings import config
+
+INDEX_FILE = 'index.jsonl'
+SEGMENT_FILE = 'segment-{:06d}.jsonl.gz'
+
+# 房间 id 用作目录名，只允许字母、数字、- 和 _（服务端生成的是 uuid4）
+ROOM_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+
+# 归档记录保存的字段，与 chat_messages 的列一致（不含 room_id）
+RECORD_FIELDS = ('id', 'type', 'content', 'role', 'timestamp', 'stop_reason')
+
+# 从文件末尾向前读取索引时每次读取的字节数
+TAIL_CHUNK_BYTES = 4096
+
+
+def record_key(record: dict) -> Tuple[datetime, str]:
+    """归档记录的排序键 (timestamp, id)，与历史消息分页的游标一致"""
+    return datetime.fromisoformat(record['timestamp']), record['id']
+
+
+def _entry_key(key: list) -> Tuple[datetime, str]:
+    return datetime.fromisoformat(key[0]), key[1]
+
+
+def _parse_index_lines(data: bytes) -> List[dict]:
+    entries = []
+    for line in data.splitlines():
+        # 写入时中断的行无法解析，跳过
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
+
+
+def _read_last_entry(f) -> Optional[dict]:
+    """从以二进制模式打开的索引文件末尾向前读取，返回最后一条完整的索引项"""
+    pos = f.seek(0, os.SEEK_END)
+    head = b''
+    while pos > 0:
+        size = min(TAIL_CHUNK_BYTES, pos)
+        pos -= size
+        f.seek(pos)
+        lines = (f.read(size) + head).split(b'\n')
+        # 没读到文件开头时第一段可能是不完整的行，留到下一轮拼接
+        head = lines.pop(0) if pos > 0 else b''
+        for line in reversed(lines):
+            try:
+                return json.loads(line)
+            except ValueError:
+                continue
+    return None
+
+
+def to_message(record: dict) -> dict:
+    """归档记录转换为 ChatMessage.to_dict() 的格式"""
+    message = {
+        'id': record['id'],
+        'type': record['type'],
+        'content': record['content'],
+        'role': record['role'],
+        'timestamp': record['timestamp']
+    }
+    if record.get('stop_reason'):
+        message['truncated'] = True
+        message['stop_reason'] = record['stop_reason']
+    return message
+
+
+class MessageArchive:
+    """按房间保存的只追加消息归档
+
+    每个房间一个目录：
+    - segment-NNNNNN.jsonl.gz：压缩的 JSONL 分段，每次归档追加一个独立的 gzip member，
+      超过 segment_bytes 后开始新的分段
+    - index.jsonl：每次归档追加一行，记录 member 所在分段、偏移、长度、条数和首尾 (timestamp, id)
+    读取时按索引只解压需要的 member。归档的总是房间内最旧的消息，归档中的消息都早于数据库中的消息。
+    追加在索引文件的排他锁内进行（多进程安全），已归档过的消息（键不大于最后一条）会被跳过，
+    归档后删除数据库行之前中断时重复归档不会产生重复记录。
+    追加和 last_key 只从索引文件末尾读取最后一项；分页读取的索引按房间缓存，
+    文件大小或修改时间变化时只解析新追加的部分。
+    """
+
+    def __init__(self, root: str, segment_bytes: int = 4 * 1024 * 1024, index_cache_rooms: int = 1024):
+        self.root = root
+        self.segment_bytes = max(1, segment_bytes)
+        self.index_cache_rooms = max(1, index_cache_rooms)
+        self._lock = threading.Lock()
+        # room_id -> (inode, 大小, 修改时间, 已解析的字节数, 索引项)
+        self._index_cache: "OrderedDict[str, Tuple[int, int, int, int, List[dict]]]" = OrderedDict()
+
+        self.appended = 0
+        self.appended_bytes = 0
+        self.members_read = 0
+
+    def room_dir(self, room_id: str) -> str:
+        """房间的归档目录；房间 id 不是安全的目录名或解析后不在归档根目录下时抛出 ValueError"""
+        if not isinstance(room_id, str) or not ROOM_ID_PATTERN.fullmatch(room_id):
+            raise ValueError(f'无效的房间 id: {room_id!r}')
+        root = os.path.realpath(self.root)
+        directory = os.path.realpath(os.path.join(root, room_id[:2], room_id))
+        if os.path.commonpath([root, directory]) != root or directory == root:
+            raise ValueError(f'无效的房间 id: {room_id!r}')
+        return directory
+
+    def has(self, room_id: str) -> bool:
+        try:
+            return os.path.exists(os.path.join(self.room_dir(room_id), INDEX_FILE))
+        except ValueError:
+            return False
+
+    def _read_index(self, room_id: str) -> List[dict]:
+        """房间的全部索引项；返回的列表与缓存共享，调用方不能修改"""
+        path = os.path.join(self.room_dir(room_id), INDEX_FILE)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            with self._lock:
+                self._index_cache.pop(room_id, None)
+            return []
+        with f:
+            st = os.fstat(f.fileno())
+            with self._lock:
+                cached = self._index_cache.get(room_id)
+            if cached is not None and cached[:3] == (st.st_ino, st.st_size, st.st_mtime_ns):
+                with self._lock:
+                    if room_id in self._index_cache:
+                        self._index_cache.move_to_end(room_id)
+                return cached[4]
+
+            entries: List[dict] = []
+            consumed = 0
+            # 索引只追加：同一个文件只解析上次之后新增的完整行
+            if cached is not None and cached[0] == st.st_ino and cached[3] <= st.st_size:
+                consumed, entries = cached[3], cached[4]
+            f.seek(consumed)
+            data = f.read(st.st_size - consumed)
+            # 末尾不完整的行（正在写入）留到下次再解析
+            complete = data.rfind(b'\n') + 1
+            if complete:
+                entries = entries + _parse_index_lines(data[:complete])
+                consumed += complete
+
+        with self._lock:
+            self._index_cache[room_id] = (st.st_ino, st.st_size, st.st_mtime_ns, consumed, entries)
+            self._index_cache.move_to_end(room_id)
+            while len(self._index_cache) > self.index_cache_rooms:
+                self._index_cache.popitem(last=False)
+        return entries
+
+    def append(self, room_id: str, records: Sequence[dict]) -> int:
+        """
+        追加一批按 (timestamp, id) 升序排列的消息记录
+
+        Returns:
+            实际写入的条数（已归档过的记录被跳过）
+        """
+        if not records:
+            return 0
+        directory = self.room_dir(room_id)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, INDEX_FILE), 'a+b') as index:
+            fcntl.flock(index, fcntl.LOCK_EX)
+            try:
+                last_entry = _read_last_entry(index)
+                if last_entry is not None:
+                    last_key = _entry_key(last_entry['last'])
+                    records = [record for record in records if record_key(record) > last_key]
+                if not records:
+                    return 0
+
+                segment = last_entry['segment'] if last_entry is not None else 1
+                path = os.path.join(directory, SEGMENT_FILE.format(segment))
+                if os.path.exists(path) and os.path.getsize(path) >= self.segment_bytes:
+                    segment += 1
+                    path = os.path.join(directory, SEGMENT_FILE.format(segment))
+
+                payload = ''.join(json.dumps({field: record.get(field) for field in RECORD_FIELDS},
+                                             ensure_ascii=False) + '\n' for record in records)
+                member = gzip.compress(payload.encode('utf-8'))
+                with open(path, 'ab') as f:
+                    offset = f.tell()
+                    f.write(member)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                # 分段数据落盘后再写索引，索引中的 member 一定完整；
+                # 上次写入中断留下的不完整行先补上换行，新索引项单独成行
+                end = index.seek(0, os.SEEK_END)
+                if end:
+                    index.seek(end - 1)
+                    prefix = b'' if index.read(1) == b'\n' else b'\n'
+                else:
+                    prefix = b''
+                index.write(prefix + json.dumps({
+                    'segment': segment,
+                    'offset': offset,
+                    'length': len(member),
+                    'count': len(records),
+                    'first': [records[0]['timestamp'], records[0]['id']],
+                    'last': [records[-1]['timestamp'], records[-1]['id']]
+                }).encode('utf-8') + b'\n')
+                index.flush()
+                os.fsync(index.fileno())
+            finally:
+                fcntl.flock(index, fcntl.LOCK_UN)
+
+        with self._lock:
+            self.appended += len(records)
+            self.appended_bytes += len(member)
+        return len(records)
+
+    def _read_member(self, room_id: str, entry: dict) -> List[dict]:
+        path = os.path.join(self.room_dir(room_id), SEGMENT_FILE.format(entry['segment']))
+        with open(path, 'rb') as f:
+            f.seek(entry['offset'])
+            data = gzip.decompress(f.read(entry['length']))
+        with self._lock:
+            self.members_read += 1
+        return [json.loads(line) for line in data.decode('utf-8').splitlines() if line]
+
+    def page(self, room_id: str, direction: str = 'backward', cursor: Optional[Tuple[datetime, str]] = None,
+             limit: int = 50, types: Optional[Iterable[str]] = None) -> List[dict]:
+        """
+        按 (timestamp, id) 分页读取归档消息，语义与数据库中的历史分页一致
+
+        Args:
+            direction: backward（从新到旧）或 forward（从旧到新）
+            cursor: 只返回早于（backward）或晚于（forward）该键的消息
+            types: 消息类型过滤
+
+        Returns:
+            ChatMessage.to_dict() 格式的消息列表，按 direction 排序
+        """
+        types = set(types) if types else None
+        entries = self._read_index(room_id)
+        backward = direction == 'backward'
+        if backward:
+            entries = entries[::-1]
+
+        messages = []
+        for entry in entries:
+            if cursor is not None:
+                bound = entry['first'] if backward else entry['last']
+                bound_key = _entry_key(bound)
+                # 整个 member 都不在游标范围内
+                if (backward and bound_key >= cursor) or (not backward and bound_key <= cursor):
+                    continue
+            records = self._read_member(room_id, entry)
+            if backward:
+                records.reverse()
+            for record in records:
+                if cursor is not None:
+                    key = record_key(record)
+                    if (backward and key >= cursor) or (not backward and key <= cursor):
+                        continue
+                if types is not None and record['type'] not in types:
+                    continue
+                messages.append(to_message(record))
+                if len(messages) >= limit:
+                    return messages
+        return messages
+
+    def iter_records(self, room_id: str) -> Iterator[dict]:
+        """按时间顺序逐个 member 读取房间的全部归档记录"""
+        for entry in self._read_index(room_id):
+            yield from self._read_member(room_id, entry)
+
+    def last_key(self, room_id: str) -> Optional[Tuple[datetime, str]]:
+        """归档中最新一条消息的 (timestamp, id)，没有归档时返回 None"""
+        try:
+            with open(os.path.join(self.room_dir(room_id), INDEX_FILE), 'rb') as f:
+                last_entry = _read_last_entry(f)
+        except FileNotFoundError:
+            return None
+        return _entry_key(last_entry['last']) if last_entry is not None else None
+
+    def count(self, room_id: str) -> int:
+        return sum(entry['count'] for entry in self._read_index(room_id))
+
+    def delete(self, room_id: str) -> None:
+        """删除房间的全部归档；无效的房间 id 不会有归档，不做处理"""
+        try:
+            directory = self.room_dir(room_id)
+        except ValueError:
+            return
+        shutil.rmtree(directory, ignore_errors=True)
+        with self._lock:
+            self._index_cache.pop(room_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'root': self.root,
+                'segment_bytes': self.segment_bytes,
+                'appended': self.appended,
+                'appended_bytes': self.appended_bytes,
+                'members_read': self.members_read,
+                'cached_indexes': len(self._index_cache)
+            }
+
+
+# 创建全局消息归档实例
+message_archive = MessageArchive(root=config.ARCHIVE_DIR, segment_bytes=config.ARCHIVE_SEGMENT_BYTES)
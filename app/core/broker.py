@@ -0,0 +1,503 @@
+import fcntl
+import json
+import logging
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Set
+
+from config.settings import config
+from .metrics import BROADCAST_FAILURES
+
+logger = logging.getLogger(__name__)
+
+# 房间事件处理函数：(room_id, kind, payload)
+EventHandler = Callable[[str, str, Any], None]
+
+EVENT_MESSAGE = 'message'  # 广播消息
+EVENT_CLOSE = 'close'      # 关闭房间内所有连接
+
+_HEADER = struct.Struct('!I')
+_MAX_FRAME = 16 * 1024 * 1024
+
+
+class Broker:
+    """房间消息的发布/订阅接口
+
+    ChatRoomManager 只通过 broker 广播：进程内有连接的房间会被订阅，
+    publish 把事件交给本进程的处理函数，并在多进程后端中转发给订阅了该房间的其他进程。
+    每个进程对每个房间只收发一次，再由本进程的 ChatRoomManager 分发给各个连接。
+    """
+    backend = ''
+
+    def __init__(self):
+        self._handler: Optional[EventHandler] = None
+
+    def start(self, handler: EventHandler) -> None:
+        """设置本进程的事件处理函数"""
+        self._handler = handler
+
+    def subscribe(self, room_id: str) -> None:
+        pass
+
+    def unsubscribe(self, room_id: str) -> None:
+        pass
+
+    def publish(self, room_id: str, kind: str, payload: Any = None) -> None:
+        raise NotImplementedError
+
+    def _deliver(self, room_id: str, kind: str, payload: Any) -> None:
+        if self._handler is None:
+            return
+        try:
+            self._handler(room_id, kind, payload)
+        except Exception as e:
+            logger.error(f"处理房间 {room_id} 的 {kind} 事件失败: {e}")
+
+    def stats(self) -> dict:
+        return {'backend': self.backend}
+
+    def close(self) -> None:
+        pass
+
+
+class LocalBroker(Broker):
+    """进程内后端：直接交给本进程处理，与单进程部署的行为一致"""
+    backend = 'local'
+
+    def publish(self, room_id: str, kind: str, payload: Any = None) -> None:
+        self._deliver(room_id, kind, payload)
+
+
+def _encode_frame(frame: dict) -> bytes:
+    data = json.dumps(frame, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return _HEADER.pack(len(data)) + data
+
+
+def _send_frame(sock: socket.socket, frame: dict) -> None:
+    sock.sendall(_encode_frame(frame))
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            return None
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def _recv_frame(sock: socket.socket) -> Optional[dict]:
+    """读取一帧，连接关闭时返回 None"""
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    (size,) = _HEADER.unpack(header)
+    if size > _MAX_FRAME:
+        raise ValueError(f"帧过大: {size} 字节")
+    data = _recv_exact(sock, size)
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+class _HubPeer:
+    """中转服务中的一个进程连接
+
+    转发的帧放入有界队列，由该连接自己的写线程发送，慢的进程不会拖住其他进程的转发。
+    队列满时断开该连接，对方重连后重新订阅。
+    """
+
+    def __init__(self, sock: socket.socket, max_queue: int):
+        self.sock = sock
+        self.rooms: Set[str] = set()
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(max(1, max_queue))
+        self._thread = threading.Thread(target=self._write_loop, name="broker_hub_writer", daemon=True)
+        self._thread.start()
+
+    def send(self, data: bytes) -> bool:
+        """放入发送队列；队列已满时断开连接并返回 False"""
+        try:
+            self._queue.put_nowait(data)
+            return True
+        except queue.Full:
+            logger.warning("中转连接发送队列已满，断开该连接")
+            self.disconnect()
+            return False
+
+    def _write_loop(self) -> None:
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.disconnect()
+                return
+
+    def disconnect(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        """停止写线程；队列已满时写线程会因连接已关闭而退出"""
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class _BrokerHub:
+    """Unix socket 中转服务
+
+    由第一个拿到文件锁的进程在后台线程中运行。记录每个进程订阅的房间，
+    收到发布后转发给订阅了该房间的其他进程。持有锁的进程退出后锁自动释放，
+    其余进程重连时由其中一个接管。
+    """
+
+    def __init__(self, path: str, lock_fd: int, max_queue: int = 1024):
+        self.path = path
+        self.lock_fd = lock_fd
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[_HubPeer]] = {}
+        self._peers: Set[_HubPeer] = set()
+        self._closed = False
+
+        if os.path.exists(path):
+            # 上一个中转进程遗留的 socket 文件
+            os.unlink(path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        # 只允许当前用户连接，其他用户无法注入或订阅房间消息
+        os.chmod(path, 0o600)
+        self._server.listen(64)
+        self._thread = threading.Thread(target=self._accept_loop, name="broker_hub", daemon=True)
+        self._thread.start()
+        logger.info(f"消息中转服务已启动: {path}")
+
+    def _accept_loop(self) -> None:
+        while not self._closed:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            peer = _HubPeer(sock, self.max_queue)
+            with self._lock:
+                self._peers.add(peer)
+            threading.Thread(target=self._serve, args=(peer,), name="broker_hub_peer", daemon=True).start()
+
+    def _serve(self, peer: _HubPeer) -> None:
+        try:
+            while True:
+                frame = _recv_frame(peer.sock)
+                if frame is None:
+                    break
+                op = frame.get('op')
+                room_id = frame.get('room')
+                if op == 'pub':
+                    with self._lock:
+                        targets = [p for p in self._subscribers.get(room_id, ()) if p is not peer]
+                    if targets:
+                        data = _encode_frame(frame)
+                        for target in targets:
+                            target.send(data)
+                elif op == 'sub':
+                    with self._lock:
+                        self._subscribers.setdefault(room_id, set()).add(peer)
+                        peer.rooms.add(room_id)
+                elif op == 'unsub':
+                    with self._lock:
+                        self._remove_subscription_locked(peer, room_id)
+        except (OSError, ValueError) as e:
+            logger.warning(f"中转连接异常断开: {e}")
+        finally:
+            with self._lock:
+                for room_id in list(peer.rooms):
+                    self._remove_subscription_locked(peer, room_id)
+                self._peers.discard(peer)
+            peer.close()
+
+    def _remove_subscription_locked(self, peer: _HubPeer, room_id: str) -> None:
+        peer.rooms.discard(room_id)
+        subscribers = self._subscribers.get(room_id)
+        if subscribers is not None:
+            subscribers.discard(peer)
+            if not subscribers:
+                del self._subscribers[room_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'peers': len(self._peers), 'rooms': len(self._subscribers)}
+
+    def close(self) -> None:
+        self._closed = True
+        try:
+            self._server.close()
+        except OSError:
+            pass
+        with self._lock:
+            peers = list(self._peers)
+        for peer in peers:
+            peer.disconnect()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+        os.close(self.lock_fd)
+
+
+class UnixSocketBroker(Broker):
+    """多进程后端：同一台机器上的进程通过 Unix socket 中转服务交换房间事件
+
+    不依赖外部服务。所有进程连接到同一个 socket 路径，第一个拿到 `<path>.lock`
+    文件锁的进程同时承担中转服务。断线后自动重连并重新订阅，断线期间的发布只投递到本进程。
+    发往中转服务的帧放入有界队列由写线程发送，publish 不会在 agent 线程上阻塞：
+    队列满时丢弃发布；订阅变更放不进队列时断开重连，重连后按当前订阅重新订阅。
+    """
+    backend = 'unix'
+    RECONNECT_WARN_EVERY = 20  # 连续连接失败时每隔多少次记一条警告
+
+    def __init__(self, path: str, reconnect_interval: float = 0.5, max_queue: int = 1024):
+        super().__init__()
+        self.path = path
+        self.reconnect_interval = reconnect_interval
+        self.max_queue = max(1, max_queue)
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(self.max_queue)
+        self._writer: Optional[threading.Thread] = None
+
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._rooms: Set[str] = set()
+        self._sock: Optional[socket.socket] = None
+        self._hub: Optional[_BrokerHub] = None
+        self._thread: Optional[threading.Thread] = None
+        self._connected = threading.Event()
+        self._closed = False
+
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.connect_failures = 0
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="broker_client", daemon=True)
+                self._thread.start()
+                self._writer = threading.Thread(target=self._write_loop, name="broker_writer", daemon=True)
+                self._writer.start()
+
+    def wait_connected(self, timeout: Optional[float] = None) -> bool:
+        """等待连接到中转服务"""
+        self._ensure_started()
+        return self._connected.wait(timeout)
+
+    def _try_become_hub(self) -> None:
+        """尝试获取文件锁并启动中转服务，锁已被其他进程持有时直接返回"""
+        if self._hub is not None:
+            return
+        # 不跟随符号链接，避免锁文件被替换成指向其他文件的链接
+        lock_fd = os.open(self.path + '.lock', os.O_CREAT | os.O_RDWR | os.O_NOFOLLOW, 0o600)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(lock_fd)
+            return
+        try:
+            self._hub = _BrokerHub(self.path, lock_fd, self.max_queue)
+        except OSError:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+            raise
+
+    def _connect(self) -> socket.socket:
+        self._try_become_hub()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _run(self) -> None:
+        """连接、重新订阅并接收其他进程的发布，断线后重连"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            # socket 目录不存在时创建为仅当前用户可访问；已存在的目录保持原权限
+            try:
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"创建消息中转目录 {directory} 失败: {e}")
+
+        failures = 0
+        while not self._closed:
+            try:
+                sock = self._connect()
+            except OSError as e:
+                failures += 1
+                self.connect_failures += 1
+                # 第一次失败和之后每 RECONNECT_WARN_EVERY 次失败记一条警告，其余只记调试日志
+                if failures == 1 or failures % self.RECONNECT_WARN_EVERY == 0:
+                    logger.warning(f"连接消息中转服务 {self.path} 失败（连续 {failures} 次）: {e}")
+                else:
+                    logger.debug(f"连接消息中转服务失败: {e}")
+                time.sleep(self.reconnect_interval)
+                continue
+            failures = 0
+
+            with self._send_lock:
+                with self._lock:
+                    rooms = list(self._rooms)
+                try:
+                    for room_id in rooms:
+                        _send_frame(sock, {'op': 'sub', 'room': room_id})
+                except OSError:
+                    sock.close()
+                    continue
+                self._sock = sock
+            self._connected.set()
+            logger.info(f"已连接消息中转服务: {self.path}")
+
+            try:
+                while True:
+                    frame = _recv_frame(sock)
+                    if frame is None:
+                        break
+                    self.received += 1
+                    self._deliver(frame['room'], frame['kind'], frame.get('payload'))
+            except (OSError, ValueError) as e:
+                if not self._closed:
+                    logger.warning(f"消息中转连接断开: {e}")
+            finally:
+                self._connected.clear()
+                with self._send_lock:
+                    self._sock = None
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+
+            if not self._closed:
+                self.reconnects += 1
+                time.sleep(self.reconnect_interval)
+
+    def _send(self, frame: dict) -> bool:
+        """放入发送队列，队列已满时返回 False"""
+        try:
+            self._queue.put_nowait(frame)
+            return True
+        except queue.Full:
+            return False
+
+    def _reconnect(self) -> None:
+        """断开当前连接，由接收线程重连并重新订阅；不获取发送锁，写线程阻塞时也不会等待"""
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _write_loop(self) -> None:
+        """写线程：把队列中的帧发给中转服务；未连接时发布被丢弃，订阅在重连后统一恢复"""
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                return
+            with self._send_lock:
+                sock = self._sock
+                if sock is not None:
+                    try:
+                        _send_frame(sock, frame)
+                        continue
+                    except OSError:
+                        # 交给接收线程发现断线并重连
+                        try:
+                            sock.shutdown(socket.SHUT_RDWR)
+                        except OSError:
+                            pass
+            if frame['op'] == 'pub':
+                self.dropped += 1
+                BROADCAST_FAILURES.inc('broker')
+
+    def subscribe(self, room_id: str) -> None:
+        self._ensure_started()
+        with self._lock:
+            if room_id in self._rooms:
+                return
+            self._rooms.add(room_id)
+        # 未连接时在重连后统一订阅
+        if not self._send({'op': 'sub', 'room': room_id}):
+            self._reconnect()
+
+    def unsubscribe(self, room_id: str) -> None:
+        with self._lock:
+            if room_id not in self._rooms:
+                return
+            self._rooms.discard(room_id)
+        if not self._send({'op': 'unsub', 'room': room_id}):
+            self._reconnect()
+
+    def publish(self, room_id: str, kind: str, payload: Any = None) -> None:
+        self._ensure_started()
+        self._deliver(room_id, kind, payload)
+        self.published += 1
+        if not self._send({'op': 'pub', 'room': room_id, 'kind': kind, 'payload': payload}):
+            self.dropped += 1
+            BROADCAST_FAILURES.inc('broker')
+
+    def stats(self) -> dict:
+        with self._lock:
+            rooms = len(self._rooms)
+        stats = {
+            'backend': self.backend,
+            'path': self.path,
+            'connected': self._connected.is_set(),
+            'is_hub': self._hub is not None,
+            'rooms': rooms,
+            'published': self.published,
+            'received': self.received,
+            'dropped': self.dropped,
+            'queued': self._queue.qsize(),
+            'max_queue': self.max_queue,
+            'reconnects': self.reconnects,
+            'connect_failures': self.connect_failures
+        }
+        if self._hub is not None:
+            stats['hub'] = self._hub.stats()
+        return stats
+
+    def close(self) -> None:
+        self._closed = True
+        self._reconnect()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        if self._hub is not None:
+            self._hub.close()
+            self._hub = None
+
+
+def create_broker(backend: str = 'local', socket_path: Optional[str] = None, max_queue: int = 1024) -> Broker:
+    """按配置创建 broker，backend 为 local 或 unix"""
+    if backend == 'unix':
+        return UnixSocketBroker(socket_path or config.BROKER_SOCKET_PATH, max_queue=max_queue)
+    if backend != 'local':
+        logger.warning(f"未知的 broker 后端 {backend}，使用进程内后端")
+    return LocalBroker()
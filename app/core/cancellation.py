@@ -0,0 +1,72 @@
+import threading
+import time
+from typing import Callable, List, Optional
+
+# 取消原因
+CANCEL_CLIENT = 'cancelled'       # 客户端发送了 cancel 帧
+CANCEL_DISCONNECT = 'disconnect'  # 发起请求的客户端断开，房间内没有其他连接
+CANCEL_TIMEOUT = 'timeout'        # 超过 AGENT_TIMEOUT
+
+
+class CancelToken:
+    """一次 agent 运行的协作式取消令牌（线程安全）
+
+    WebSocket 处理函数持有令牌，调度器、共享运行时和 agent 协程通过回调响应取消：
+    排队中的任务直接移出队列，运行中的协程在下一个 await 处收到 CancelledError。
+    设置了截止时间时，由运行时在到期后以 timeout 原因取消。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self._completed = False
+        self.reason: Optional[str] = None
+        self.deadline: Optional[float] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def set_timeout(self, seconds: Optional[float]) -> None:
+        """从现在起 seconds 秒后到期，为空或不大于 0 时不设截止时间"""
+        self.deadline = time.monotonic() + seconds if seconds and seconds > 0 else None
+
+    def remaining(self) -> Optional[float]:
+        """距离截止时间的秒数，没有截止时间时返回 None"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def cancel(self, reason: str = CANCEL_CLIENT) -> bool:
+        """取消运行并执行回调；已取消或已完成时返回 False"""
+        with self._lock:
+            if self.reason is not None or self._completed:
+                return False
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+        return True
+
+    def complete(self) -> Optional[str]:
+        """标记运行结束，之后的取消不再生效；返回结束前的取消原因"""
+        with self._lock:
+            self._completed = True
+            self._callbacks = []
+            return self.reason
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """注册取消回调，已经取消时立即执行"""
+        with self._lock:
+            if self.reason is None:
+                if not self._completed:
+                    self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            try:
+                self._callbacks.remove(callback)
+            except ValueError:
+                pass
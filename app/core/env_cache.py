@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from config.settings import config
+
+logger = logging.getLogger(__name__)
+
+
+class _CacheEntry:
+    """缓存条目"""
+    __slots__ = ('env', 'last_used')
+
+    def __init__(self, env: Any, last_used: float):
+        self.env = env
+        self.last_used = last_used
+
+
+class EnvironmentCache:
+    """按房间缓存 MetaGPT 环境
+
+    每个房间持有独立的环境（会话状态不再在房间之间共享或丢失），
+    超过空闲时间的环境会过期，超过容量时按 LRU 淘汰。
+    环境的构建在后台线程中进行，同一房间的并发请求只会构建一次。
+    """
+
+    def __init__(self, max_size: int = 100, ttl: float = 1800.0, build_workers: int = 2):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.build_workers = build_workers
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.prebuilds = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.build_workers,
+                    thread_name_prefix="env_builder"
+                )
+            return self._executor
+
+    def _expire_locked(self, now: float) -> None:
+        """清理过期条目；OrderedDict 按最近使用排序，只需从头部检查"""
+        if self.ttl is None or self.ttl <= 0:
+            return
+        while self._entries:
+            room_id, entry = next(iter(self._entries.items()))
+            if now - entry.last_used < self.ttl:
+                break
+            del self._entries[room_id]
+            self.expirations += 1
+            logger.debug(f"房间 {room_id} 的环境已过期")
+
+    def _evict_locked(self) -> None:
+        while len(self._entries) > self.max_size:
+            room_id, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            logger.debug(f"房间 {room_id} 的环境被淘汰")
+
+    def _request(self, room_id: str, factory: Callable[[], Any], count: bool = True) -> Future:
+        """返回房间环境的 Future：已缓存时立即完成，否则提交后台构建"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire_locked(now)
+            entry = self._entries.get(room_id)
+            if entry is not None:
+                entry.last_used = now
+                self._entries.move_to_end(room_id)
+                if count:
+                    self.hits += 1
+                future = Future()
+                future.set_result(entry.env)
+                return future
+
+            future = self._pending.get(room_id)
+            if future is not None:
+                # 正在预构建的环境也算作命中
+                if count:
+                    self.hits += 1
+                return future
+
+            if count:
+                self.misses += 1
+            future = Future()
+            self._pending[room_id] = future
+
+        try:
+            self._get_executor().submit(self._build, room_id, factory, future)
+        except RuntimeError as e:
+            with self._lock:
+                self._pending.pop(room_id, None)
+            future.set_exception(e)
+        return future
+
+    def _build(self, room_id: str, factory: Callable[[], Any], future: Future) -> None:
+        try:
+            env = factory()
+        except BaseException as e:
+            logger.error(f"构建房间 {room_id} 的环境失败: {e}")
+            with self._lock:
+                if self._pending.get(room_id) is future:
+                    del self._pending[room_id]
+            self._resolve(future, exception=e)
+            return
+
+        with self._lock:
+            # 构建期间房间被移除时不再放入缓存
+            if self._pending.get(room_id) is future:
+                del self._pending[room_id]
+                self._entries[room_id] = _CacheEntry(env, time.monotonic())
+                self._entries.move_to_end(room_id)
+                self._evict_locked()
+        self._resolve(future, result=env)
+
+    @staticmethod
+    def _resolve(future: Future, result: Any = None, exception: Optional[BaseException] = None) -> None:
+        """完成 Future；关闭时已被置为失败的 Future 不再改变"""
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def get_or_create(self, room_id: str, factory: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """同步获取房间环境，不存在时构建"""
+        return self._request(room_id, factory).result(timeout)
+
+    async def aget_or_create(self, room_id: str, factory: Callable[[], Any]) -> Any:
+        """异步获取房间环境，构建在后台线程中进行，不阻塞事件循环"""
+        return await asyncio.wrap_future(self._request(room_id, factory))
+
+    def prebuild(self, room_id: str, factory: Callable[[], Any]) -> Future:
+        """预先构建房间环境，避免房间的第一条消息承担冷启动开销"""
+        with self._lock:
+            self.prebuilds += 1
+        return self._request(room_id, factory, count=False)
+
+    def get(self, room_id: str) -> Optional[Any]:
+        """获取已缓存的环境，不会触发构建"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire_locked(now)
+            entry = self._entries.get(room_id)
+            if entry is None:
+                return None
+            entry.last_used = now
+            self._entries.move_to_end(room_id)
+            return entry.env
+
+    def discard(self, room_id: str) -> None:
+        """移除房间环境"""
+        with self._lock:
+            self._entries.pop(room_id, None)
+            self._pending.pop(room_id, None)
+
+    def memory_usage(self) -> dict:
+        """各房间环境的记忆占用（环境提供 memory_usage 时）"""
+        with self._lock:
+            entries = [(room_id, entry.env) for room_id, entry in self._entries.items()]
+        return {
+            room_id: env.memory_usage()
+            for room_id, env in entries
+            if hasattr(env, 'memory_usage')
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+
+    def stats(self) -> dict:
+        """缓存统计信息"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'pending': len(self._pending),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'prebuilds': self.prebuilds
+            }
+
+    def shutdown(self) -> None:
+        """停止后台构建线程，等待中的构建全部以异常结束"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            pending = list(self._pending.values())
+            self._pending.clear()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        # 被取消的构建任务不会再完成自己的 Future，这里让 get_or_create 和 aget_or_create 的等待方返回
+        for future in pending:
+            self._resolve(future, exception=RuntimeError("服务器正在关闭，环境构建已取消"))
+
+
+# 创建全局环境缓存实例
+environment_cache = EnvironmentCache(
+    max_size=config.ENV_CACHE_SIZE,
+    ttl=config.ENV_CACHE_TTL
+)
@@ -0,0 +1,245 @@
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy.exc import OperationalError
+
+from app.models import ChatMessage, db
+from .metrics import DB_COMMIT_LATENCY
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """聊天消息持久化
+
+    默认同步写入（每条消息一次提交）。开启 write-behind 模式后，消息先进入内存队列，
+    由专门的写入线程按批量大小或时间窗口合并成一个事务提交，
+    WebSocket 路径上不再等待 SQLite 提交。
+    读取历史前调用 flush(room_id) 可以保证读到自己写入的消息。
+    """
+
+    def __init__(self):
+        self.app = None
+        self.write_behind = False
+        self.batch_size = 100
+        self.flush_interval = 0.05
+        self.max_retries = 3
+
+        self._queue: Deque[dict] = deque()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._flush_requested = False
+
+        # 序号用于实现 flush：记录入队序号和已提交序号
+        self._enqueued_seq = 0
+        self._committed_seq = 0
+        self._room_seq: Dict[str, int] = {}
+
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+
+    def init_app(self, app) -> None:
+        """从应用配置中读取持久化参数"""
+        self.app = app
+        self.write_behind = app.config.get('MESSAGE_WRITE_BEHIND', False)
+        self.batch_size = max(1, app.config.get('MESSAGE_BATCH_SIZE', self.batch_size))
+        self.flush_interval = app.config.get('MESSAGE_FLUSH_INTERVAL', self.flush_interval)
+        self._stopping = False
+
+    def write(self, room_id: str, msg_id: str, msg_type: str, content: str, role: str,
+              stop_reason: Optional[str] = None) -> dict:
+        """保存一条消息，返回标准格式的消息字典；stop_reason 标记被截断的回复"""
+        timestamp = datetime.utcnow()
+        row = {
+            'id': msg_id,
+            'room_id': room_id,
+            'type': msg_type,
+            'content': content,
+            'role': role,
+            'timestamp': timestamp,
+            'stop_reason': stop_reason
+        }
+
+        if not (self.write_behind and self._enqueue(row)):
+            started = time.perf_counter()
+            db.session.add(ChatMessage(**row))
+            db.session.commit()
+            DB_COMMIT_LATENCY.observe(time.perf_counter() - started, 'sync')
+
+        message = {
+            'id': msg_id,
+            'type': msg_type,
+            'content': content,
+            'role': role,
+            'timestamp': timestamp.isoformat()
+        }
+        if stop_reason:
+            message['truncated'] = True
+            message['stop_reason'] = stop_reason
+        return message
+
+    def _enqueue(self, row: dict) -> bool:
+        """放入写入队列；写入器正在关闭时返回 False，由调用方同步写入"""
+        with self._cond:
+            if self._stopping:
+                return False
+            self._ensure_thread_locked()
+            self._enqueued_seq += 1
+            row['_seq'] = self._enqueued_seq
+            self._room_seq[row['room_id']] = self._enqueued_seq
+            self._queue.append(row)
+            if len(self._queue) == 1 or len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+            return True
+
+    def _ensure_thread_locked(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run,
+                name="message_writer",
+                daemon=True
+            )
+            self._thread.start()
+
+    def _take_batch(self) -> List[dict]:
+        """等待批量大小或时间窗口到达后取出一批消息"""
+        with self._cond:
+            while not self._queue and not self._stopping:
+                self._cond.wait()
+            if not self._queue:
+                return []
+
+            # 第一条消息到达后最多再等待一个时间窗口凑批
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._queue) < self.batch_size and not self._stopping and not self._flush_requested:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            self._flush_requested = False
+            count = min(len(self._queue), self.batch_size)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _commit_batch(self, batch: List[dict]) -> int:
+        """
+        一个事务写入整批消息；重试后仍失败时逐条写入，只丢弃写不进去的消息
+
+        Returns:
+            成功写入的条数
+        """
+        rows = [{k: v for k, v in row.items() if k != '_seq'} for row in batch]
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self._insert(rows, 'batch')
+                return len(rows)
+            except OperationalError as e:
+                # 数据库被锁等暂时性错误，稍后重试整批
+                logger.error(f"批量写入消息失败（第 {attempt} 次）: {e}")
+                time.sleep(min(0.1 * attempt, 1.0))
+            except Exception as e:
+                # 主键冲突、外键约束等错误与具体某条消息有关，重试整批没有意义
+                logger.error(f"批量写入消息失败，改为逐条写入: {e}")
+                break
+
+        written = 0
+        for row in rows:
+            try:
+                self._insert([row], 'row')
+                written += 1
+            except Exception as e:
+                logger.error(f"丢弃无法写入的消息 {row['id']}（房间 {row['room_id']}）: {e}")
+        return written
+
+    def _insert(self, rows: List[dict], kind: str) -> None:
+        with self.app.app_context():
+            try:
+                started = time.perf_counter()
+                db.session.execute(ChatMessage.__table__.insert(), rows)
+                db.session.commit()
+                DB_COMMIT_LATENCY.observe(time.perf_counter() - started, kind)
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+
+    def _run(self) -> None:
+        """写入线程主循环"""
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                with self._cond:
+                    if self._stopping and not self._queue:
+                        return
+                continue
+
+            written = self._commit_batch(batch)
+            self.batches += 1
+            self.written += written
+            self.failed += len(batch) - written
+
+            with self._cond:
+                self._committed_seq = max(self._committed_seq, batch[-1]['_seq'])
+                # 房间最后入队的消息已提交后移除其序号，空闲或已删除的房间不会一直留在表中
+                for row in batch:
+                    room_id = row['room_id']
+                    if self._room_seq.get(room_id, 0) <= self._committed_seq:
+                        self._room_seq.pop(room_id, None)
+                self._cond.notify_all()
+
+    def flush(self, room_id: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """等待已入队的消息提交完成；指定 room_id 时只等待该房间的消息"""
+        with self._cond:
+            if room_id is None:
+                target = self._enqueued_seq
+            else:
+                target = self._room_seq.get(room_id, 0)
+            if target <= self._committed_seq:
+                return True
+            if self._thread is None or not self._thread.is_alive():
+                self._ensure_thread_locked()
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._committed_seq >= target, timeout)
+
+    def pending(self) -> int:
+        """队列中尚未提交的消息数量"""
+        return len(self._queue)
+
+    def shutdown(self, timeout: Optional[float] = 10.0) -> None:
+        """写入所有排队的消息并停止写入线程"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            if self._queue:
+                logger.error(f"关闭时仍有 {len(self._queue)} 条消息未写入")
+            else:
+                logger.info("消息写入线程已停止")
+
+
+# 创建全局消息写入器实例
+message_writer = MessageWriter()
+
+
+def create_message(room_id: str, msg_id: str, msg_type: str, content: str, role: str,
+                   stop_reason: Optional[str] = None) -> dict:
+    """创建标准格式的消息并持久化"""
+    return message_writer.write(
+        room_id=room_id,
+        msg_id=msg_id,
+        msg_type=msg_type,
+        content=content,
+        role=role,
+        stop_reason=stop_reason
+    )
@@ -0,0 +1,192 @@
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 延迟类指标的桶（秒）
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 每个回复的分片数
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+# 每个回复的字节数
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Counter:
+    """按标签计数的累加器"""
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram:
+    """固定桶的直方图，记录一次观测只需一次二分查找和几次加法"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # 标签 -> [各桶计数（不累积，最后一个为 +Inf）, 总和, 次数]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def collect(self) -> Dict[Tuple[str, ...], dict]:
+        with self._lock:
+            values = {labels: ([*state[0]], state[1], state[2]) for labels, state in self._values.items()}
+        result = {}
+        for labels, (counts, total, count) in values.items():
+            cumulative = []
+            running = 0
+            for c in counts:
+                running += c
+                cumulative.append(running)
+            result[labels] = {
+                'buckets': dict(zip([*map(str, self.buckets), '+Inf'], cumulative)),
+                'sum': total,
+                'count': count,
+                'avg': total / count if count else 0.0
+            }
+        return result
+
+
+class Gauge:
+    """采集时由回调函数计算当前值的指标，平时没有任何开销"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        if self.callback is None:
+            return {}
+        return dict(self.callback())
+
+
+class MetricsRegistry:
+    """进程内指标注册表，支持 JSON 和 Prometheus 文本格式输出"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, object] = {}
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (),
+              callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None) -> Gauge:
+        gauge = self._register(Gauge(name, help, labelnames))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def _metrics_snapshot(self) -> List[object]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def snapshot(self) -> dict:
+        """所有指标的当前值（JSON 格式）"""
+        result = {}
+        for metric in self._metrics_snapshot():
+            result[metric.name] = {
+                'type': metric.kind,
+                'help': metric.help,
+                'values': [
+                    {'labels': dict(zip(metric.labelnames, labels)), 'value': value}
+                    for labels, value in metric.collect().items()
+                ]
+            }
+        return result
+
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        lines = []
+        for metric in self._metrics_snapshot():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in metric.collect().items():
+                label_pairs = list(zip(metric.labelnames, labels))
+                if metric.kind != 'histogram':
+                    lines.append(f"{metric.name}{_format_labels(label_pairs)} {value}")
+                    continue
+                for bound, count in value['buckets'].items():
+                    lines.append(f"{metric.name}_bucket{_format_labels(label_pairs + [('le', bound)])} {count}")
+                lines.append(f"{metric.name}_sum{_format_labels(label_pairs)} {value['sum']}")
+                lines.append(f"{metric.name}_count{_format_labels(label_pairs)} {value['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ''
+    escaped = []
+    for key, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+# 创建全局指标注册表
+metrics = MetricsRegistry()
+
+# 流式回复
+AGENT_TIME_TO_FIRST_CHUNK = metrics.histogram(
+    'agent_time_to_first_chunk_seconds', 'agent 开始处理到第一个分片广播的时间', ['agent_type'])
+AGENT_RESPONSE_DURATION = metrics.histogram(
+    'agent_response_duration_seconds', 'agent 回复的总耗时', ['agent_type'])
+RESPONSE_CHUNKS = metrics.histogram(
+    'agent_response_chunks', '每个回复广播的流式分片数', ['agent_type'], buckets=COUNT_BUCKETS)
+RESPONSE_BYTES = metrics.histogram(
+    'agent_response_bytes', '每个回复的内容字节数', ['agent_type'], buckets=SIZE_BUCKETS)
+AGENT_CANCELLATIONS = metrics.counter(
+    'agent_cancellations_total', '被取消（客户端取消、断开或超时）的 agent 运行次数', ['agent_type', 'reason'])
+
+# 调度
+QUEUE_WAIT = metrics.histogram(
+    'agent_queue_wait_seconds', 'agent 任务的排队等待时间', ['agent_type'])
+
+# 持久化
+DB_COMMIT_LATENCY = metrics.histogram(
+    'db_commit_seconds', '消息写入数据库的提交耗时', ['mode'])
+
+# 广播
+BROADCAST_FAILURES = metrics.counter(
+    'broadcast_failures_total', '房间广播中发送失败的次数', ['reason'])
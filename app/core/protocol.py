@@ -0,0 +1,96 @@
+import json
+import zlib
+from typing import Any, Optional
+
+# 默认的 JSON 协议：每帧都是完整的消息
+PROTOCOL_JSON = 1
+# 紧凑的增量协议：短类型码 + 流内序号，流式帧只携带增量内容
+PROTOCOL_DELTA = 2
+
+SUPPORTED_PROTOCOLS = (PROTOCOL_JSON, PROTOCOL_DELTA)
+
+# 增量协议的帧类型码
+CODE_HELLO = 'h'      # 协议确认
+CODE_MESSAGE = 'm'    # 完整消息（用户消息、系统消息、错误等）
+CODE_RESULT = 'd'     # 结果内容增量
+CODE_THINKING = 'k'   # 思考过程增量
+CODE_END = 'e'        # 流结束，携带长度和校验和；被截断的回复另带截断原因 x
+
+# 非首帧只携带消息 id 的前缀，足以区分同一房间内并发的流
+SHORT_ID_LENGTH = 8
+
+
+def negotiate_protocol(requested: Any) -> int:
+    """根据客户端请求的版本选择协议，不支持时回退到默认 JSON 协议"""
+    try:
+        version = int(requested)
+    except (TypeError, ValueError):
+        return PROTOCOL_JSON
+    return version if version in SUPPORTED_PROTOCOLS else PROTOCOL_JSON
+
+
+def checksum(content: str) -> str:
+    """计算内容的 CRC32 校验和（十六进制）"""
+    return format(zlib.crc32(content.encode('utf-8')) & 0xffffffff, '08x')
+
+
+def _dumps(frame: dict) -> str:
+    return json.dumps(frame, ensure_ascii=False, separators=(',', ':'))
+
+
+def hello_frame(protocol: int) -> Optional[str]:
+    """连接建立后发送的协议确认帧，默认协议不发送"""
+    if protocol == PROTOCOL_DELTA:
+        return _dumps({'t': CODE_HELLO, 'v': protocol})
+    return None
+
+
+def encode_message(message: Any, protocol: int = PROTOCOL_JSON) -> str:
+    """按协议版本编码消息"""
+    if isinstance(message, str):
+        return message
+    if protocol != PROTOCOL_DELTA:
+        return json.dumps(message)
+    return _dumps(_to_delta_frame(message))
+
+
+def _to_delta_frame(message: dict) -> dict:
+    msg_id = message.get('id')
+
+    if not message.get('is_stream'):
+        frame = {
+            't': CODE_MESSAGE,
+            'y': message.get('type'),
+            'r': message.get('role'),
+            'c': message.get('content', ''),
+        }
+        if msg_id:
+            frame['i'] = msg_id
+        if message.get('timestamp'):
+            frame['ts'] = message['timestamp']
+        return frame
+
+    seq = message.get('seq', 0)
+    # 流的第一帧（包括合并了第一帧的帧）携带完整 id，之后只携带短 id
+    frame_id = msg_id if message.get('seq_from', seq) == 0 else (msg_id or '')[:SHORT_ID_LENGTH]
+
+    if message.get('is_end'):
+        # 结束帧不再重复完整内容，只携带长度和校验和供客户端核对
+        content = message.get('content', '')
+        frame = {
+            't': CODE_END,
+            'i': frame_id,
+            's': seq,
+            'n': len(content),
+            'h': checksum(content),
+        }
+        if message.get('stop_reason'):
+            frame['x'] = message['stop_reason']
+        return frame
+
+    return {
+        't': CODE_THINKING if message.get('is_thinking') else CODE_RESULT,
+        'i': frame_id,
+        's': seq,
+        'c': message.get('content', ''),
+    }
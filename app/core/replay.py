@@ -0,0 +1,271 @@
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, List, Optional, Tuple
+
+from config.settings import config
+
+# 续传结果，随 resume 消息发送给重连的客户端
+RESUME_REPLAYED = 'replayed'  # 错过的帧全部补发
+RESUME_PARTIAL = 'partial'    # 最早的一部分帧已被淘汰，只补发保留的帧，完整内容以结束帧和历史消息为准
+RESUME_EXPIRED = 'expired'    # 缓冲区中已没有该回复，需要从历史消息读取
+
+# 不需要完整 id，前缀足以在房间内定位回复（与增量协议的短 id 一致）
+MIN_ID_PREFIX = 8
+
+
+def parse_last_seen(value: Any) -> Optional[Tuple[str, int]]:
+    """
+    解析重连时携带的 last_seen
+
+    支持 JSON 对象 {"msg_id": "...", "seq": 12}（也接受 id / i 和 s 作为键）
+    和 "msg_id:seq" 两种形式；没有 seq 时表示该回复的帧一个都没有收到。
+
+    Returns:
+        (msg_id, seq)；为空或格式不正确时返回 None
+    """
+    if not value:
+        return None
+    msg_id, seq = None, -1
+    try:
+        data = json.loads(value) if isinstance(value, str) else value
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        msg_id = data.get('msg_id') or data.get('id') or data.get('i')
+        seq = data.get('seq', data.get('s', -1))
+    elif isinstance(value, str):
+        msg_id, _, tail = value.partition(':')
+        seq = tail or -1
+    try:
+        seq = int(seq)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(msg_id, str) or not msg_id:
+        return None
+    return msg_id, seq
+
+
+class ReplayStream:
+    """一次流式回复的重放缓冲区
+
+    按帧序号保存已广播的帧，超过帧数或内容长度上限时从最旧的帧开始丢弃。
+    帧在锁内记录并放入发件队列，由发布方在锁外按顺序广播（同一时刻只有一个线程在广播）。
+    续传时持有锁等待正在广播的帧完成，只补发已广播的帧并注册连接，
+    发件队列中剩下的帧随后由实时广播送达，补发和实时广播之间不会遗漏或重复。
+    """
+
+    def __init__(self, room_id: str, msg_id: str, max_frames: int, max_chars: int):
+        self.room_id = room_id
+        self.msg_id = msg_id
+        self.max_frames = max_frames
+        self.max_chars = max_chars
+        self.lock = threading.Lock()
+        self._cond = threading.Condition(self.lock)
+        self.frames: Deque[Tuple[int, dict, int]] = deque()
+        # 已记录、尚未广播的帧；发布方在锁外依次广播
+        self._outbox: Deque[Tuple[int, dict, Callable[[dict], None]]] = deque()
+        self._draining = False
+        self._in_flight = False
+        self._resuming = 0
+        self.sent_seq = -1
+        self.chars = 0
+        self.next_seq = 0
+        self.dropped = 0
+        self.ended_at: Optional[float] = None
+
+    @property
+    def ended(self) -> bool:
+        return self.ended_at is not None
+
+    def publish(self, message: dict, send: Callable[[dict], None]) -> None:
+        """记录一帧并通过 send 在锁外广播；结束帧和错误消息结束该流"""
+        with self.lock:
+            seq = message.get('seq', self.next_seq)
+            size = len(message.get('content') or '')
+            self.frames.append((seq, message, size))
+            self.chars += size
+            self.next_seq = seq + 1
+            while len(self.frames) > 1 and (len(self.frames) > self.max_frames or self.chars > self.max_chars):
+                _seq, _message, dropped_size = self.frames.popleft()
+                self.chars -= dropped_size
+                self.dropped += 1
+            if message.get('is_end') or not message.get('is_stream'):
+                self.ended_at = time.monotonic()
+            self._outbox.append((seq, message, send))
+            # 其他线程正在广播时由它按顺序发出这一帧
+            if self._draining:
+                return
+            self._draining = True
+        self._drain()
+
+    def _drain(self) -> None:
+        """按记录顺序广播发件队列中的帧，send 在锁外调用"""
+        try:
+            while True:
+                with self._cond:
+                    # 让等待中的续传先完成补发和注册
+                    self._cond.wait_for(lambda: not self._resuming)
+                    if not self._outbox:
+                        self._draining = False
+                        return
+                    seq, message, send = self._outbox.popleft()
+                    self._in_flight = True
+                try:
+                    send(message)
+                finally:
+                    with self._cond:
+                        self._in_flight = False
+                        self.sent_seq = seq
+                        self._cond.notify_all()
+        except BaseException:
+            with self._cond:
+                self._draining = False
+            raise
+
+    def attach(self, seq: int, attach: Callable[[List[dict], bool], None]) -> int:
+        """
+        续传：等待正在广播的帧完成后，在锁内调用 attach(错过的帧, 是否连续)
+
+        只补发已经广播过的帧，发件队列中尚未广播的帧会在 attach 注册连接之后广播给它。
+
+        Returns:
+            补发的帧数
+        """
+        with self._cond:
+            self._resuming += 1
+            try:
+                self._cond.wait_for(lambda: not self._in_flight)
+            finally:
+                self._resuming -= 1
+            frames, complete = self.frames_after(seq)
+            try:
+                attach(frames, complete)
+            finally:
+                self._cond.notify_all()
+        return len(frames)
+
+    def frames_after(self, seq: int) -> Tuple[List[dict], bool]:
+        """序号大于 seq 的已广播帧，以及这些帧是否连续（中间没有被淘汰的帧）；调用方需持有 lock"""
+        frames = [message for frame_seq, message, _size in self.frames if seq < frame_seq <= self.sent_seq]
+        first_seq = self.frames[0][0] if self.frames else self.next_seq
+        return frames, first_seq <= seq + 1
+
+    def stats(self) -> dict:
+        return {
+            'room_id': self.room_id,
+            'frames': len(self.frames),
+            'chars': self.chars,
+            'next_seq': self.next_seq,
+            'dropped': self.dropped,
+            'ended': self.ended
+        }
+
+
+class ReplayBuffer:
+    """按回复 id 索引的有界重放缓冲区
+
+    - 每个回复最多保留 max_frames 帧、max_chars 个字符
+    - 最多保留 max_streams 个回复，超出时淘汰最早开始的回复
+    - 回复结束 ttl 秒后淘汰，客户端需在这段时间内重连
+    只保存在产生回复的进程中，多进程部署时续传需要连回同一个进程。
+    """
+
+    def __init__(self, max_streams: int = 500, max_frames: int = 2048, max_chars: int = 65536, ttl: float = 120.0):
+        self.max_streams = max(1, max_streams)
+        self.max_frames = max(1, max_frames)
+        self.max_chars = max(1, max_chars)
+        self.ttl = ttl
+        self._streams: "OrderedDict[str, ReplayStream]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.resumes = {RESUME_REPLAYED: 0, RESUME_PARTIAL: 0, RESUME_EXPIRED: 0}
+        self.replayed_frames = 0
+        self.evicted = 0
+
+    def open(self, room_id: str, msg_id: str) -> ReplayStream:
+        """为一次回复创建缓冲区"""
+        stream = ReplayStream(room_id, msg_id, self.max_frames, self.max_chars)
+        with self._lock:
+            self._prune_locked()
+            self._streams[msg_id] = stream
+            while len(self._streams) > self.max_streams:
+                self._streams.popitem(last=False)
+                self.evicted += 1
+        return stream
+
+    def _prune_locked(self) -> None:
+        """淘汰已结束超过 ttl 的回复；按开始顺序检查，遇到未过期的回复即停止"""
+        now = time.monotonic()
+        while self._streams:
+            stream = next(iter(self._streams.values()))
+            if not stream.ended or now - stream.ended_at < self.ttl:
+                break
+            self._streams.popitem(last=False)
+            self.evicted += 1
+
+    def _find_locked(self, room_id: str, msg_id: str) -> Optional[ReplayStream]:
+        stream = self._streams.get(msg_id)
+        if stream is None and len(msg_id) >= MIN_ID_PREFIX:
+            # 只有短 id 时在房间内按前缀查找，取最近开始的回复
+            for candidate in reversed(self._streams.values()):
+                if candidate.room_id == room_id and candidate.msg_id.startswith(msg_id):
+                    stream = candidate
+                    break
+        if stream is None or stream.room_id != room_id:
+            return None
+        if stream.ended and time.monotonic() - stream.ended_at >= self.ttl:
+            return None
+        return stream
+
+    def resume(self, room_id: str, msg_id: str, seq: int,
+               attach: Callable[[Optional[str], str, List[dict]], None]) -> str:
+        """
+        续传一次回复
+
+        在回复的锁内调用 attach(完整 id, 续传结果, 错过的帧)，此时没有正在广播的帧，
+        attach 负责把帧放入新连接的发送队列并把连接加入房间，之后的帧由实时广播送达。
+
+        Returns:
+            续传结果：replayed / partial / expired
+        """
+        with self._lock:
+            stream = self._find_locked(room_id, msg_id)
+        if stream is None:
+            attach(None, RESUME_EXPIRED, [])
+            status = RESUME_EXPIRED
+        else:
+            result = {}
+
+            def attach_stream(frames: List[dict], complete: bool) -> None:
+                result['status'] = RESUME_REPLAYED if complete else RESUME_PARTIAL
+                attach(stream.msg_id, result['status'], frames)
+
+            self.replayed_frames += stream.attach(seq, attach_stream)
+            status = result['status']
+        self.resumes[status] += 1
+        return status
+
+    def stats(self) -> dict:
+        with self._lock:
+            streams = list(self._streams.values())
+        return {
+            'streams': len(streams),
+            'active': sum(1 for stream in streams if not stream.ended),
+            'frames': sum(len(stream.frames) for stream in streams),
+            'chars': sum(stream.chars for stream in streams),
+            'max_streams': self.max_streams,
+            'evicted': self.evicted,
+            'resumes': dict(self.resumes),
+            'replayed_frames': self.replayed_frames
+        }
+
+
+# 创建全局重放缓冲区实例
+replay_buffer = ReplayBuffer(
+    max_streams=config.REPLAY_MAX_STREAMS,
+    max_frames=config.REPLAY_MAX_FRAMES,
+    max_chars=config.REPLAY_MAX_CHARS,
+    ttl=config.REPLAY_TTL
+)
@@ -0,0 +1,143 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config.settings import config
+from .stream import StreamEvent
+
+# 归一化时去掉的结尾标点，"北京今天天气怎么样？" 与 "北京今天天气怎么样" 视为同一问题
+_TRAILING_PUNCTUATION = '?？!！.。~～…'
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_message(message: str) -> str:
+    """归一化用户消息作为缓存键：全半角统一、大小写、空白和结尾标点"""
+    text = unicodedata.normalize('NFKC', message or '')
+    text = _WHITESPACE.sub(' ', text).strip().lower()
+    return text.rstrip(_TRAILING_PUNCTUATION).strip()
+
+
+class _TypeCache:
+    """单个 agent 类型的缓存分区"""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        # 归一化消息 -> (过期时间, 事件列表)
+        self.entries: "OrderedDict[str, Tuple[float, List[StreamEvent]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bypasses = 0
+
+
+class ResponseCache:
+    """agent 回复缓存
+
+    按 agent 类型分区，每个类型有独立的 TTL 和容量上限（LRU 淘汰），
+    只对配置中列出的 agent 类型启用。缓存的是 agent 产出的事件序列而不是最终文本，
+    命中时按原顺序重放，客户端收到的帧与实际运行时一致。
+    缓存键只有归一化后的消息，命中时不会经过房间的环境和对话历史，结果在所有房间间共享，
+    只应为回复只取决于当前消息的 agent 启用（天气、聊天等依赖上下文的 agent 不应列出）。
+    """
+
+    def __init__(self, type_settings: Optional[Dict[str, dict]] = None,
+                 default_ttl: float = 300.0, default_max_size: int = 256):
+        self.type_settings = dict(type_settings or {})
+        self.default_ttl = default_ttl
+        self.default_max_size = default_max_size
+        self._lock = threading.Lock()
+        self._caches: Dict[str, _TypeCache] = {}
+
+    def enabled_for(self, agent_type: str) -> bool:
+        return agent_type in self.type_settings
+
+    def _cache_for(self, agent_type: str) -> _TypeCache:
+        cache = self._caches.get(agent_type)
+        if cache is None:
+            settings = self.type_settings.get(agent_type) or {}
+            cache = self._caches[agent_type] = _TypeCache(
+                ttl=settings.get('ttl', self.default_ttl),
+                max_size=settings.get('max_size', self.default_max_size)
+            )
+        return cache
+
+    def get(self, agent_type: str, message: str) -> Optional[List[StreamEvent]]:
+        """查找缓存的事件序列，未命中或已过期时返回 None"""
+        if not self.enabled_for(agent_type):
+            return None
+        key = normalize_message(message)
+        with self._lock:
+            cache = self._cache_for(agent_type)
+            entry = cache.entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del cache.entries[key]
+                cache.expirations += 1
+                entry = None
+            if entry is None:
+                cache.misses += 1
+                return None
+            cache.entries.move_to_end(key)
+            cache.hits += 1
+            return list(entry[1])
+
+    def record_bypass(self, agent_type: str) -> None:
+        """记录一次客户端要求跳过缓存的请求"""
+        if not self.enabled_for(agent_type):
+            return
+        with self._lock:
+            self._cache_for(agent_type).bypasses += 1
+
+    def put(self, agent_type: str, message: str, events: List[StreamEvent]) -> None:
+        """保存一次完整回复的事件序列"""
+        if not self.enabled_for(agent_type) or not events:
+            return
+        key = normalize_message(message)
+        with self._lock:
+            cache = self._cache_for(agent_type)
+            cache.entries[key] = (time.monotonic() + cache.ttl, list(events))
+            cache.entries.move_to_end(key)
+            cache.stores += 1
+            while len(cache.entries) > cache.max_size:
+                cache.entries.popitem(last=False)
+                cache.evictions += 1
+
+    def clear(self, agent_type: Optional[str] = None) -> None:
+        with self._lock:
+            if agent_type is None:
+                for cache in self._caches.values():
+                    cache.entries.clear()
+            elif agent_type in self._caches:
+                self._caches[agent_type].entries.clear()
+
+    def stats(self) -> dict:
+        """各 agent 类型的命中、未命中和淘汰统计"""
+        with self._lock:
+            return {
+                agent_type: {
+                    'size': len(cache.entries),
+                    'max_size': cache.max_size,
+                    'ttl': cache.ttl,
+                    'hits': cache.hits,
+                    'misses': cache.misses,
+                    'hit_rate': cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0.0,
+                    'stores': cache.stores,
+                    'evictions': cache.evictions,
+                    'expirations': cache.expirations,
+                    'bypasses': cache.bypasses
+                }
+                for agent_type, cache in self._caches.items()
+            }
+
+
+# 创建全局回复缓存实例
+response_cache = ResponseCache(
+    type_settings=config.RESPONSE_CACHE,
+    default_ttl=config.RESPONSE_CACHE_TTL,
+    default_max_size=config.RESPONSE_CACHE_SIZE
+)
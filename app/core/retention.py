@@ -0,0 +1,370 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy import and_, func, or_
+
+from app.models import ChatMessage, ChatRoom, db, room_cache
+from .archive import MessageArchive, message_archive
+from .message_writer import message_writer
+
+logger = logging.getLogger(__name__)
+
+# 删除任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# 保留的已结束删除任务数
+MAX_FINISHED_JOBS = 100
+
+# 清理时读取并归档的列
+_MESSAGE_COLUMNS = (ChatMessage.id, ChatMessage.type, ChatMessage.content, ChatMessage.role,
+                    ChatMessage.timestamp, ChatMessage.stop_reason)
+
+
+class RetentionPolicy:
+    """一个 agent 类型的保留策略：保留天数和每个房间的行数上限（0 表示不限），以及清理前是否归档"""
+    __slots__ = ('ttl_days', 'max_rows', 'archive')
+
+    def __init__(self, ttl_days: float = 0, max_rows: int = 0, archive: bool = True):
+        self.ttl_days = ttl_days
+        self.max_rows = max_rows
+        self.archive = archive
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.ttl_days or self.max_rows)
+
+    def cutoff(self, now: datetime) -> Optional[datetime]:
+        """早于该时间的消息超出保留期，不限天数时返回 None"""
+        return now - timedelta(days=self.ttl_days) if self.ttl_days else None
+
+    def to_dict(self) -> dict:
+        return {'ttl_days': self.ttl_days, 'max_rows': self.max_rows, 'archive': self.archive}
+
+
+class RetentionManager:
+    """消息保留和房间删除的后台任务
+
+    - 清理：每隔 interval 秒按 agent 类型的保留策略找出超期或超出行数上限的房间，
+      从最旧的消息开始每次处理 batch_size 条：先追加到房间的归档，再按 id 删除并提交，
+      批次之间暂停 batch_pause 秒让出 SQLite 写锁；每轮最多 max_batches 批，剩余的下一轮继续
+    - 删除房间：接口只把房间标记为已删除，由后台线程分批删除消息后再删除房间和归档；
+      标记保存在数据库中，进程重启后未完成的删除会继续执行
+    删除任务优先于清理执行，二者在同一个线程中串行，不会同时占用写锁。
+    """
+
+    def __init__(self, archive: MessageArchive = message_archive):
+        self.app = None
+        self.archive = archive
+        self.default_policy = RetentionPolicy()
+        self.type_policies: Dict[str, RetentionPolicy] = {}
+        self.interval = 0.0
+        self.batch_size = 500
+        self.batch_pause = 0.05
+        self.max_batches = 200
+
+        self._cond = threading.Condition()
+        self._queue: Deque[str] = deque()
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._next_prune: Optional[float] = None
+
+        self.cycles = 0
+        self.pruned = 0
+        self.archived = 0
+        self.deleted_rooms = 0
+        self.deleted_messages = 0
+        self.last_cycle: dict = {}
+
+    def init_app(self, app) -> None:
+        """读取保留策略，继续执行未完成的房间删除，按需启动后台线程；需在建表之后调用"""
+        self.app = app
+        self.default_policy = RetentionPolicy(
+            ttl_days=app.config.get('RETENTION_TTL_DAYS', 0),
+            max_rows=app.config.get('RETENTION_MAX_ROWS', 0),
+            archive=app.config.get('RETENTION_ARCHIVE', True)
+        )
+        self.type_policies = {
+            agent_type: RetentionPolicy(
+                ttl_days=settings.get('ttl_days', self.default_policy.ttl_days),
+                max_rows=settings.get('max_rows', self.default_policy.max_rows),
+                archive=settings.get('archive', self.default_policy.archive)
+            )
+            for agent_type, settings in (app.config.get('RETENTION') or {}).items()
+        }
+        self.interval = app.config.get('RETENTION_INTERVAL', 0)
+        self.batch_size = max(1, app.config.get('RETENTION_BATCH_SIZE', self.batch_size))
+        self.batch_pause = app.config.get('RETENTION_BATCH_PAUSE', self.batch_pause)
+        self.max_batches = max(1, app.config.get('RETENTION_MAX_BATCHES', self.max_batches))
+        self._stopping = False
+
+        with app.app_context():
+            pending = [room_id for (room_id,) in
+                       db.session.query(ChatRoom.id).filter(ChatRoom.deleted_at.isnot(None)).all()]
+        for room_id in pending:
+            self.delete_room(room_id)
+        if pending:
+            logger.info(f"继续删除 {len(pending)} 个已标记删除的房间")
+
+        with self._cond:
+            if self.interval > 0:
+                self._next_prune = time.monotonic() + self.interval
+                self._ensure_thread_locked()
+
+    def policy_for(self, agent_type: str) -> RetentionPolicy:
+        return self.type_policies.get(agent_type, self.default_policy)
+
+    def _ensure_thread_locked(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+            self._thread.start()
+
+    def delete_room(self, room_id: str) -> dict:
+        """排队删除已标记删除的房间，返回删除任务的状态"""
+        with self._cond:
+            job = self._jobs.get(room_id)
+            if job is not None and job['status'] in (JOB_QUEUED, JOB_RUNNING):
+                return dict(job)
+            job = {'room_id': room_id, 'status': JOB_QUEUED, 'messages': 0, 'queued_at': datetime.utcnow().isoformat()}
+            self._jobs[room_id] = job
+            self._jobs.move_to_end(room_id)
+            self._queue.append(room_id)
+            if not self._stopping:
+                self._ensure_thread_locked()
+            self._cond.notify_all()
+            return dict(job)
+
+    def deletion_status(self, room_id: str) -> Optional[dict]:
+        with self._cond:
+            job = self._jobs.get(room_id)
+            return dict(job) if job is not None else None
+
+    def _run(self) -> None:
+        """后台线程主循环：优先执行删除任务，到时间后执行一轮清理"""
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    if self._next_prune is None:
+                        self._cond.wait()
+                        continue
+                    remaining = self._next_prune - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+                room_id = self._queue.popleft() if self._queue else None
+
+            if room_id is not None:
+                self._run_job(room_id)
+                continue
+            try:
+                self.prune()
+            except Exception as e:
+                logger.error(f"清理消息失败: {e}")
+            with self._cond:
+                self._next_prune = time.monotonic() + self.interval if self.interval > 0 else None
+
+    def _run_job(self, room_id: str) -> None:
+        with self._cond:
+            job = self._jobs[room_id]
+            job['status'] = JOB_RUNNING
+        try:
+            with self.app.app_context():
+                try:
+                    deleted = self._delete_room(room_id, job)
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            # 房间仍标记为已删除，下次启动时重试
+            logger.error(f"删除房间 {room_id} 失败: {e}")
+            with self._cond:
+                job.update(status=JOB_FAILED, error=str(e), finished_at=datetime.utcnow().isoformat())
+            return
+        with self._cond:
+            job.update(status=JOB_DONE, finished_at=datetime.utcnow().isoformat())
+            self.deleted_rooms += 1
+            self.deleted_messages += deleted
+            self._trim_jobs_locked()
+
+    def _trim_jobs_locked(self) -> None:
+        finished = [room_id for room_id, job in self._jobs.items() if job['status'] in (JOB_DONE, JOB_FAILED)]
+        for room_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[room_id]
+
+    def _delete_room(self, room_id: str, job: dict) -> int:
+        """分批删除房间的消息，然后删除房间和归档"""
+        # 先等待排队中的消息写入，避免删除后又被写回
+        message_writer.flush(room_id)
+        deleted = self._delete_messages(room_id, job)
+        # 删除期间结束的运行可能又写入了回复
+        message_writer.flush(room_id)
+        deleted += self._delete_messages(room_id, job)
+
+        db.session.execute(ChatRoom.__table__.delete().where(ChatRoom.id == room_id))
+        db.session.commit()
+        self.archive.delete(room_id)
+        room_cache.invalidate(room_id)
+        return deleted
+
+    def _delete_messages(self, room_id: str, job: dict) -> int:
+        deleted = 0
+        while True:
+            ids = [msg_id for (msg_id,) in db.session.query(ChatMessage.id).filter(
+                ChatMessage.room_id == room_id
+            ).limit(self.batch_size).all()]
+            if not ids:
+                return deleted
+            db.session.query(ChatMessage).filter(ChatMessage.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += len(ids)
+            with self._cond:
+                job['messages'] += len(ids)
+            if len(ids) < self.batch_size:
+                return deleted
+            time.sleep(self.batch_pause)
+
+    def prune(self, now: Optional[datetime] = None) -> dict:
+        """
+        执行一轮清理（后台线程定期调用，也可手动调用）
+
+        Returns:
+            本轮处理的房间数、清理和归档的消息数、批次数和耗时
+        """
+        now = now or datetime.utcnow()
+        started = time.perf_counter()
+        result = {'rooms': 0, 'pruned': 0, 'archived': 0, 'batches': 0}
+        with self.app.app_context():
+            try:
+                for room_id, policy in self._candidates(now):
+                    if result['batches'] >= self.max_batches or self._stopping:
+                        break
+                    pruned, archived, batches = self._prune_room(room_id, policy, now,
+                                                                 self.max_batches - result['batches'])
+                    if pruned:
+                        result['rooms'] += 1
+                    result['pruned'] += pruned
+                    result['archived'] += archived
+                    result['batches'] += batches
+            finally:
+                db.session.remove()
+        result['elapsed'] = time.perf_counter() - started
+        with self._cond:
+            self.cycles += 1
+            self.pruned += result['pruned']
+            self.archived += result['archived']
+            self.last_cycle = dict(result, finished_at=datetime.utcnow().isoformat())
+        return result
+
+    def _candidates(self, now: datetime) -> List[tuple]:
+        """超出保留期或行数上限的房间及其策略；已标记删除的房间由删除任务处理"""
+        groups = [(ChatRoom.agent_type == agent_type, policy) for agent_type, policy in self.type_policies.items()]
+        if self.type_policies:
+            groups.append((ChatRoom.agent_type.notin_(list(self.type_policies)), self.default_policy))
+        else:
+            groups.append((None, self.default_policy))
+
+        candidates = {}
+        for type_filter, policy in groups:
+            if not policy.enabled:
+                continue
+            base = db.session.query(ChatMessage.room_id).join(ChatRoom, ChatRoom.id == ChatMessage.room_id).filter(
+                ChatRoom.deleted_at.is_(None)
+            )
+            if type_filter is not None:
+                base = base.filter(type_filter)
+            cutoff = policy.cutoff(now)
+            if cutoff is not None:
+                for (room_id,) in base.filter(ChatMessage.timestamp < cutoff).distinct().all():
+                    candidates[room_id] = policy
+            if policy.max_rows:
+                for (room_id,) in base.group_by(ChatMessage.room_id).having(
+                    func.count(ChatMessage.id) > policy.max_rows
+                ).all():
+                    candidates[room_id] = policy
+        return list(candidates.items())
+
+    def _prune_room(self, room_id: str, policy: RetentionPolicy, now: datetime, max_batches: int) -> tuple:
+        """从最旧的消息开始分批归档并删除超出策略的消息，返回 (删除数, 归档数, 批次数)"""
+        conditions = []
+        cutoff = policy.cutoff(now)
+        if cutoff is not None:
+            conditions.append(ChatMessage.timestamp < cutoff)
+        if policy.max_rows:
+            # 从新到旧第 max_rows + 1 条及更早的消息超出上限
+            boundary = db.session.query(ChatMessage.timestamp, ChatMessage.id).filter(
+                ChatMessage.room_id == room_id
+            ).order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).offset(policy.max_rows).limit(1).first()
+            if boundary is not None:
+                conditions.append(or_(
+                    ChatMessage.timestamp < boundary.timestamp,
+                    and_(ChatMessage.timestamp == boundary.timestamp, ChatMessage.id <= boundary.id)
+                ))
+        if not conditions:
+            return 0, 0, 0
+
+        pruned = archived = batches = 0
+        while batches < max_batches and not self._stopping:
+            rows = db.session.query(*_MESSAGE_COLUMNS).filter(
+                ChatMessage.room_id == room_id, or_(*conditions)
+            ).order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc()).limit(self.batch_size).all()
+            if not rows:
+                break
+            try:
+                # 先归档再删除，归档失败时保留数据库中的消息
+                if policy.archive:
+                    archived += self.archive.append(room_id, [
+                        dict(row._asdict(), timestamp=row.timestamp.isoformat()) for row in rows
+                    ])
+                db.session.query(ChatMessage).filter(
+                    ChatMessage.id.in_([row.id for row in rows])
+                ).delete(synchronize_session=False)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"清理房间 {room_id} 的消息失败: {e}")
+                break
+            pruned += len(rows)
+            batches += 1
+            if len(rows) < self.batch_size:
+                break
+            time.sleep(self.batch_pause)
+        return pruned, archived, batches
+
+    def shutdown(self, timeout: Optional[float] = 10.0) -> None:
+        """停止后台线程；正在处理的批次提交后退出，未完成的删除在下次启动时继续"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'default_policy': self.default_policy.to_dict(),
+                'type_policies': {agent_type: policy.to_dict() for agent_type, policy in self.type_policies.items()},
+                'interval': self.interval,
+                'batch_size': self.batch_size,
+                'cycles': self.cycles,
+                'pruned': self.pruned,
+                'archived': self.archived,
+                'last_cycle': dict(self.last_cycle),
+                'deleted_rooms': self.deleted_rooms,
+                'deleted_messages': self.deleted_messages,
+                'pending_deletions': len(self._queue),
+                'jobs': [dict(job) for job in self._jobs.values()],
+                'archive': self.archive.stats()
+            }
+
+
+# 创建全局消息保留管理器实例
+retention_manager = RetentionManager()
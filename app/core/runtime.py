@@ -0,0 +1,193 @@
+import asyncio
+import itertools
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Coroutine, Generator, Hashable, List, Optional
+
+from config.settings import config
+from .cancellation import CANCEL_TIMEOUT, CancelToken
+from .stream import StreamChannel
+
+logger = logging.getLogger(__name__)
+
+
+class _LoopWorker:
+    """单个长期运行的事件循环及其所在线程"""
+
+    def __init__(self, name: str):
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+        self._ready.wait()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._ready.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            # 取消仍在运行的任务，保证 finally 块得以执行
+            pending = asyncio.all_tasks(self.loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+
+async def _pump(agen: AsyncIterator, channel: StreamChannel, cancel_token: Optional[CancelToken] = None) -> None:
+    """把异步生成器的结果写入通道；有界通道使消费过慢时协程在 aput 处挂起，而不是无限堆积
+
+    指定取消令牌时，令牌被取消（或到达截止时间）后协程被取消，通道正常关闭，
+    消费方收到取消前已产出的部分结果。
+    """
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    timer = None
+    on_cancel = None
+    if cancel_token is not None:
+        def on_cancel():
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(task.cancel)
+
+        cancel_token.add_callback(on_cancel)
+        remaining = cancel_token.remaining()
+        if remaining is not None:
+            timer = loop.call_later(max(0.0, remaining), cancel_token.cancel, CANCEL_TIMEOUT)
+    try:
+        async for item in agen:
+            await channel.aput(item)
+    except BaseException as e:
+        channel.close(None if isinstance(e, asyncio.CancelledError) else e)
+        # 在 aput 处被取消时生成器仍挂起在 yield，主动关闭以执行其中的清理（如取消 agent 任务）
+        aclose = getattr(agen, 'aclose', None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception:
+                pass
+        raise
+    else:
+        channel.close()
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if on_cancel is not None:
+            cancel_token.remove_callback(on_cancel)
+
+
+class AgentRuntime:
+    """Agent 共享运行时
+
+    维护少量长期运行的事件循环，所有 agent 的协程都提交到这里执行，
+    避免每条消息都新建线程和事件循环，HTTP/LLM 客户端状态也可以在循环内复用。
+    """
+
+    def __init__(self, num_loops: int = 1):
+        self.num_loops = max(1, num_loops)
+        self._workers: List[_LoopWorker] = []
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._closed = False
+
+    def _ensure_started(self) -> List[_LoopWorker]:
+        """按需启动事件循环线程"""
+        if self._workers:
+            return self._workers
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Agent 运行时已关闭")
+            if not self._workers:
+                self._workers = [
+                    _LoopWorker(name=f"agent_loop_{i}") for i in range(self.num_loops)
+                ]
+                logger.info(f"Agent 运行时已启动，事件循环数量: {self.num_loops}")
+        return self._workers
+
+    def _pick(self, key: Optional[Hashable] = None) -> _LoopWorker:
+        """选择事件循环：指定 key 时固定到同一个循环，否则轮询"""
+        workers = self._ensure_started()
+        if key is not None:
+            return workers[hash(key) % len(workers)]
+        return workers[next(self._counter) % len(workers)]
+
+    def in_runtime_thread(self) -> bool:
+        """当前线程是否为运行时的事件循环线程"""
+        current = threading.current_thread()
+        return any(worker.thread is current for worker in self._workers)
+
+    def get_loop(self, key: Optional[Hashable] = None) -> asyncio.AbstractEventLoop:
+        """获取用于执行协程的事件循环"""
+        return self._pick(key).loop
+
+    def submit(self, coro: Coroutine, key: Optional[Hashable] = None) -> Future:
+        """提交协程到共享事件循环，返回线程安全的 Future"""
+        try:
+            loop = self.get_loop(key)
+        except RuntimeError:
+            coro.close()
+            raise
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+    def run(self, coro: Coroutine, key: Optional[Hashable] = None, timeout: Optional[float] = None) -> Any:
+        """同步等待协程执行结果"""
+        if self.in_runtime_thread():
+            coro.close()
+            raise RuntimeError("不能在 agent 事件循环线程内同步等待协程")
+        return self.submit(coro, key=key).result(timeout)
+
+    def iterate(self, agen: AsyncIterator, key: Optional[Hashable] = None,
+                cancel_token: Optional[CancelToken] = None) -> Generator[Any, None, None]:
+        """在共享事件循环上消费异步生成器，以同步生成器的方式产出结果"""
+        if self.in_runtime_thread():
+            raise RuntimeError("不能在 agent 事件循环线程内同步迭代异步生成器")
+
+        channel = StreamChannel(maxsize=config.STREAM_CHANNEL_SIZE)
+        future = self.submit(_pump(agen, channel, cancel_token), key=key)
+        try:
+            yield from channel
+        finally:
+            # 消费方提前退出时取消协程
+            if not future.done():
+                future.cancel()
+
+    async def aiterate(self, agen: AsyncIterator, key: Optional[Hashable] = None,
+                       cancel_token: Optional[CancelToken] = None) -> AsyncIterator[Any]:
+        """在共享事件循环上消费异步生成器，在调用方所在的事件循环中异步产出结果"""
+        channel = StreamChannel(maxsize=config.STREAM_CHANNEL_SIZE)
+        future = self.submit(_pump(agen, channel, cancel_token), key=key)
+        try:
+            async for item in channel:
+                yield item
+        finally:
+            if not future.done():
+                future.cancel()
+
+    def shutdown(self, timeout: Optional[float] = 5.0) -> None:
+        """停止所有事件循环"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop(timeout)
+        if workers:
+            logger.info("Agent 运行时已关闭")
+
+
+# 创建全局 agent 运行时实例
+agent_runtime = AgentRuntime(num_loops=config.AGENT_RUNTIME_LOOPS)
+
+
+def get_agent_runtime() -> AgentRuntime:
+    """获取全局 agent 运行时"""
+    return agent_runtime
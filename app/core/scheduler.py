@@ -0,0 +1,368 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from .cancellation import CancelToken
+from .metrics import QUEUE_WAIT
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerRejected(RuntimeError):
+    """调度器队列已满或正在关闭，任务被拒绝"""
+    pass
+
+
+class _Task:
+    """排队中的任务"""
+    __slots__ = ('fn', 'args', 'kwargs', 'future', 'room_id', 'agent_type', 'enqueued_at')
+
+    def __init__(self, fn: Callable, args: tuple, kwargs: dict, room_id: str, agent_type: str):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.room_id = room_id
+        self.agent_type = agent_type
+        self.enqueued_at = time.monotonic()
+
+
+class _FairQueue:
+    """按 agent 类型和房间两级轮询的等待队列，AgentScheduler 与 AsyncAgentGate 共用
+
+    类型之间轮询，跳过已达到并发上限的类型；同一类型内按房间轮询，
+    一个房间的突发消息不会饿死其他房间。等待项需要有 room_id 和 agent_type 属性，
+    加锁由子类负责。
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, type_limits: Optional[Dict[str, int]]):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(1, max_queue)
+        self.type_limits = dict(type_limits or {})
+
+        # agent 类型 -> 房间 -> 等待队列
+        self._queues: Dict[str, "OrderedDict[str, Deque[Any]]"] = {}
+        self._type_order: Deque[str] = deque()
+        self._running: Dict[str, int] = {}
+        self._queued = 0
+
+    def type_limit(self, agent_type: str) -> int:
+        """agent 类型的并发上限，未配置时为总并发数"""
+        return min(self.type_limits.get(agent_type, self.max_workers), self.max_workers)
+
+    def _push_locked(self, item: Any) -> None:
+        rooms = self._queues.get(item.agent_type)
+        if rooms is None:
+            rooms = self._queues[item.agent_type] = OrderedDict()
+            self._type_order.append(item.agent_type)
+        rooms.setdefault(item.room_id, deque()).append(item)
+        self._queued += 1
+
+    def _remove_locked(self, item: Any) -> bool:
+        """把等待项移出队列，已经不在队列中（已被取出）时返回 False"""
+        rooms = self._queues.get(item.agent_type)
+        items = rooms.get(item.room_id) if rooms is not None else None
+        if items is None or item not in items:
+            return False
+        items.remove(item)
+        if not items:
+            del rooms[item.room_id]
+        if not rooms:
+            del self._queues[item.agent_type]
+            self._type_order.remove(item.agent_type)
+        self._queued -= 1
+        return True
+
+    def _pop_next_locked(self) -> Optional[Any]:
+        """按类型轮询，选出未达到并发上限的类型中下一个房间的等待项"""
+        for _ in range(len(self._type_order)):
+            agent_type = self._type_order[0]
+            self._type_order.rotate(-1)
+            if self._running.get(agent_type, 0) >= self.type_limit(agent_type):
+                continue
+
+            rooms = self._queues[agent_type]
+            room_id, items = next(iter(rooms.items()))
+            item = items.popleft()
+            # 房间移到队尾，实现房间之间的轮询
+            if items:
+                rooms.move_to_end(room_id)
+            else:
+                del rooms[room_id]
+            if not rooms:
+                del self._queues[agent_type]
+                self._type_order.remove(agent_type)
+            self._queued -= 1
+            return item
+        return None
+
+    def _clear_locked(self) -> List[Any]:
+        """清空队列，返回所有等待项"""
+        items = [item for rooms in self._queues.values() for queue in rooms.values() for item in queue]
+        self._queues.clear()
+        self._type_order.clear()
+        self._queued = 0
+        return items
+
+    def _queued_by_type_locked(self) -> Dict[str, int]:
+        return {
+            agent_type: sum(len(items) for items in rooms.values())
+            for agent_type, rooms in self._queues.items()
+        }
+
+
+class AgentScheduler(_FairQueue):
+    """agent 任务调度器
+
+    - 按 agent 类型限制并发，慢的 agent 不会占满所有工作线程
+    - 同一类型内按房间轮询，一个房间的突发消息不会饿死其他房间
+    - 排队总数有上限，超出时立即拒绝而不是无限堆积
+    - 记录每个任务的排队等待时间
+    """
+
+    def __init__(self, max_workers: int = 10, max_queue: int = 100,
+                 type_limits: Optional[Dict[str, int]] = None, thread_name_prefix: str = "agent_worker"):
+        super().__init__(max_workers, max_queue, type_limits)
+        self.thread_name_prefix = thread_name_prefix
+
+        self._cond = threading.Condition()
+        self._workers: List[threading.Thread] = []
+        self._shutdown = False
+
+        self.submitted = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def is_shutdown(self) -> bool:
+        return self._shutdown
+
+    def submit(self, room_id: str, agent_type: str, fn: Callable, *args: Any,
+               cancel_token: Optional[CancelToken] = None, **kwargs: Any) -> Future:
+        """提交任务，队列已满或正在关闭时抛出 SchedulerRejected
+
+        指定 cancel_token 时，令牌在任务开始前被取消会把任务移出队列并取消其 Future；
+        令牌同时作为 cancel_token 参数传给 fn，由 fn 负责运行中的取消。
+        """
+        if cancel_token is not None:
+            kwargs['cancel_token'] = cancel_token
+        task = _Task(fn, args, kwargs, room_id, agent_type)
+        with self._cond:
+            if self._shutdown:
+                raise SchedulerRejected("服务器正在关闭，无法处理新消息")
+            if self._queued >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerRejected("服务器繁忙，请稍后重试")
+
+            self._push_locked(task)
+            self.submitted += 1
+
+            self._ensure_workers_locked()
+            self._cond.notify()
+
+        if cancel_token is not None:
+            cancel_token.add_callback(lambda: self._cancel_queued(task))
+        return task.future
+
+    def _cancel_queued(self, task: _Task) -> None:
+        """把尚未开始的任务移出队列并取消；已经开始的任务不受影响"""
+        with self._cond:
+            if not self._remove_locked(task):
+                return
+            self.cancelled += 1
+        task.future.cancel()
+
+    def _ensure_workers_locked(self) -> None:
+        if self._workers:
+            return
+        for i in range(self.max_workers):
+            worker = threading.Thread(
+                target=self._run,
+                name=f"{self.thread_name_prefix}_{i}",
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _run(self) -> None:
+        """工作线程主循环"""
+        while True:
+            with self._cond:
+                while True:
+                    task = self._pop_next_locked()
+                    if task is not None:
+                        break
+                    if self._shutdown and self._queued == 0:
+                        return
+                    self._cond.wait()
+                self._running[task.agent_type] = self._running.get(task.agent_type, 0) + 1
+
+            try:
+                if task.future.set_running_or_notify_cancel():
+                    wait = time.monotonic() - task.enqueued_at
+                    self._record_wait(wait)
+                    QUEUE_WAIT.observe(wait, task.agent_type)
+                    logger.info(f"房间 {task.room_id} 的 {task.agent_type} 任务排队 {wait * 1000:.1f}ms")
+                    try:
+                        result = task.fn(*task.args, **task.kwargs)
+                    except BaseException as e:
+                        task.future.set_exception(e)
+                    else:
+                        task.future.set_result(result)
+            finally:
+                with self._cond:
+                    self._running[task.agent_type] -= 1
+                    self.completed += 1
+                    self._cond.notify_all()
+
+    def _record_wait(self, wait: float) -> None:
+        with self._cond:
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def stats(self) -> dict:
+        """调度器统计信息"""
+        with self._cond:
+            started = self.completed + sum(self._running.values())
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'queued': self._queued,
+                'running': dict(self._running),
+                'queued_by_type': self._queued_by_type_locked(),
+                'type_limits': {agent_type: self.type_limit(agent_type) for agent_type in self._running},
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'cancelled': self.cancelled,
+                'completed': self.completed,
+                'avg_wait_ms': self.total_wait / started * 1000 if started else 0.0,
+                'max_wait_ms': self.max_wait * 1000
+            }
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        """停止调度器；cancel_futures 为 True 时取消所有排队中的任务"""
+        with self._cond:
+            self._shutdown = True
+            if cancel_futures:
+                for task in self._clear_locked():
+                    task.future.cancel()
+            self._cond.notify_all()
+            workers = list(self._workers)
+        if wait:
+            for worker in workers:
+                worker.join()
+
+
+class AsyncAgentGate(_FairQueue):
+    """协程版本的准入控制，供 ASGI 模式使用
+
+    与 AgentScheduler 使用相同的并发配置和排队策略：总并发、按 agent 类型的并发上限、
+    类型和房间之间的轮询以及排队上限，但等待的是协程而不是线程。
+    只在创建它的事件循环中使用，不需要加锁。
+    """
+
+    def __init__(self, max_workers: int = 10, max_queue: int = 100, type_limits: Optional[Dict[str, int]] = None):
+        super().__init__(max_workers, max_queue, type_limits)
+        self._active = 0
+
+        self.submitted = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def admit(self, room_id: str, agent_type: str) -> "_GateSlot":
+        """申请执行名额，排队数超限时抛出 SchedulerRejected；进入 async with 时才开始排队"""
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise SchedulerRejected("服务器繁忙，请稍后重试")
+        self.submitted += 1
+        return _GateSlot(self, room_id, agent_type)
+
+    def _dispatch(self) -> None:
+        """总并发未满时按轮询顺序唤醒等待的协程"""
+        while self._active < self.max_workers:
+            slot = self._pop_next_locked()
+            if slot is None:
+                return
+            if slot._ready.cancelled():
+                # 等待的协程已被取消、还没来得及把自己移出队列
+                self.cancelled += 1
+                continue
+            self._running[slot.agent_type] = self._running.get(slot.agent_type, 0) + 1
+            self._active += 1
+            slot._ready.set_result(None)
+
+    def _release(self, slot: "_GateSlot") -> None:
+        self._running[slot.agent_type] -= 1
+        self._active -= 1
+        self.completed += 1
+        self._dispatch()
+
+    def stats(self) -> dict:
+        started = self.completed + self._active
+        return {
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'queued': self._queued,
+            'running': dict(self._running),
+            'queued_by_type': self._queued_by_type_locked(),
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'cancelled': self.cancelled,
+            'completed': self.completed,
+            'avg_wait_ms': self.total_wait / started * 1000 if started else 0.0,
+            'max_wait_ms': self.max_wait * 1000
+        }
+
+
+class _GateSlot:
+    """AsyncAgentGate 的执行名额，以 async with 使用"""
+
+    def __init__(self, gate: AsyncAgentGate, room_id: str, agent_type: str):
+        self.gate = gate
+        self.room_id = room_id
+        self.agent_type = agent_type
+        self.queue_wait = 0.0
+        self._ready: Optional[asyncio.Future] = None
+        self._acquired = False
+
+    async def __aenter__(self) -> "_GateSlot":
+        gate = self.gate
+        enqueued_at = time.monotonic()
+        self._ready = asyncio.get_running_loop().create_future()
+        gate._push_locked(self)
+        try:
+            gate._dispatch()
+            await self._ready
+        except BaseException:
+            # 仍在排队时移出队列；已经分到名额但还没开始执行时归还名额
+            if gate._remove_locked(self):
+                gate.cancelled += 1
+            elif self._ready.done() and not self._ready.cancelled():
+                gate._release(self)
+            raise
+        self._acquired = True
+
+        self.queue_wait = time.monotonic() - enqueued_at
+        gate.total_wait += self.queue_wait
+        gate.max_wait = max(gate.max_wait, self.queue_wait)
+        QUEUE_WAIT.observe(self.queue_wait, self.agent_type)
+        logger.info(f"房间 {self.room_id} 的 {self.agent_type} 任务排队 {self.queue_wait * 1000:.1f}ms")
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if self._acquired:
+            self._acquired = False
+            self.gate._release(self)
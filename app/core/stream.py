@@ -0,0 +1,279 @@
+import asyncio
+import threading
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, AsyncIterator, Deque, Iterator, List, Optional, Tuple
+
+
+class StreamEventType(str, Enum):
+    """流式事件类型"""
+    START = "start"
+    THINKING = "thinking"
+    RESULT = "result"
+    END = "end"
+    ERROR = "error"
+
+
+@dataclass
+class StreamEvent:
+    """agent 产出的流式事件，直接以对象形式传递给房间处理逻辑，无需 JSON 编解码"""
+    type: StreamEventType
+    content: str = ""
+
+    @classmethod
+    def start(cls, content: str = "") -> "StreamEvent":
+        return cls(StreamEventType.START, content)
+
+    @classmethod
+    def thinking(cls, content: str) -> "StreamEvent":
+        return cls(StreamEventType.THINKING, content)
+
+    @classmethod
+    def result(cls, content: str) -> "StreamEvent":
+        return cls(StreamEventType.RESULT, content)
+
+    @classmethod
+    def end(cls, content: str = "") -> "StreamEvent":
+        return cls(StreamEventType.END, content)
+
+    @classmethod
+    def error(cls, content: str) -> "StreamEvent":
+        return cls(StreamEventType.ERROR, content)
+
+
+class ChannelClosed(Exception):
+    """通道已关闭且缓冲区为空"""
+    pass
+
+
+class StreamChannel:
+    """有界的流式事件通道
+
+    生产者和消费者可以分别位于事件循环或普通线程中：
+    - 事件循环内使用 `await aput()` / `async for`
+    - 普通线程内使用 `put()` / `for`
+    消费者在没有数据时休眠，直到生产者写入或关闭通道才被唤醒，不会忙等。
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = max(1, maxsize)
+        self._buffer: Deque[Any] = deque()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._closed = False
+        self._error: Optional[BaseException] = None
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def qsize(self) -> int:
+        return len(self._buffer)
+
+    def _full(self) -> bool:
+        return len(self._buffer) >= self.maxsize
+
+    def _notify_locked(self) -> None:
+        """唤醒所有等待者，调用方需持有锁"""
+        self._cond.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        if not waiters:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        for loop, future in waiters:
+            if loop is running:
+                _resolve(future)
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(_resolve, future)
+
+    def _register_async_waiter_locked(self) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._async_waiters.append((loop, future))
+        return future
+
+    @staticmethod
+    def _merge(tail: Any, item: Any) -> bool:
+        """缓冲区满时尝试把同类型的事件合并到队尾"""
+        if isinstance(tail, StreamEvent) and isinstance(item, StreamEvent) and tail.type == item.type:
+            tail.content += item.content
+            return True
+        return False
+
+    def put_nowait(self, item: Any) -> None:
+        """非阻塞写入，供无法等待的同步回调使用
+
+        缓冲区满时优先与队尾同类型事件合并，否则仍追加，保证不丢数据。
+        """
+        with self._lock:
+            if self._closed:
+                raise ChannelClosed("通道已关闭")
+            if not (self._full() and self._buffer and self._merge(self._buffer[-1], item)):
+                self._buffer.append(item)
+            self._notify_locked()
+
+    def put(self, item: Any, timeout: Optional[float] = None) -> None:
+        """同步写入，缓冲区满时阻塞（不能在消费者所在的事件循环线程中调用）"""
+        with self._lock:
+            if not self._cond.wait_for(lambda: self._closed or not self._full(), timeout):
+                raise TimeoutError("写入流式通道超时")
+            if self._closed:
+                raise ChannelClosed("通道已关闭")
+            self._buffer.append(item)
+            self._notify_locked()
+
+    async def aput(self, item: Any) -> None:
+        """异步写入，缓冲区满时挂起等待消费者"""
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise ChannelClosed("通道已关闭")
+                if not self._full():
+                    self._buffer.append(item)
+                    self._notify_locked()
+                    return
+                future = self._register_async_waiter_locked()
+            await future
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        """关闭通道；传入 error 时消费者在读完缓冲区后会收到该异常"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._error = error
+            self._notify_locked()
+
+    def _pop_locked(self) -> Any:
+        if self._buffer:
+            item = self._buffer.popleft()
+            self._notify_locked()
+            return item
+        if self._error is not None:
+            raise self._error
+        raise ChannelClosed("通道已关闭")
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """同步读取，没有数据时阻塞"""
+        with self._lock:
+            if not self._cond.wait_for(lambda: self._buffer or self._closed, timeout):
+                raise TimeoutError("读取流式通道超时")
+            return self._pop_locked()
+
+    async def aget(self) -> Any:
+        """异步读取，没有数据时挂起"""
+        while True:
+            with self._lock:
+                if self._buffer or self._closed:
+                    return self._pop_locked()
+                future = self._register_async_waiter_locked()
+            await future
+
+    def __iter__(self) -> Iterator[Any]:
+        while True:
+            try:
+                yield self.get()
+            except ChannelClosed:
+                return
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        while True:
+            try:
+                yield await self.aget()
+            except ChannelClosed:
+                return
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+async def coalesce_stream(source: AsyncIterator[Any], window: float = 0.03,
+                          max_bytes: int = 2048) -> AsyncIterator[StreamEvent]:
+    """按时间/大小窗口合并连续的同类型流式事件
+
+    LLM 的每个分片往往只有几个字符，逐个发送会产生大量帧。
+    每种类型的第一个分片立即产出，保证首字延迟不变；之后的分片在 window 秒内
+    或累计达到 max_bytes 字节时合并为一个事件。类型切换以及 end/error 事件会先
+    产出已缓冲的内容，保证顺序不变。
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+    done = object()
+
+    async def pump():
+        try:
+            async for item in source:
+                await queue.put(item)
+        except Exception as e:
+            await queue.put((done, e))
+        else:
+            await queue.put((done, None))
+
+    task = asyncio.create_task(pump())
+    loop = asyncio.get_running_loop()
+
+    seen_types = set()
+    pending_type: Optional[StreamEventType] = None
+    pending_parts: List[str] = []
+    pending_bytes = 0
+    deadline = 0.0
+
+    def flush() -> Optional[StreamEvent]:
+        nonlocal pending_type, pending_parts, pending_bytes
+        if pending_type is None:
+            return None
+        event = StreamEvent(pending_type, ''.join(pending_parts))
+        pending_type, pending_parts, pending_bytes = None, [], 0
+        return event
+
+    try:
+        while True:
+            if pending_type is None:
+                item = await queue.get()
+            else:
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    yield flush()
+                    continue
+
+            if isinstance(item, tuple) and len(item) == 2 and item[0] is done:
+                event = flush()
+                if event is not None:
+                    yield event
+                if item[1] is not None:
+                    raise item[1]
+                return
+
+            event = item if isinstance(item, StreamEvent) else StreamEvent.result(str(item))
+
+            # 类型切换或控制事件：先产出已缓冲的内容
+            if pending_type is not None and event.type != pending_type:
+                yield flush()
+
+            if event.type in (StreamEventType.END, StreamEventType.ERROR):
+                yield event
+                continue
+
+            if event.type not in seen_types:
+                # 每种类型的第一个分片不进入窗口
+                seen_types.add(event.type)
+                yield event
+                continue
+
+            if pending_type is None:
+                pending_type = event.type
+                deadline = loop.time() + window
+            pending_parts.append(event.content)
+            pending_bytes += len(event.content.encode('utf-8'))
+            if pending_bytes >= max_bytes:
+                yield flush()
+    finally:
+        if not task.done():
+            task.cancel()
@@ -1,11 +1,14 @@
 from .base import db
 from .agent import Agent
 from .chat import ChatRoom, ChatMessage, chat_room_manager
+from .room_cache import RoomCache, room_cache
 
 __all__ = [
     'db',
     'Agent',
     'ChatRoom',
     'ChatMessage',
-    'chat_room_manager'
+    'chat_room_manager',
+    'RoomCache',
+    'room_cache'
 ]
@@ -1,5 +1,6 @@
+import asyncio
 from datetime import datetime
-from typing import Generator
+from typing import AsyncGenerator, Callable, Generator, Optional
 from .base import db
 
 class Agent(db.Model):
@@ -28,11 +29,96 @@ class Agent(db.Model):
             'capabilities': self.capabilities
         }
 
-    def generate_response(self, message: str) -> str:
+    def prepare_room(self, room_id: str) -> None:
+        """房间创建时的预热钩子，默认无操作"""
+        pass
+
+    def release_room(self, room_id: str) -> None:
+        """房间删除时的清理钩子，默认无操作"""
+        pass
+
+    def generate_response(self, message: str, room_id: Optional[str] = None) -> str:
         """生成回复（同步方式）"""
         raise NotImplementedError("Agent子类必须实现generate_response方法")
 
-    def generate_response_stream(self, message: str) -> Generator[str, None, None]:
+    @classmethod
+    def is_async_native(cls) -> bool:
+        """子类是否实现了异步流式接口"""
+        return cls.agenerate_response_stream is not Agent.agenerate_response_stream
+
+    def generate_response_stream(self, message: str, room_id: Optional[str] = None) -> Generator[str, None, None]:
         """生成流式回复"""
+        if self.is_async_native():
+            # 异步实现的 agent：在共享事件循环上运行，同步地产出结果
+            # 同一个房间（或 agent）固定在同一个事件循环上，便于复用其中的客户端状态
+            from app.core.runtime import get_agent_runtime
+            yield from get_agent_runtime().iterate(
+                self.agenerate_response_stream(message, room_id=room_id),
+                key=room_id or self.id
+            )
+            return
+
         # 默认实现：将同步响应转换为流式响应
-        yield self.generate_response(message)
+        yield self.generate_response(message, room_id=room_id)
+
+    async def agenerate_response_stream(self, message: str, room_id: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """异步生成流式回复
+
+        产出的每一项可以是字符串（视为结果内容）或 StreamEvent。
+        子类优先实现此方法；默认实现在线程中迭代同步的 generate_response_stream。
+        """
+        iterator = iter(self.generate_response_stream(message, room_id=room_id))
+        done = object()
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, done)
+            if chunk is done:
+                break
+            yield chunk
+
+    async def acached_response_stream(self, message: str, room_id: Optional[str] = None,
+                                      bypass_cache: bool = False,
+                                      transform: Optional[Callable[[AsyncGenerator], AsyncGenerator]] = None
+                                      ) -> AsyncGenerator:
+        """带回复缓存的异步流式回复
+
+        只对配置了 RESPONSE_CACHE 的 agent 类型生效：命中时按原顺序重放缓存的事件，
+        未命中时运行 agent 并记录事件，完整结束且没有错误的回复才写入缓存。
+        bypass_cache 为 True 时跳过查找，但仍用新的回复刷新缓存。
+        transform（如分片合并）只作用于实际运行的流，缓存记录的是变换后的事件，
+        重放时客户端收到的帧与首次回复相同。
+        """
+        from app.core.response_cache import response_cache
+        from app.core.stream import StreamEvent, StreamEventType
+
+        stream = self.agenerate_response_stream(message, room_id=room_id)
+        if transform is not None:
+            stream = transform(stream)
+
+        if not response_cache.enabled_for(self.type):
+            async for chunk in stream:
+                yield chunk
+            return
+
+        if bypass_cache:
+            response_cache.record_bypass(self.type)
+        else:
+            cached = response_cache.get(self.type, message)
+            if cached is not None:
+                for event in cached:
+                    yield event
+                return
+
+        events = []
+        async for chunk in stream:
+            if not isinstance(chunk, StreamEvent):
+                chunk = StreamEvent.result(str(chunk))
+            if chunk.type == StreamEventType.ERROR:
+                events = None
+            elif events is not None:
+                events.append(chunk)
+            yield chunk
+            if chunk.type == StreamEventType.END:
+                break
+
+        if events and any(event.type == StreamEventType.RESULT and event.content for event in events):
+            response_cache.put(self.type, message, events)
@@ -1,4 +1,20 @@
-from .repeater import RepeaterAgent
-from .weather import WeatherAgent
+from .registry import AgentRegistry, AgentSpec, agent_registry
 
-__all__ = ['RepeaterAgent', 'WeatherAgent']
+# agent 实现类按需导入，例如访问 WeatherAgent 时才会加载 metagpt
+_LAZY_CLASSES = {
+    'RepeaterAgent': 'repeater',
+    'WeatherAgent': 'weather',
+    'SyntheticAgent': 'synthetic',
+    'ChatAdapterAgent': 'chat',
+    'HelloAdapterAgent': 'hello',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_CLASSES:
+        return agent_registry.get_class(_LAZY_CLASSES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ['AgentRegistry', 'AgentSpec', 'agent_registry', 'RepeaterAgent', 'WeatherAgent', 'SyntheticAgent',
+           'ChatAdapterAgent', 'HelloAdapterAgent']
@@ -0,0 +1,3 @@
+from .adapter import BaseAgentAdapter, BaseAgentPool, ChatAdapterAgent, HelloAdapterAgent
+
+__all__ = ['BaseAgentAdapter', 'BaseAgentPool', 'ChatAdapterAgent', 'HelloAdapterAgent']
@@ -0,0 +1,265 @@
+import asyncio
+import json
+import threading
+import weakref
+from collections import deque
+from datetime import datetime
+from typing import AsyncGenerator, Callable, Deque, Dict, List, Optional, Type
+from uuid import uuid4
+
+from agents.base.base_agent import BaseAgent
+from agents.base.conversation_history import ConversationHistory
+from agents.specialized.chat_agent import ChatAgent
+from agents.specialized.hello_agent import HelloAgent
+from app.core.stream import StreamEvent
+from config.settings import config
+from ...agent import Agent
+from ..registry import agent_registry
+
+
+class BaseAgentPool:
+    """一个事件循环上某类 BaseAgent 的实例池
+
+    以实例的 is_busy（status == "processing"）判断是否空闲：优先复用空闲实例，
+    全部忙碌时在上限内创建新实例，达到上限后按先来先得排队。
+    只在所属的事件循环中使用，不需要加锁。
+    """
+
+    def __init__(self, factory: Callable[[int], BaseAgent], max_size: int):
+        self.factory = factory
+        self.max_size = max(1, max_size)
+        self.instances: List[BaseAgent] = []
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.processed = 0
+        self.waited = 0
+
+    async def acquire(self) -> BaseAgent:
+        """取得一个空闲实例并标记为 processing"""
+        for instance in self.instances:
+            if not instance.is_busy:
+                instance.status = "processing"
+                return instance
+        if len(self.instances) < self.max_size:
+            instance = self.factory(len(self.instances))
+            instance.status = "processing"
+            self.instances.append(instance)
+            return instance
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.waited += 1
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            # 已经分配到实例后才被取消，转交给下一个等待者
+            if waiter.done() and not waiter.cancelled():
+                self.release(waiter.result())
+            raise
+
+    def release(self, instance: BaseAgent) -> None:
+        """归还实例：有等待者时直接交给它，否则恢复为空闲状态"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                instance.status = "processing"
+                waiter.set_result(instance)
+                return
+        instance.status = "initialized"
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self.instances),
+            'max_size': self.max_size,
+            'busy': sum(1 for instance in self.instances if instance.is_busy),
+            'waiting': sum(1 for waiter in self._waiters if not waiter.done()),
+            'processed': self.processed,
+            'waited': self.waited
+        }
+
+
+class BaseAgentAdapter:
+    """把 agents/ 中的 BaseAgent 子类作为房间 agent 运行
+
+    process 协程直接在共享运行时的事件循环上执行，不为每个请求占用线程。
+    每个事件循环维护自己的实例池，并发由实例的 is_busy/status 控制。
+    子类设置 agent_class 并实现 build_input，与 Agent 一起继承（本类在前）。
+    """
+
+    agent_class: Type[BaseAgent] = None
+
+    # 事件循环 -> agent 类型 -> 实例池
+    _pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, BaseAgentPool]]" = weakref.WeakKeyDictionary()
+    _pools_lock = threading.Lock()
+
+    @classmethod
+    def agent_type(cls) -> str:
+        return cls.__mapper_args__['polymorphic_identity']
+
+    @classmethod
+    def create(cls):
+        """按注册表中的声明创建 agent 实例"""
+        spec = agent_registry.spec(cls.agent_type())
+        return cls(
+            id=str(uuid4()),
+            name=spec.name,
+            type=spec.type,
+            description=spec.description,
+            capabilities=list(spec.capabilities)
+        )
+
+    @classmethod
+    def init_app(cls, app):
+        """初始化 agent（已存在时不重复写入）"""
+        if agent_registry.seed(app, [cls.agent_type()]):
+            print(f"{agent_registry.spec(cls.agent_type()).name}已创建")
+
+    @classmethod
+    def runtime_stats(cls) -> dict:
+        """汇总各事件循环中该类型实例池的状态"""
+        with cls._pools_lock:
+            pools = [(loop, pools.get(cls.agent_type())) for loop, pools in list(cls._pools.items())]
+        totals = {'loops': 0, 'size': 0, 'busy': 0, 'waiting': 0, 'processed': 0, 'waited': 0}
+        for loop, pool in pools:
+            if pool is None:
+                continue
+            totals['loops'] += 1
+            for key, value in pool.stats().items():
+                if key in totals:
+                    totals[key] += value
+            for key, value in cls.loop_stats(loop).items():
+                totals[key] = totals.get(key, 0) + value
+        totals['max_size'] = config.BASE_AGENT_POOL_SIZE
+        return totals
+
+    @classmethod
+    def loop_stats(cls, loop: asyncio.AbstractEventLoop) -> Dict[str, int]:
+        """一个事件循环中该类型的附加统计，在 runtime_stats 中按键求和"""
+        return {}
+
+    def new_instance(self, index: int) -> BaseAgent:
+        return self.agent_class(agent_id=f"{self.id}-{index}")
+
+    def get_pool(self) -> BaseAgentPool:
+        """当前事件循环中该类型的实例池"""
+        loop = asyncio.get_running_loop()
+        pools = self._pools.get(loop)
+        if pools is None:
+            with self._pools_lock:
+                pools = self._pools.setdefault(loop, {})
+        pool = pools.get(self.type)
+        if pool is None:
+            pool = pools[self.type] = BaseAgentPool(self.new_instance, config.BASE_AGENT_POOL_SIZE)
+        return pool
+
+    @staticmethod
+    def parse_message(message: str) -> Optional[dict]:
+        """消息为 JSON 对象时作为 process 的输入，否则返回 None"""
+        try:
+            data = json.loads(message)
+        except (TypeError, ValueError):
+            return None
+        return data if isinstance(data, dict) else None
+
+    def build_input(self, message: str, room_id: Optional[str] = None) -> dict:
+        """把房间消息转换为 process 的输入"""
+        raise NotImplementedError("BaseAgentAdapter子类必须实现build_input方法")
+
+    def format_output(self, output: dict) -> StreamEvent:
+        """把 process 的返回值转换为流式事件"""
+        if 'error' in output:
+            return StreamEvent.error(str(output['error']))
+        return StreamEvent.result(str(output.get('message', '')))
+
+    def generate_response(self, message: str, room_id: Optional[str] = None) -> str:
+        """生成回复（同步方式）- 在共享运行时上执行 process"""
+        return ''.join(event.content for event in self.generate_response_stream(message, room_id=room_id))
+
+    async def agenerate_response_stream(self, message: str, room_id: Optional[str] = None) -> AsyncGenerator[StreamEvent, None]:
+        """生成流式回复 - 从实例池取得实例并等待 process 的结果"""
+        data = self.build_input(message, room_id)
+        pool = self.get_pool()
+        instance = await pool.acquire()
+        try:
+            output = await instance.process(data)
+        finally:
+            pool.processed += 1
+            pool.release(instance)
+        yield self.format_output(output)
+
+
+class ChatAdapterAgent(BaseAgentAdapter, Agent):
+    """聊天Agent - 运行 agents.specialized.ChatAgent，以房间 id 作为 user_id（JSON 消息中的 user_id 作为其后缀）
+
+    同一事件循环中池里的所有 ChatAgent 实例共用一个 ConversationHistory，
+    房间的对话历史不会因为消息被不同实例处理而分散。
+    """
+
+    __mapper_args__ = {
+        'polymorphic_identity': 'chat'
+    }
+
+    agent_class = ChatAgent
+
+    # 事件循环 -> 该循环中所有实例共用的对话历史（与实例池一样只在所属循环中使用）
+    _histories: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ConversationHistory]" = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def get_history(cls, loop: asyncio.AbstractEventLoop) -> ConversationHistory:
+        """事件循环中共用的对话历史，不存在时创建"""
+        with cls._pools_lock:
+            history = cls._histories.get(loop)
+            if history is None:
+                history = cls._histories[loop] = ConversationHistory(
+                    max_messages=config.CHAT_HISTORY_MAX_MESSAGES,
+                    max_size_per_user=config.CHAT_HISTORY_MAX_CHARS,
+                    max_users=config.CHAT_HISTORY_MAX_USERS,
+                    max_total_size=config.CHAT_HISTORY_MAX_TOTAL_CHARS
+                )
+            return history
+
+    @classmethod
+    def loop_stats(cls, loop: asyncio.AbstractEventLoop) -> Dict[str, int]:
+        with cls._pools_lock:
+            history = cls._histories.get(loop)
+        if history is None:
+            return {}
+        return {f'history_{key}': value for key, value in history.stats().items()}
+
+    def new_instance(self, index: int) -> ChatAgent:
+        history = self.get_history(asyncio.get_running_loop())
+        return ChatAgent(agent_id=f"{self.id}-{index}", conversation_history=history)
+
+    def build_input(self, message: str, room_id: Optional[str] = None) -> dict:
+        data = self.parse_message(message) or {'message': message}
+        # 对话历史由所有房间共用，客户端给出的 user_id 只能在本房间之下区分用户，不能指向其他房间
+        owner = room_id or self.id
+        user_id = data.get('user_id')
+        data['user_id'] = f"{owner}:{user_id}" if user_id not in (None, '') else owner
+        return data
+
+
+class HelloAdapterAgent(BaseAgentAdapter, Agent):
+    """问候Agent - 运行 agents.specialized.HelloAgent，纯文本消息作为用户名，按当前时间问候"""
+
+    __mapper_args__ = {
+        'polymorphic_identity': 'hello'
+    }
+
+    agent_class = HelloAgent
+
+    @staticmethod
+    def time_of_day(hour: int) -> str:
+        if 5 <= hour < 12:
+            return 'morning'
+        if 12 <= hour < 18:
+            return 'afternoon'
+        if 18 <= hour < 23:
+            return 'evening'
+        return 'default'
+
+    def build_input(self, message: str, room_id: Optional[str] = None) -> dict:
+        data = self.parse_message(message)
+        if data is None:
+            data = {'user_name': message.strip()}
+        data.setdefault('time_of_day', self.time_of_day(datetime.now().hour))
+        return data
@@ -0,0 +1,178 @@
+import importlib
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Type
+from uuid import uuid4
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from ..agent import Agent
+from ..base import db
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AgentSpec:
+    """agent 类型的声明：实现类所在模块和写入数据库的基本信息"""
+    type: str
+    module: str
+    class_name: str
+    name: str
+    description: str
+    capabilities: List[str] = field(default_factory=list)
+    # 根据应用配置判断是否在启动时写入数据库
+    enabled: Callable[[dict], bool] = lambda app_config: True
+
+
+class AgentRegistry:
+    """agent 注册表
+
+    agent 类型按名字声明，实现模块在第一次使用时才导入：
+    只服务复读机房间或健康检查的进程不会加载 metagpt。
+    SQLAlchemy 按 type 字段加载子类时需要对应的类已经导入，
+    所以在查询某个类型的 agent 之前先调用 get_class。
+    """
+
+    def __init__(self):
+        self._specs: Dict[str, AgentSpec] = {}
+        self._classes: Dict[str, Type[Agent]] = {}
+        self._lock = threading.RLock()
+        # agent 类型 -> 导入耗时（秒）
+        self.import_times: Dict[str, float] = {}
+
+    def declare(self, spec: AgentSpec) -> None:
+        self._specs[spec.type] = spec
+
+    def is_declared(self, agent_type: str) -> bool:
+        return agent_type in self._specs
+
+    def spec(self, agent_type: str) -> AgentSpec:
+        return self._specs[agent_type]
+
+    def types(self) -> List[str]:
+        return list(self._specs)
+
+    def is_loaded(self, agent_type: str) -> bool:
+        return agent_type in self._classes
+
+    def get_class(self, agent_type: str) -> Type[Agent]:
+        """返回 agent 类型的实现类，第一次使用时导入模块；未声明的类型抛出 KeyError"""
+        cls = self._classes.get(agent_type)
+        if cls is not None:
+            return cls
+        spec = self._specs[agent_type]
+        with self._lock:
+            cls = self._classes.get(agent_type)
+            if cls is None:
+                started = time.perf_counter()
+                module = importlib.import_module(spec.module)
+                cls = getattr(module, spec.class_name)
+                self.import_times[agent_type] = time.perf_counter() - started
+                self._classes[agent_type] = cls
+                logger.info(f"已加载 agent 类型 {agent_type}，导入耗时 {self.import_times[agent_type] * 1000:.1f}ms")
+        return cls
+
+    def ensure_loaded(self, agent_types: Iterable[str]) -> None:
+        """导入一组 agent 类型，忽略未声明的类型"""
+        for agent_type in agent_types:
+            if agent_type in self._specs:
+                self.get_class(agent_type)
+
+    def seed(self, app=None, agent_types: Optional[Iterable[str]] = None) -> List[str]:
+        """把已启用但数据库中还不存在的 agent 一次性批量写入，可重复调用，返回新写入的类型
+
+        只写入表中的基本信息，不需要导入 agent 的实现模块。
+        """
+        def run() -> List[str]:
+            types = agent_types
+            if types is None:
+                types = [t for t, spec in self._specs.items() if spec.enabled(current_app.config)]
+            existing = {agent_type for (agent_type,) in db.session.query(Agent.type)}
+            now = datetime.utcnow()
+            rows = [
+                {
+                    'id': str(uuid4()),
+                    'name': self._specs[agent_type].name,
+                    'type': agent_type,
+                    'description': self._specs[agent_type].description,
+                    'capabilities': list(self._specs[agent_type].capabilities),
+                    'created_at': now
+                }
+                for agent_type in types
+                if agent_type in self._specs and agent_type not in existing
+            ]
+            if not rows:
+                return []
+            try:
+                db.session.execute(Agent.__table__.insert(), rows)
+                db.session.commit()
+            except IntegrityError:
+                # 其他进程同时写入了相同类型（type 唯一），以数据库中的为准
+                db.session.rollback()
+                return []
+            return [row['type'] for row in rows]
+
+        if app is None:
+            return run()
+        with app.app_context():
+            return run()
+
+    def report(self) -> dict:
+        """启动报告：声明的类型、已加载的类型及各自的导入耗时"""
+        return {
+            'declared': self.types(),
+            'loaded': list(self._classes),
+            'import_ms': {agent_type: seconds * 1000 for agent_type, seconds in self.import_times.items()}
+        }
+
+
+# 创建全局 agent 注册表
+agent_registry = AgentRegistry()
+
+agent_registry.declare(AgentSpec(
+    type='repeater',
+    module='app.models.agents.repeater.repeater',
+    class_name='RepeaterAgent',
+    name='复读机',
+    description='我是一个复读机，我会重复你说的话',
+    capabilities=['repeat', 'stream']
+))
+agent_registry.declare(AgentSpec(
+    type='weather',
+    module='app.models.agents.weather.weather_agent',
+    class_name='WeatherAgent',
+    name='天气Agent',
+    description='我是一个天气Agent，我会查询天气信息',
+    capabilities=['weather', 'stream']
+))
+agent_registry.declare(AgentSpec(
+    type='chat',
+    module='app.models.agents.adapter.adapter',
+    class_name='ChatAdapterAgent',
+    name='聊天Agent',
+    description='我是一个聊天Agent，我会记录对话并回复你',
+    capabilities=['chat']
+))
+agent_registry.declare(AgentSpec(
+    type='hello',
+    module='app.models.agents.adapter.adapter',
+    class_name='HelloAdapterAgent',
+    name='问候Agent',
+    description='我是一个问候Agent，我会根据时间向你问好',
+    capabilities=['greet']
+))
+agent_registry.declare(AgentSpec(
+    type='synthetic',
+    module='app.models.agents.synthetic.synthetic',
+    class_name='SyntheticAgent',
+    name='合成负载',
+    description='压测用的合成 agent，按配置产出固定大小的流式分片',
+    capabilities=['stream', 'benchmark'],
+    # 合成 agent 只在压测时注册
+    enabled=lambda app_config: app_config.get('SYNTHETIC_AGENT_ENABLED', False)
+))
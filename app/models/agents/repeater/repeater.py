@@ -1,8 +1,9 @@
 from uuid import uuid4
-from typing import Generator
-import time
+from typing import AsyncGenerator, Optional
+import asyncio
 from ...base import db
 from ...agent import Agent
+from ..registry import agent_registry
 
 class RepeaterAgent(Agent):
     """复读机Agent - 简单重复用户的消息"""
@@ -14,33 +15,27 @@ class RepeaterAgent(Agent):
     @classmethod
     def create(cls):
         """创建一个复读机Agent实例"""
+        spec = agent_registry.spec("repeater")
         agent = cls(
             id=str(uuid4()),
-            name="复读机",
-            type="repeater",
-            description="我是一个复读机，我会重复你说的话",
-            capabilities=["repeat", "stream"]
+            name=spec.name,
+            type=spec.type,
+            description=spec.description,
+            capabilities=list(spec.capabilities)
         )
         return agent
 
     @classmethod
     def init_app(cls, app):
-        """初始化复读机Agent"""
-        with app.app_context():
-            # 检查是否已存在
-            existing = Agent.query.filter_by(type="repeater").first()
-            if not existing:
-                # 创建新的复读机Agent
-                repeater = cls.create()
-                db.session.add(repeater)
-                db.session.commit()
-                print("复读机Agent已创建")
-
-    def generate_response(self, message: str) -> str:
+        """初始化复读机Agent（已存在时不重复写入）"""
+        if agent_registry.seed(app, ["repeater"]):
+            print("复读机Agent已创建")
+
+    def generate_response(self, message: str, room_id: Optional[str] = None) -> str:
         """生成回复 - 简单重复用户的消息"""
         return message
 
-    def generate_response_stream(self, message: str) -> Generator[str, None, None]:
+    async def agenerate_response_stream(self, message: str, room_id: Optional[str] = None) -> AsyncGenerator[str, None]:
         """生成流式回复 - 带开场白和延时的逐字返回"""
         # 先发送开场白
         intro = "开始重复："
@@ -52,7 +47,7 @@ class RepeaterAgent(Agent):
         yield "\n"
 
         # 等待1秒
-        time.sleep(1)
+        await asyncio.sleep(1)
 
         yield message
 
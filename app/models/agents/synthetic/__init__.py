@@ -0,0 +1,3 @@
+from .synthetic import SyntheticAgent
+
+__all__ = ['SyntheticAgent']
@@ -0,0 +1,65 @@
+from uuid import uuid4
+from typing import AsyncGenerator, Optional
+import asyncio
+import json
+from ...agent import Agent
+from ..registry import agent_registry
+from config.settings import config
+
+class SyntheticAgent(Agent):
+    """合成Agent - 按配置的分片数量、大小和间隔产出固定内容，用于不依赖 LLM 的压测"""
+
+    __mapper_args__ = {
+        'polymorphic_identity': 'synthetic'
+    }
+
+    @classmethod
+    def create(cls):
+        """创建一个合成Agent实例"""
+        spec = agent_registry.spec("synthetic")
+        agent = cls(
+            id=str(uuid4()),
+            name=spec.name,
+            type=spec.type,
+            description=spec.description,
+            capabilities=list(spec.capabilities)
+        )
+        return agent
+
+    @classmethod
+    def init_app(cls, app):
+        """初始化合成Agent（已存在时不重复写入）"""
+        if agent_registry.seed(app, ["synthetic"]):
+            print("合成Agent已创建")
+
+    @staticmethod
+    def parse_options(message: str) -> dict:
+        """读取负载参数：默认取自配置，消息为 JSON 时可以覆盖 chunks / chunk_size / delay"""
+        options = {
+            'chunks': config.SYNTHETIC_AGENT_CHUNKS,
+            'chunk_size': config.SYNTHETIC_AGENT_CHUNK_SIZE,
+            'delay': config.SYNTHETIC_AGENT_DELAY
+        }
+        try:
+            overrides = json.loads(message)
+        except (TypeError, ValueError):
+            return options
+        if isinstance(overrides, dict):
+            for key in options:
+                if key in overrides:
+                    options[key] = type(options[key])(overrides[key])
+        return options
+
+    def generate_response(self, message: str, room_id: Optional[str] = None) -> str:
+        """生成回复 - 一次性返回全部内容"""
+        options = self.parse_options(message)
+        return 'x' * (options['chunks'] * options['chunk_size'])
+
+    async def agenerate_response_stream(self, message: str, room_id: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """生成流式回复 - 每隔 delay 秒产出一个 chunk_size 字符的分片"""
+        options = self.parse_options(message)
+        chunk = 'x' * options['chunk_size']
+        for _ in range(options['chunks']):
+            if options['delay'] > 0:
+                await asyncio.sleep(options['delay'])
+            yield chunk
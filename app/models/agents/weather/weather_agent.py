@@ -1,23 +1,25 @@
-from typing import Generator
+from typing import AsyncGenerator, Optional
 import asyncio
 from contextvars import ContextVar
-import threading
-import json
+from app.core.runtime import get_agent_runtime
+from app.core.env_cache import environment_cache
+from app.core.stream import StreamChannel, StreamEvent
 from app.models.environment.base import BaseEnv
 from metagpt.roles.di.team_leader import TeamLeader
 from metagpt.schema import Message
-from metagpt.utils.stream_pipe import StreamPipe
 from metagpt.logs import logger, set_llm_stream_logfunc
 from ...agent import Agent
+from ..registry import agent_registry
 import time
 from uuid import uuid4
 from metagpt.roles import Searcher
 from metagpt.tools.search_engine import SearchEngine
 from metagpt.tools import SearchEngineType
 from ...base import db
+from config.settings import config
 
-# 创建上下文变量来存储 StreamPipe
-stream_pipe_var: ContextVar[StreamPipe] = ContextVar("stream_pipe")
+# 创建上下文变量来存储当前请求的流式通道
+stream_channel_var: ContextVar[StreamChannel] = ContextVar("stream_channel")
 
 def stream_pipe_log(content, is_thinking=False):
     """处理流式日志输出
@@ -26,14 +28,13 @@ def stream_pipe_log(content, is_thinking=False):
         is_thinking: 是否为思考过程的内容
     """
     print(content, end="")
-    stream_pipe = stream_pipe_var.get(None)
-    if stream_pipe:
+    stream_channel = stream_channel_var.get(None)
+    if stream_channel is not None and not stream_channel.closed:
         # 根据is_thinking参数决定消息类型
-        msg_type = "thinking" if is_thinking else "result"
-        stream_pipe.set_message(json.dumps({
-            "type": msg_type,
-            "content": content
-        }))
+        if is_thinking:
+            stream_channel.put_nowait(StreamEvent.thinking(content))
+        else:
+            stream_channel.put_nowait(StreamEvent.result(content))
 
 # 设置流式日志函数，传递所有参数
 set_llm_stream_logfunc(lambda *args, **kwargs: stream_pipe_log(*args, **kwargs))
@@ -45,109 +46,116 @@ class WeatherAgent(Agent):
         'polymorphic_identity': 'weather'
     }
 
+    @staticmethod
+    def build_env() -> BaseEnv:
+        """构建带 TeamLeader 的 MetaGPT 环境"""
+        env = BaseEnv()
+        team_leader = TeamLeader(name="TeamLeader")
+        if config.WEATHER_AGENT_LLM == 'fake':
+            # 离线压测：用脚本回复替代真实 LLM
+            from app.models.llm import FakeLLM, install_llm
+            install_llm(team_leader, FakeLLM.from_config())
+        env.add_role(team_leader)
+        # env.add_role(Searcher(name="Searcher",search_engine=SearchEngine(engine=SearchEngineType.BING)))
+        # env.run()
+        return env
+
     def __post_init__(self):
         """在 SQLAlchemy 模型初始化后执行的初始化"""
-        self.env = BaseEnv()
-        self.env.add_role(TeamLeader(name="TeamLeader"))
-        # self.env.add_role(Searcher(name="Searcher",search_engine=SearchEngine(engine=SearchEngineType.BING)))
-        # self.env.run()
+        self.env = self.build_env()
+
+    def prepare_room(self, room_id: str) -> None:
+        """在后台预先构建房间环境"""
+        environment_cache.prebuild(room_id, self.build_env)
+
+    def release_room(self, room_id: str) -> None:
+        """移除房间环境"""
+        environment_cache.discard(room_id)
+
+    async def _get_env(self, room_id: Optional[str] = None) -> BaseEnv:
+        """获取房间环境；未指定房间时使用 agent 自身的环境"""
+        if room_id is None:
+            if not hasattr(self, 'env'):
+                self.__post_init__()
+            return self.env
+        return await environment_cache.aget_or_create(room_id, self.build_env)
 
     @classmethod
     def create(cls):
         """创建一个天气Agent实例"""
+        spec = agent_registry.spec("weather")
         agent = cls(
             id=str(uuid4()),
-            name="天气Agent",
-            type="weather",
-            description="我是一个天气Agent，我会查询天气信息",
-            capabilities=["weather", "stream"]
+            name=spec.name,
+            type=spec.type,
+            description=spec.description,
+            capabilities=list(spec.capabilities)
         )
         agent.__post_init__()  # 手动调用后初始化
         return agent
 
     @classmethod
     def init_app(cls, app):
-        """初始化天气Agent"""
-        with app.app_context():
-            # 检查是否已存在
-            existing = Agent.query.filter_by(type="weather").first()
-            if not existing:
-                # 创建新的天气Agent
-                weather = cls.create()
-                db.session.add(weather)
-                db.session.commit()
-                print("天气Agent已创建")
-
-    def generate_response(self, message: str) -> str:
-        """生成回复 - 简单重复用户的消息"""
-        if not hasattr(self, 'env'):
-            self.__post_init__()
-        # 使用成员变量 env 发布消息
-        self.env.publish_message(Message(content=message, role="user"))
-        # Get the TeamLeader role instance
-        tl = self.env.get_role("TeamLeader")
-        # Execute the TeamLeader's tasks
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        response = loop.run_until_complete(tl.run())
-        loop.close()
+        """初始化天气Agent（已存在时不重复写入）"""
+        if agent_registry.seed(app, ["weather"]):
+            print("天气Agent已创建")
+
+    async def _run_team_leader(self, message: str, room_id: Optional[str] = None):
+        """发布用户消息并执行 TeamLeader 的任务"""
+        env = await self._get_env(room_id)
+        env.begin_turn()
+        # 使用房间环境发布消息
+        env.publish_message(Message(content=message, role="user"))
+        # 获取并执行 TeamLeader 的任务
+        tl = env.get_role("TeamLeader")
+        try:
+            return await tl.run()
+        finally:
+            # 压缩较早的对话，记忆和提示词长度不随房间存活时间增长
+            env.compact_memory()
+
+    def generate_response(self, message: str, room_id: Optional[str] = None) -> str:
+        """生成回复 - 在共享事件循环上执行 TeamLeader"""
+        response = get_agent_runtime().run(
+            self._run_team_leader(message, room_id=room_id),
+            key=room_id or self.id
+        )
         return str(response) if response else message
 
-    async def _process_response(self, message: str, stream_pipe: StreamPipe):
+    async def _process_response(self, message: str, stream_channel: StreamChannel, room_id: Optional[str] = None):
         """异步处理响应"""
-        if not hasattr(self, 'env'):
-            self.__post_init__()
-
-        # 设置流式管道到上下文
-        stream_pipe_var.set(stream_pipe)
+        # 设置流式通道到上下文
+        stream_channel_var.set(stream_channel)
 
         # 发送开场白
-        stream_pipe.set_message(json.dumps({
-            "type": "start",
-            "content": "开始查询天气：\n"
-        }))
-
-        # 使用成员变量 env 发布消息
-        self.env.publish_message(Message(content=message, role="user"))
+        await stream_channel.aput(StreamEvent.start("开始查询天气：\n"))
 
-        # 获取并执行 TeamLeader 的任务
-        tl = self.env.get_role("TeamLeader")
-        response = await tl.run()
+        response = await self._run_team_leader(message, room_id=room_id)
 
         # 发送最终结果
         if response:
-            stream_pipe.set_message(json.dumps({
-                "type": "result",
-                "content": str(response)
-            }))
+            await stream_channel.aput(StreamEvent.result(str(response)))
 
-    def generate_response_stream(self, message: str) -> Generator[str, None, None]:
+    async def agenerate_response_stream(self, message: str, room_id: Optional[str] = None) -> AsyncGenerator[StreamEvent, None]:
         """生成流式回复"""
-        def thread_run(msg: str, stream_pipe: StreamPipe):
-            """在线程中运行异步函数"""
-            asyncio.run(self._process_response(msg, stream_pipe))
-
-        # 创建流式管道
-        stream_pipe = StreamPipe()
-
-        # 创建并启动处理线程
-        thread = threading.Thread(
-            target=thread_run,
-            args=(message, stream_pipe)
-        )
-        thread.start()
-
-        # 持续获取并产出消息
-        while thread.is_alive():
-            msg = stream_pipe.get_message()
-            if msg:
-                yield msg
-
-        # 确保线程完成
-        thread.join()
-
-        # 获取最后的消息
-        final_msg = stream_pipe.get_message()
-        if final_msg:
-            yield final_msg
-
+        stream_channel = StreamChannel(maxsize=config.STREAM_CHANNEL_SIZE)
+
+        async def run():
+            try:
+                await self._process_response(message, stream_channel, room_id=room_id)
+            except BaseException as e:
+                stream_channel.close(e)
+                raise
+            else:
+                stream_channel.close()
+
+        # 在当前事件循环中启动处理任务，流式日志通过上下文变量写入通道
+        task = asyncio.create_task(run())
+        # 异常已经通过通道传递给消费方，这里只把它标记为已读取
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            async for event in stream_channel:
+                yield event
+        finally:
+            if not task.done():
+                task.cancel()
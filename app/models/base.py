@@ -1,3 +1,66 @@
+from typing import Dict, Mapping
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
 
 db = SQLAlchemy()
+
+
+def is_sqlite_memory(uri: str) -> bool:
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(uri: str, settings: Mapping) -> dict:
+    """
+    根据数据库类型生成 SQLAlchemy 引擎参数（SQLALCHEMY_ENGINE_OPTIONS）
+
+    - 服务端数据库：连接池大小、溢出上限、等待超时、回收时间和取出前检测（pre-ping）
+    - SQLite 文件：连接池大小和溢出上限，驱动的锁等待时间与 busy_timeout 一致；
+      本地文件不会断开连接，不做 pre-ping
+    - SQLite 内存数据库：由 Flask-SQLAlchemy 使用单连接池，不设置连接池参数
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        if is_sqlite_memory(uri):
+            return {}
+        return {
+            'pool_size': settings['DB_POOL_SIZE'],
+            'max_overflow': settings['DB_MAX_OVERFLOW'],
+            'pool_timeout': settings['DB_POOL_TIMEOUT'],
+            'connect_args': {'timeout': settings['SQLITE_BUSY_TIMEOUT'] / 1000}
+        }
+    return {
+        'pool_size': settings['DB_POOL_SIZE'],
+        'max_overflow': settings['DB_MAX_OVERFLOW'],
+        'pool_timeout': settings['DB_POOL_TIMEOUT'],
+        'pool_recycle': settings['DB_POOL_RECYCLE'],
+        'pool_pre_ping': settings['DB_POOL_PRE_PING']
+    }
+
+
+def sqlite_pragmas(settings: Mapping) -> Dict[str, object]:
+    """每个 SQLite 连接建立时执行的 PRAGMA，配置为空的项不设置"""
+    pragmas = {
+        'journal_mode': settings['SQLITE_JOURNAL_MODE'],
+        'synchronous': settings['SQLITE_SYNCHRONOUS'],
+        'busy_timeout': settings['SQLITE_BUSY_TIMEOUT'],
+        'mmap_size': settings['SQLITE_MMAP_SIZE'],
+    }
+    return {name: value for name, value in pragmas.items() if value not in (None, '')}
+
+
+def install_sqlite_pragmas(engine: Engine, pragmas: Mapping[str, object]) -> None:
+    """在引擎的每个新连接上执行 PRAGMA；非 SQLite 引擎不做处理"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
@@ -1,9 +1,20 @@
+import asyncio
+from collections import deque
 from datetime import datetime
-from typing import Dict, Set, Any
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 from flask_sock import Sock
-import json
+import logging
+import socket
+import threading
+from config.settings import config
+from app.core.broker import EVENT_CLOSE, EVENT_MESSAGE, Broker, LocalBroker, create_broker
+from app.core.metrics import BROADCAST_FAILURES
+from app.core.protocol import PROTOCOL_JSON, encode_message
+from app.core.replay import replay_buffer
 from .base import db
 
+logger = logging.getLogger(__name__)
+
 class ChatRoom(db.Model):
     """聊天室模型"""
     __tablename__ = 'chat_rooms'
@@ -12,8 +23,10 @@ class ChatRoom(db.Model):
     agent_type = db.Column(db.String(50), nullable=False)
     agent_id = db.Column(db.String(36), db.ForeignKey('agents.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    deleted_at = db.Column(db.DateTime)  # 标记删除的时间，消息由后台任务分批删除后再删除房间
 
-    messages = db.relationship('ChatMessage', backref='room', lazy=True)
+    # 使用 dynamic 关系，按需查询而不是一次加载全部消息
+    messages = db.relationship('ChatMessage', backref='room', lazy='dynamic')
     agent = db.relationship('Agent', backref='rooms')
 
     def to_dict(self) -> dict:
@@ -28,6 +41,10 @@ class ChatRoom(db.Model):
 class ChatMessage(db.Model):
     """聊天消息模型"""
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        # 支持按房间 keyset 分页读取历史消息
+        db.Index('ix_chat_messages_room_timestamp_id', 'room_id', 'timestamp', 'id'),
+    )
 
     id = db.Column(db.String(36), primary_key=True)
     room_id = db.Column(db.String(36), db.ForeignKey('chat_rooms.id'), nullable=False)
@@ -35,64 +52,507 @@ class ChatMessage(db.Model):
     content = db.Column(db.Text, nullable=False)
     role = db.Column(db.String(20), nullable=False)  # user, assistant, system
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    stop_reason = db.Column(db.String(20))  # 回复被截断的原因：cancelled, disconnect, timeout；完整回复为空
 
     def to_dict(self) -> dict:
         """转换为字典"""
-        return {
+        data = {
             'id': self.id,
             'type': self.type,
             'content': self.content,
             'role': self.role,
             'timestamp': self.timestamp.isoformat()
         }
+        if self.stop_reason:
+            data['truncated'] = True
+            data['stop_reason'] = self.stop_reason
+        return data
 
-class ChatRoomManager:
-    """聊天室连接管理器"""
-    def __init__(self):
-        self.room_connections: Dict[str, Set[Sock]] = {}
+class OutboundFrame:
+    """待发送的帧
 
-    def add_connection(self, room_id: str, ws: Sock) -> None:
-        """添加WebSocket连接到房间"""
-        if room_id not in self.room_connections:
-            self.room_connections[room_id] = set()
-        self.room_connections[room_id].add(ws)
+    message 为原始消息（用于溢出处理和按协议编码），payload 为已序列化的文本。
+    同一帧广播给房间内多个连接时，每种协议只编码一次。
+    """
+    __slots__ = ('message', 'payload', '_encoded')
 
-    def remove_connection(self, room_id: str, ws: Sock) -> None:
-        """从房间移除WebSocket连接"""
-        if room_id in self.room_connections:
-            self.room_connections[room_id].discard(ws)
-            if not self.room_connections[room_id]:
-                del self.room_connections[room_id]
+    def __init__(self, message: Optional[dict], payload: Optional[str] = None):
+        self.message = message
+        self.payload = payload
+        self._encoded: Dict[int, str] = {}
 
-    def broadcast_to_room(self, room_id: str, message: Any) -> None:
-        """向房间内所有连接广播消息"""
-        if room_id not in self.room_connections:
-            return
+    def payload_for(self, protocol: int) -> str:
+        """获取指定协议下的序列化文本"""
+        if self.message is None:
+            return self.payload
+        encoded = self._encoded.get(protocol)
+        if encoded is None:
+            encoded = encode_message(self.message, protocol)
+            self._encoded[protocol] = encoded
+        return encoded
+
+    @property
+    def is_intermediate(self) -> bool:
+        """是否为可丢弃/合并的中间流式帧"""
+        return bool(self.message and self.message.get('is_stream') and not self.message.get('is_end'))
+
+
+class RoomConnection:
+    """单个 WebSocket 连接
+
+    每个连接有自己的有界发送队列，由独立的写线程发送，
+    慢客户端只会积压自己的队列，不会阻塞房间内的其他连接和 agent 线程。
+    所有对该 socket 的发送都在写线程中串行进行。关闭连接时在锁内只做标记并唤醒写线程，
+    由写线程发送关闭帧；写线程正阻塞在发送中时在锁外 shutdown 底层 socket 让发送返回。
+    """
+
+    OVERFLOW_POLICIES = ('drop', 'coalesce', 'disconnect')
+
+    def __init__(self, room_id: str, ws: Sock, max_queue: int = 256, overflow_policy: str = 'coalesce',
+                 idle_timeout: float = 5.0, on_dead: Optional[Callable[['RoomConnection'], None]] = None,
+                 protocol: int = PROTOCOL_JSON):
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"不支持的溢出策略: {overflow_policy}")
+        self.room_id = room_id
+        self.ws = ws
+        self.max_queue = max(1, max_queue)
+        self.overflow_policy = overflow_policy
+        self.idle_timeout = idle_timeout
+        self.protocol = protocol
+        self._on_dead = on_dead
+
+        self._queue: Deque[OutboundFrame] = deque()
+        self._cond = threading.Condition()
+        self._writer: Optional[threading.Thread] = None
+        self._sending = False
+        self._closed = False
+
+        # 续传的回复 id -> 已补发的最大帧序号，实时广播中不大于该序号的帧不再发送
+        self.resumed: Dict[str, int] = {}
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def send(self, message: Any) -> bool:
+        """将消息放入发送队列，返回连接是否仍然可用"""
+        if isinstance(message, str):
+            return self.enqueue(OutboundFrame(None, message))
+        return self.enqueue(OutboundFrame(message))
+
+    def enqueue(self, frame: OutboundFrame) -> bool:
+        """将帧放入发送队列，返回连接是否仍然可用"""
+        with self._cond:
+            if self._closed:
+                return False
+            if self.resumed and frame.message is not None and self._is_replayed_locked(frame.message):
+                return True
+            if len(self._queue) >= self.max_queue and self.overflow_policy == 'disconnect':
+                logger.warning(f"房间 {self.room_id} 的连接发送队列溢出，断开连接")
+                BROADCAST_FAILURES.inc('overflow_disconnect')
+                action = self._close_locked(abort=True)
+            elif len(self._queue) >= self.max_queue and not self._handle_overflow_locked(frame):
+                # 帧已被合并或丢弃
+                return True
+            else:
+                self._queue.append(frame)
+                self.max_depth = max(self.max_depth, len(self._queue))
+                self._ensure_writer_locked()
+                self._cond.notify()
+                return True
+        # 在锁外完成关闭，不阻塞发布线程
+        self._finish_close(action)
+        return False
+
+    def _is_replayed_locked(self, message: dict) -> bool:
+        """该帧是否已在续传时补发过"""
+        last = self.resumed.get(message.get('id'))
+        if last is None:
+            return False
+        seq = message.get('seq')
+        if message.get('is_end') or not message.get('is_stream'):
+            del self.resumed[message['id']]
+        return seq is not None and seq <= last
+
+    def replay(self, messages: List[dict]) -> None:
+        """补发续传回复中错过的帧，相邻的中间帧先合并以免占满发送队列"""
+        frames: List[OutboundFrame] = []
+        for message in messages:
+            frame = OutboundFrame(message)
+            if frames and self._mergeable(frames[-1], frame):
+                frames[-1] = self._merge(frames[-1], frame)
+            else:
+                frames.append(frame)
+        for frame in frames:
+            self.enqueue(frame)
+        last = messages[-1] if messages else None
+        if last is not None and last.get('is_stream') and not last.get('is_end'):
+            with self._cond:
+                self.resumed[last['id']] = last['seq']
 
-        message_str = message if isinstance(message, str) else json.dumps(message)
-        dead_connections = set()
+    def _handle_overflow_locked(self, frame: OutboundFrame) -> bool:
+        """队列已满时按 drop / coalesce 策略处理；返回 True 表示新帧仍需入队"""
+        if self.overflow_policy == 'coalesce':
+            # 优先把新帧合并到队尾，其次合并队列中相邻的中间帧，内容不会丢失
+            if self._queue and self._mergeable(self._queue[-1], frame):
+                self._queue[-1] = self._merge(self._queue[-1], frame)
+                self.coalesced += 1
+                return False
+            for index in range(len(self._queue) - 1):
+                if self._mergeable(self._queue[index], self._queue[index + 1]):
+                    self._queue[index] = self._merge(self._queue[index], self._queue[index + 1])
+                    del self._queue[index + 1]
+                    self.coalesced += 1
+                    return True
+        else:
+            # 丢弃最早的中间流式帧，为新帧腾出空间
+            for index, queued in enumerate(self._queue):
+                if queued.is_intermediate:
+                    del self._queue[index]
+                    self.dropped += 1
+                    BROADCAST_FAILURES.inc('overflow_drop')
+                    return True
+
+        # 无法腾出空间：丢弃新的中间帧，关键帧（普通消息、结束帧）仍然保留
+        if frame.is_intermediate:
+            self.dropped += 1
+            BROADCAST_FAILURES.inc('overflow_drop')
+            return False
+        return True
+
+    @staticmethod
+    def _mergeable(first: OutboundFrame, second: OutboundFrame) -> bool:
+        return (first.is_intermediate and second.is_intermediate
+                and first.message.get('id') == second.message.get('id')
+                and first.message.get('is_thinking') == second.message.get('is_thinking'))
+
+    @staticmethod
+    def _merge(first: OutboundFrame, second: OutboundFrame) -> OutboundFrame:
+        # 合并后的帧携带最后一帧的序号，客户端据此续传；seq_from 记录合并的第一帧
+        merged = dict(first.message)
+        merged['content'] = first.message.get('content', '') + second.message.get('content', '')
+        if 'seq' in second.message:
+            merged['seq_from'] = first.message.get('seq_from', first.message.get('seq', 0))
+            merged['seq'] = second.message['seq']
+        return OutboundFrame(merged)
+
+    def _ensure_writer_locked(self) -> None:
+        if self._writer is None:
+            self._writer = threading.Thread(
+                target=self._run,
+                name=f"ws_writer_{self.room_id[:8]}",
+                daemon=True
+            )
+            self._writer.start()
+
+    def _run(self) -> None:
+        """写线程：串行发送队列中的帧，空闲一段时间后退出；连接被标记关闭后发送关闭帧并退出"""
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    if not self._cond.wait(self.idle_timeout) and not self._queue:
+                        self._writer = None
+                        return
+                if self._closed:
+                    self._writer = None
+                    break
+                frame = self._queue.popleft()
+                self._sending = True
 
-        for ws in self.room_connections[room_id]:
             try:
-                ws.send(message_str)
+                self.ws.send(frame.payload_for(self.protocol))
+                self.sent += 1
             except Exception:
-                dead_connections.add(ws)
+                with self._cond:
+                    self._sending = False
+                    self._writer = None
+                    # 关闭时 shutdown 导致的发送失败不计入发送错误
+                    if not self._closed:
+                        BROADCAST_FAILURES.inc('send_error')
+                    self._closed = True
+                    self._queue.clear()
+                self._close_ws()
+                if self._on_dead:
+                    self._on_dead(self)
+                return
+            with self._cond:
+                self._sending = False
+        self._close_ws()
 
-        # 清理断开的连接
-        for ws in dead_connections:
-            self.remove_connection(room_id, ws)
+    def _close_locked(self, abort: bool = False) -> Optional[str]:
+        """
+        标记关闭并唤醒写线程，不在锁内操作 socket
+
+        Args:
+            abort: 不发送关闭帧直接断开（发送队列溢出的慢客户端，关闭帧同样发不出去）
+
+        Returns:
+            需要在锁外完成的动作，交给 _finish_close：
+            shutdown（写线程阻塞在发送中或 abort）、close（没有写线程）或 None（写线程自己发送关闭帧）
+        """
+        if self._closed:
+            return None
+        self._closed = True
+        self._queue.clear()
+        self._cond.notify_all()
+        if abort or self._sending:
+            # 慢客户端的发送缓冲区已满时写线程阻塞在发送中，shutdown 让发送返回
+            return 'shutdown'
+        if self._writer is None:
+            return 'close'
+        return None
+
+    def _finish_close(self, action: Optional[str]) -> None:
+        """在锁外完成关闭"""
+        if action == 'shutdown':
+            sock = getattr(self.ws, 'sock', None)
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+        elif action == 'close':
+            self._close_ws()
+
+    def _close_ws(self) -> None:
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        """关闭连接并丢弃未发送的帧"""
+        with self._cond:
+            action = self._close_locked()
+        self._finish_close(action)
+
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> dict:
+        """连接的发送队列统计"""
+        return {
+            'queue_depth': len(self._queue),
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'protocol': self.protocol,
+            'closed': self._closed
+        }
+
+
+class AsyncRoomConnection(RoomConnection):
+    """ASGI 模式下的 WebSocket 连接
+
+    发送队列与溢出策略与 RoomConnection 相同，但由事件循环中的写协程发送，
+    空闲连接不占用线程。可以从任意线程入队。
+    """
+
+    def __init__(self, room_id: str, ws: Any, loop: asyncio.AbstractEventLoop, **kwargs):
+        super().__init__(room_id, ws, **kwargs)
+        self.loop = loop
+        self._wakeup = asyncio.Event()
+
+    def _ensure_writer_locked(self) -> None:
+        # 写协程常驻，只需唤醒
+        self._wake()
+
+    def _wake(self) -> None:
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._wakeup.set()
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def run_writer(self) -> None:
+        """写协程：串行发送队列中的帧，直到连接关闭"""
+        while True:
+            with self._cond:
+                frame = self._queue.popleft() if self._queue else None
+                closed = self._closed
+            if frame is None:
+                if closed:
+                    return
+                self._wakeup.clear()
+                with self._cond:
+                    if self._queue or self._closed:
+                        continue
+                await self._wakeup.wait()
+                continue
+
+            try:
+                await self.ws.send_text(frame.payload_for(self.protocol))
+                self.sent += 1
+            except Exception:
+                BROADCAST_FAILURES.inc('send_error')
+                self.close()
+                if self._on_dead:
+                    self._on_dead(self)
+                return
+
+    def _close_locked(self, abort: bool = False) -> Optional[str]:
+        if self._closed:
+            return None
+        self._closed = True
+        self._queue.clear()
+        self._wake()
+
+        async def close_ws():
+            try:
+                await self.ws.close()
+            except Exception:
+                pass
+
+        if not self.loop.is_closed():
+            asyncio.run_coroutine_threadsafe(close_ws(), self.loop)
+
+
+class ChatRoomManager:
+    """聊天室连接管理器
+
+    广播经由 broker 发布：进程内后端直接分发给本进程的连接，
+    多进程后端还会把消息转发给其他进程，每个进程每个房间只收到一份，再在本进程内扇出。
+    """
+    def __init__(self, max_queue: int = 256, overflow_policy: str = 'coalesce', broker: Optional[Broker] = None):
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.room_connections: Dict[str, Dict[Sock, RoomConnection]] = {}
+        self._lock = threading.Lock()
+        self.broker = broker or LocalBroker()
+        self.broker.start(self._on_room_event)
+
+    def add_connection(self, room_id: str, ws: Sock, protocol: int = PROTOCOL_JSON,
+                       connection_class: type = RoomConnection, greeting: Any = None,
+                       last_seen: Optional[Tuple[str, int]] = None, **kwargs) -> RoomConnection:
+        """
+        添加WebSocket连接到房间，返回带发送队列的连接对象
+
+        Args:
+            greeting: 加入房间前最先发送的帧（如协议确认帧）
+            last_seen: 重连时客户端最后收到的 (回复 id, 帧序号)，先补发之后错过的帧再接收实时广播
+        """
+        connection = connection_class(
+            room_id,
+            ws,
+            max_queue=self.max_queue,
+            overflow_policy=self.overflow_policy,
+            on_dead=lambda conn: self.remove_connection(conn.room_id, conn.ws),
+            protocol=protocol,
+            **kwargs
+        )
+        if greeting:
+            connection.send(greeting)
+        if last_seen is None:
+            self._register(room_id, connection)
+        else:
+            msg_id, seq = last_seen
+
+            def attach(full_id: Optional[str], status: str, frames: List[dict]) -> None:
+                # 在回复的锁内执行：该回复的新帧要等连接加入房间后才会广播
+                connection.send({
+                    'id': full_id or msg_id,
+                    'type': 'resume',
+                    'content': status,
+                    'role': 'system',
+                    'seq': seq,
+                    'timestamp': datetime.utcnow().isoformat()
+                })
+                connection.replay(frames)
+                self._register(room_id, connection)
+
+            replay_buffer.resume(room_id, msg_id, seq, attach)
+        return connection
+
+    def _register(self, room_id: str, connection: RoomConnection) -> None:
+        ws = connection.ws
+        with self._lock:
+            first = room_id not in self.room_connections
+            if first:
+                self.room_connections[room_id] = {}
+            self.room_connections[room_id][ws] = connection
+        # 房间在本进程有了第一个连接时订阅
+        if first:
+            self.broker.subscribe(room_id)
+
+    def remove_connection(self, room_id: str, ws: Sock) -> None:
+        """从房间移除WebSocket连接"""
+        empty = False
+        with self._lock:
+            if room_id in self.room_connections:
+                self.room_connections[room_id].pop(ws, None)
+                if not self.room_connections[room_id]:
+                    del self.room_connections[room_id]
+                    empty = True
+        if empty:
+            self.broker.unsubscribe(room_id)
+
+    def get_connections(self, room_id: str) -> List[RoomConnection]:
+        """获取房间内连接的快照"""
+        with self._lock:
+            return list(self.room_connections.get(room_id, {}).values())
+
+    def broadcast_to_room(self, room_id: str, message: Any) -> None:
+        """向房间内所有连接广播消息（只入队，不等待发送）"""
+        self.broker.publish(room_id, EVENT_MESSAGE, message)
 
     def close_room(self, room_id: str) -> None:
         """关闭房间的所有连接"""
-        if room_id not in self.room_connections:
+        self.broker.publish(room_id, EVENT_CLOSE)
+
+    def _on_room_event(self, room_id: str, kind: str, payload: Any) -> None:
+        """处理 broker 投递到本进程的房间事件"""
+        if kind == EVENT_MESSAGE:
+            self._fan_out(room_id, payload)
+        elif kind == EVENT_CLOSE:
+            self._close_local(room_id)
+
+    def _fan_out(self, room_id: str, message: Any) -> None:
+        connections = self.get_connections(room_id)
+        if not connections:
             return
 
-        for ws in self.room_connections[room_id].copy():
-            try:
-                ws.close()
-            except:
-                pass
-            self.remove_connection(room_id, ws)
+        if isinstance(message, str):
+            frame = OutboundFrame(None, message)
+        else:
+            frame = OutboundFrame(message)
+
+        # 清理断开的连接
+        for connection in connections:
+            if not connection.enqueue(frame) and connection.closed:
+                BROADCAST_FAILURES.inc('closed')
+                self.remove_connection(room_id, connection.ws)
+
+    def _close_local(self, room_id: str) -> None:
+        for connection in self.get_connections(room_id):
+            connection.close()
+            self.remove_connection(room_id, connection.ws)
+
+    def stats(self) -> dict:
+        """各房间连接的发送队列统计"""
+        with self._lock:
+            rooms = {room_id: list(connections.values()) for room_id, connections in self.room_connections.items()}
+        return {
+            room_id: [connection.stats() for connection in connections]
+            for room_id, connections in rooms.items()
+        }
+
+    def connection_counts(self) -> Dict[str, int]:
+        """各房间当前打开的连接数"""
+        with self._lock:
+            return {room_id: len(connections) for room_id, connections in self.room_connections.items()}
 
 # 创建全局聊天室管理器实例
-chat_room_manager = ChatRoomManager()
+chat_room_manager = ChatRoomManager(
+    max_queue=config.OUTBOUND_QUEUE_SIZE,
+    overflow_policy=config.OUTBOUND_OVERFLOW_POLICY,
+    broker=create_broker(config.BROKER_BACKEND, socket_path=config.BROKER_SOCKET_PATH,
+                         max_queue=config.BROKER_QUEUE_SIZE)
+)
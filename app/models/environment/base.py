@@ -1,6 +1,9 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from pydantic import PrivateAttr
 from metagpt.environment.base_env import Environment
 from metagpt.schema import Message
 from metagpt.const import AGENT, IMAGES, MESSAGE_ROUTE_TO_ALL, TEAMLEADER_NAME
+from .compaction import MemoryCompactor, memory_compactor
 
 class BaseEnv(Environment):
     """基础环境类"""
@@ -9,6 +12,75 @@ class BaseEnv(Environment):
     direct_chat_roles: set[str] = set()  # record direct chat: @role_name
     is_public_chat: bool = True
 
+    # 记忆名称（history 或角色名）-> 每轮对话开始时的记忆长度
+    _turn_starts: Dict[str, List[int]] = PrivateAttr(default_factory=dict)
+    _turns: int = PrivateAttr(default=0)
+    _compactions: int = PrivateAttr(default=0)
+    _removed_messages: int = PrivateAttr(default=0)
+
+    def _memories(self) -> Iterator[Tuple[str, object]]:
+        """环境历史和各角色的记忆"""
+        yield 'history', self.history
+        for role in self.roles.values():
+            memory = getattr(getattr(role, 'rc', None), 'memory', None)
+            if memory is not None:
+                yield role.name, memory
+
+    @staticmethod
+    def _replace_storage(memory, messages: List[Message]) -> None:
+        """替换记忆中的消息并重建 cause_by 索引（Memory.add 逐条查重，消息多时开销大）"""
+        memory.clear()
+        for message in messages:
+            memory.storage.append(message)
+            if message.cause_by:
+                memory.index[message.cause_by].append(message)
+
+    def begin_turn(self) -> None:
+        """记录一轮对话开始时各记忆的位置，压缩时按轮保留"""
+        self._turns += 1
+        for name, memory in self._memories():
+            self._turn_starts.setdefault(name, []).append(memory.count())
+
+    def compact_memory(self, compactor: Optional[MemoryCompactor] = None) -> int:
+        """按压缩策略整理环境历史和角色记忆，返回移除的消息数"""
+        compactor = compactor or memory_compactor
+        if not compactor.enabled:
+            self._turn_starts.clear()
+            return 0
+
+        removed = 0
+        for name, memory in self._memories():
+            result = compactor.compact(list(memory.storage), self._turn_starts.get(name, []))
+            if result is None:
+                continue
+            messages, turn_starts, count = result
+            self._replace_storage(memory, messages)
+            self._turn_starts[name] = turn_starts
+            removed += count
+
+        if removed:
+            self._compactions += 1
+            self._removed_messages += removed
+        return removed
+
+    def memory_usage(self) -> dict:
+        """各记忆的消息数和字符数，以及压缩统计"""
+        memories = {}
+        for name, memory in self._memories():
+            storage = list(memory.storage)
+            memories[name] = {
+                'messages': len(storage),
+                'chars': sum(len(str(message.content)) for message in storage)
+            }
+        return {
+            'turns': self._turns,
+            'messages': sum(usage['messages'] for usage in memories.values()),
+            'chars': sum(usage['chars'] for usage in memories.values()),
+            'compactions': self._compactions,
+            'removed_messages': self._removed_messages,
+            'memories': memories
+        }
+
     def move_message_info_to_content(self, message: Message) -> Message:
         """Two things here:
         1. Convert role, since role field must be reserved for LLM API, and is limited to, for example, one of ["user", "assistant", "system"]
@@ -0,0 +1,114 @@
+from typing import List, Optional
+
+from metagpt.schema import Message
+from config.settings import config
+
+# 摘要消息的标题，TeamLeader 读到的是折叠后的早期对话
+SUMMARY_HEADER = "[Summary of earlier conversation]"
+
+
+class MemoryCompactor:
+    """环境和角色记忆的压缩策略
+
+    - 最近 keep_turns 轮对话原样保留
+    - 更早的消息按 mode 处理：summary 折叠为一条摘要消息（不调用 LLM，按轮截取要点），drop 直接丢弃
+    - 保留部分的内容总量超过 max_chars 时，从最旧的消息开始丢弃（至少保留最后一条）
+    """
+
+    MODES = ('summary', 'drop', 'off')
+
+    def __init__(self, keep_turns: int = 10, mode: str = 'summary', max_chars: int = 50000,
+                 summary_chars: int = 4000, line_chars: int = 200):
+        if mode not in self.MODES:
+            raise ValueError(f"不支持的压缩方式: {mode}")
+        self.keep_turns = max(1, keep_turns)
+        self.mode = mode
+        self.max_chars = max(1, max_chars)
+        self.summary_chars = max(0, summary_chars)
+        self.line_chars = max(1, line_chars)
+
+    @classmethod
+    def from_config(cls) -> "MemoryCompactor":
+        """按 ENV_MEMORY_* 配置创建"""
+        return cls(
+            keep_turns=config.ENV_MEMORY_KEEP_TURNS,
+            mode=config.ENV_MEMORY_COMPACTION,
+            max_chars=config.ENV_MEMORY_MAX_CHARS,
+            summary_chars=config.ENV_MEMORY_SUMMARY_CHARS
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'off'
+
+    @staticmethod
+    def is_summary(message: Message) -> bool:
+        return isinstance(message.content, str) and message.content.startswith(SUMMARY_HEADER)
+
+    def summarize(self, previous: Optional[Message], folded: List[Message]) -> Optional[Message]:
+        """把被折叠的消息合并进摘要：每条消息截取开头一行，超出 summary_chars 时保留最新的部分"""
+        lines = []
+        if previous is not None:
+            lines.extend(previous.content[len(SUMMARY_HEADER):].strip('\n').split('\n'))
+        for message in folded:
+            content = ' '.join(str(message.content).split())
+            if not content:
+                continue
+            if len(content) > self.line_chars:
+                content = content[:self.line_chars] + '...'
+            lines.append(f"- {message.role}: {content}")
+
+        total = 0
+        kept = []
+        for line in reversed(lines):
+            total += len(line) + 1
+            if total > self.summary_chars:
+                break
+            kept.append(line)
+        if not kept:
+            return None
+        kept.reverse()
+        return Message(content=SUMMARY_HEADER + '\n' + '\n'.join(kept), role="user")
+
+    def compact(self, messages: List[Message], turn_starts: List[int]) -> Optional[tuple]:
+        """计算压缩后的消息列表
+
+        Args:
+            messages: 记忆中的全部消息（从旧到新）
+            turn_starts: 每轮对话开始时记忆的长度（递增）
+
+        Returns:
+            (保留的消息, 新的轮次起点, 移除的消息数)；无需压缩时返回 None
+        """
+        if not self.enabled:
+            return None
+
+        previous = messages[0] if messages and self.is_summary(messages[0]) else None
+        start = 1 if previous is not None else 0
+        cut = start
+        if len(turn_starts) > self.keep_turns:
+            cut = max(start, turn_starts[-self.keep_turns])
+
+        size = sum(len(str(message.content)) for message in messages[cut:])
+        while size > self.max_chars and cut < len(messages) - 1:
+            size -= len(str(messages[cut].content))
+            cut += 1
+        kept = messages[cut:]
+
+        if cut == start:
+            return None
+
+        folded = messages[start:cut]
+        summary = previous
+        if self.mode == 'summary':
+            summary = self.summarize(previous, folded)
+        head = [summary] if summary is not None else []
+
+        result = head + kept
+        offset = cut - len(head)
+        new_turn_starts = [max(len(head), position - offset) for position in turn_starts if position >= cut]
+        return result, new_turn_starts, len(folded)
+
+
+# 创建全局记忆压缩策略
+memory_compactor = MemoryCompactor.from_config()
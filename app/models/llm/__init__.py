@@ -0,0 +1,3 @@
+from .fake_llm import FakeLLM, install_llm
+
+__all__ = ['FakeLLM', 'install_llm']
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import time
+from typing import List, Optional, Sequence, Tuple, Union
+
+from metagpt.configs.llm_config import LLMConfig, LLMType
+from metagpt.const import USE_CONFIG_TIMEOUT
+from metagpt.logs import log_llm_stream
+from metagpt.provider.base_llm import BaseLLM
+from config.settings import config
+
+# TeamLeader 默认的脚本回复：直接回复用户并结束
+DEFAULT_REPLIES = [
+    '```json\n'
+    '[\n'
+    '    {"command_name": "RoleZero.reply_to_human", "args": {"content": "北京今天晴，气温 15~25℃，西北风 3-4 级。"}},\n'
+    '    {"command_name": "end"}\n'
+    ']\n'
+    '```'
+]
+
+Reply = Union[str, List[str]]
+
+
+class FakeLLM(BaseLLM):
+    """确定性的 LLM 替身，用于离线压测和性能分析
+
+    按顺序返回脚本中的回复（用完后循环），也可以按最后一条用户消息中的关键字匹配回复。
+    流式调用与真实 provider 一样通过 log_llm_stream 逐块输出，
+    首块前等待 latency 秒，块之间等待 chunk_delay 秒。
+    """
+
+    def __init__(self, replies: Optional[Sequence[Reply]] = None,
+                 rules: Optional[Sequence[Tuple[str, Reply]]] = None,
+                 latency: float = 0.0, chunk_size: int = 8, chunk_delay: float = 0.0,
+                 llm_config: Optional[LLMConfig] = None):
+        self.config = llm_config or LLMConfig(api_type=LLMType.OPENAI, model='fake', api_key='fake')
+        self.model = 'fake'
+        self.pricing_plan = 'fake'
+        self.cost_manager = None
+
+        self.replies = list(replies or DEFAULT_REPLIES)
+        self.rules = list(rules or [])
+        self.latency = latency
+        self.chunk_size = max(1, chunk_size)
+        self.chunk_delay = chunk_delay
+
+        self._index = 0
+        self.calls = 0
+        # 模拟的等待时间合计，用于从总耗时中扣除 LLM 部分
+        self.simulated_time = 0.0
+
+    @classmethod
+    def from_config(cls) -> "FakeLLM":
+        """按 FAKE_LLM_* 配置创建，FAKE_LLM_SCRIPT 为脚本文件路径"""
+        replies, rules = None, None
+        if config.FAKE_LLM_SCRIPT:
+            replies, rules = cls.load_script(config.FAKE_LLM_SCRIPT)
+        return cls(
+            replies=replies,
+            rules=rules,
+            latency=config.FAKE_LLM_LATENCY,
+            chunk_size=config.FAKE_LLM_CHUNK_SIZE,
+            chunk_delay=config.FAKE_LLM_CHUNK_DELAY
+        )
+
+    @staticmethod
+    def load_script(path: str) -> Tuple[List[Reply], List[Tuple[str, Reply]]]:
+        """读取脚本文件：{"replies": [...], "rules": [{"match": "...", "reply": "..."}]}
+
+        回复可以是字符串，也可以是字符串列表（按给定的分块流式输出）。
+        """
+        with open(path, encoding='utf-8') as f:
+            script = json.load(f)
+        rules = [(rule['match'], rule['reply']) for rule in script.get('rules', [])]
+        return script.get('replies') or None, rules
+
+    def _next_reply(self, messages: list) -> List[str]:
+        self.calls += 1
+        prompt = ''
+        for message in reversed(messages):
+            if isinstance(message, dict) and message.get('role') == 'user':
+                prompt = str(message.get('content', ''))
+                break
+
+        reply = None
+        for match, candidate in self.rules:
+            if match in prompt:
+                reply = candidate
+                break
+        if reply is None:
+            reply = self.replies[self._index % len(self.replies)]
+            self._index += 1
+
+        if isinstance(reply, str):
+            return [reply[i:i + self.chunk_size] for i in range(0, len(reply), self.chunk_size)] or ['']
+        return list(reply)
+
+    async def _sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            started = time.perf_counter()
+            await asyncio.sleep(seconds)
+            self.simulated_time += time.perf_counter() - started
+
+    @staticmethod
+    def _completion(content: str) -> dict:
+        return {
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0}
+        }
+
+    async def _achat_completion(self, messages: list, timeout: int = USE_CONFIG_TIMEOUT) -> dict:
+        chunks = self._next_reply(messages)
+        await self._sleep(self.latency)
+        return self._completion(''.join(chunks))
+
+    async def acompletion(self, messages: list, timeout: int = USE_CONFIG_TIMEOUT) -> dict:
+        return await self._achat_completion(messages, timeout=timeout)
+
+    async def _achat_completion_stream(self, messages: list, timeout: int = USE_CONFIG_TIMEOUT) -> str:
+        chunks = self._next_reply(messages)
+        await self._sleep(self.latency)
+        for index, chunk in enumerate(chunks):
+            if index:
+                await self._sleep(self.chunk_delay)
+            log_llm_stream(chunk)
+        log_llm_stream("\n")
+        return ''.join(chunks)
+
+
+def install_llm(role, llm: BaseLLM) -> None:
+    """替换角色及其动作使用的 LLM"""
+    role.llm = llm
+    for action in getattr(role, 'actions', None) or []:
+        if hasattr(action, 'set_llm'):
+            action.set_llm(llm, override=True)
+        else:
+            action.llm = llm
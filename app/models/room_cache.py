@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from config.settings import config
+from .agent import Agent
+from .agents.registry import agent_registry
+from .base import db
+from .chat import ChatRoom
+
+
+class CachedRoom:
+    """房间的元数据和所用的 agent（已脱离数据库会话，可在线程间共享）"""
+    __slots__ = ('id', 'agent_type', 'agent_id', 'created_at', 'agent', 'expires_at')
+
+    def __init__(self, room_id: str, agent_type: str, agent_id: str, created_at: datetime, agent: Agent,
+                 expires_at: float):
+        self.id = room_id
+        self.agent_type = agent_type
+        self.agent_id = agent_id
+        self.created_at = created_at
+        self.agent = agent
+        self.expires_at = expires_at
+
+
+class RoomCache:
+    """房间 -> agent 解析结果的进程内缓存
+
+    WebSocket 连接和每条消息都要知道房间使用哪个 agent，命中缓存时不访问数据库。
+    - 房间按 LRU 保留最多 max_size 个，条目 ttl 秒后过期（多进程部署时其他进程删除的房间最多在此期间内可见）
+    - agent 按 id 缓存，每个类型只有一行且不会修改，进程内只读取一次
+    - 删除房间时调用 invalidate；max_size 为 0 时不缓存房间
+    未命中时的加载需要在 Flask 应用上下文中调用。
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max(0, max_size)
+        self.ttl = ttl
+        self._rooms: "OrderedDict[str, CachedRoom]" = OrderedDict()
+        self._agents: Dict[str, Agent] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def peek(self, room_id: str) -> Optional[CachedRoom]:
+        """只查缓存，不访问数据库"""
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                return None
+            if room.expires_at <= time.monotonic():
+                del self._rooms[room_id]
+                return None
+            self._rooms.move_to_end(room_id)
+            self.hits += 1
+            return room
+
+    def get(self, room_id: str) -> Optional[CachedRoom]:
+        """获取房间，未命中时从数据库加载；房间不存在或已标记删除时返回 None（不缓存）"""
+        room = self.peek(room_id)
+        if room is not None:
+            return room
+        with self._lock:
+            self.misses += 1
+        return self._load(room_id)
+
+    def _load(self, room_id: str) -> Optional[CachedRoom]:
+        # 只读取列：agent 的实现类可能还没有导入，不能直接按 type 加载 agent 子类
+        row = db.session.query(ChatRoom.agent_type, ChatRoom.agent_id, ChatRoom.created_at).filter(
+            ChatRoom.id == room_id, ChatRoom.deleted_at.is_(None)
+        ).first()
+        if row is None:
+            return None
+        agent = self.get_agent(row.agent_type, row.agent_id)
+        if agent is None:
+            return None
+        return self._store(room_id, row.agent_type, row.agent_id, row.created_at, agent)
+
+    def get_agent(self, agent_type: str, agent_id: str) -> Optional[Agent]:
+        """按 id 获取 agent，第一次使用时导入实现类并从数据库读取"""
+        agent = self._agents.get(agent_id)
+        if agent is not None:
+            return agent
+        agent_registry.get_class(agent_type)
+        agent = Agent.query.get(agent_id)
+        if agent is None:
+            return None
+        # 脱离会话后对象不会再因提交而过期，属性已全部加载
+        db.session.expunge(agent)
+        with self._lock:
+            return self._agents.setdefault(agent_id, agent)
+
+    def put(self, room_id: str, agent_type: str, agent_id: str, created_at: datetime) -> Optional[CachedRoom]:
+        """写入刚创建的房间，之后的连接不需要再读取数据库"""
+        agent = self.get_agent(agent_type, agent_id)
+        if agent is None:
+            return None
+        return self._store(room_id, agent_type, agent_id, created_at, agent)
+
+    def _store(self, room_id: str, agent_type: str, agent_id: str, created_at: datetime,
+               agent: Agent) -> CachedRoom:
+        room = CachedRoom(room_id, agent_type, agent_id, created_at, agent, time.monotonic() + self.ttl)
+        if self.max_size == 0:
+            return room
+        with self._lock:
+            self._rooms[room_id] = room
+            self._rooms.move_to_end(room_id)
+            while len(self._rooms) > self.max_size:
+                self._rooms.popitem(last=False)
+                self.evictions += 1
+        return room
+
+    def invalidate(self, room_id: str) -> None:
+        """移除房间（删除房间时调用）"""
+        with self._lock:
+            if self._rooms.pop(room_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rooms.clear()
+            self._agents.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'rooms': len(self._rooms),
+                'agents': len(self._agents),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions
+            }
+
+
+# 创建全局房间缓存实例
+room_cache = RoomCache(max_size=config.ROOM_CACHE_SIZE, ttl=config.ROOM_CACHE_TTL)
@@ -0,0 +1,18 @@
+import logging
+
+import uvicorn
+
+from app.asgi import create_asgi_app
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    filename='multiagent.log'
+)
+logger = logging.getLogger(__name__)
+
+app = create_asgi_app()
+
+if __name__ == '__main__':
+    uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -11,16 +11,111 @@ class Config:
     DEBUG = os.environ.get('DEBUG', 'False').lower() == 'true'
 
     # 数据库配置
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
-        'sqlite:///' + os.path.join(ROOT_DIR, 'app.db')
+    # 默认沿用 instance/multiagent.db（相对路径由 Flask-SQLAlchemy 解析到应用的 instance 目录）
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///multiagent.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))          # 连接池常驻连接数
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '20'))    # 超出常驻连接数后最多再创建的连接数
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))  # 等待空闲连接的超时时间（秒）
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))  # 连接的最长使用时间（秒），只用于服务端数据库
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'True').lower() == 'true'  # 取出连接前检测是否可用，只用于服务端数据库
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')      # SQLite 日志模式，WAL 下读写互不阻塞；为空时不设置
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')     # SQLite 同步级别，WAL 下 NORMAL 只在检查点时 fsync；为空时不设置
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'))  # 数据库被锁时等待的毫秒数
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))  # 内存映射读取的字节数，0 表示不使用
 
     # API配置
     API_PREFIX = '/api/v1'
+    ASGI_WSGI_WORKERS = int(os.environ.get('ASGI_WSGI_WORKERS', '10'))  # ASGI 模式下运行 Flask 请求的线程数（流式导出会占用一个线程直到结束）
 
     # 代理配置
-    AGENT_TIMEOUT = 30  # 代理超时时间（秒）
-    MAX_AGENTS = 10     # 最大代理数量
+    AGENT_TIMEOUT = float(os.environ.get('AGENT_TIMEOUT', '30'))  # agent 单次运行的超时时间（秒），超时后保存已生成的部分并标记为截断
+    MAX_AGENTS = 10     # 最大代理数量（同时运行的 agent 任务数）
+    SCHEDULER_MAX_QUEUE = int(os.environ.get('SCHEDULER_MAX_QUEUE', '100'))  # 排队任务上限，超出时拒绝
+    AGENT_CONCURRENCY = {   # 各 agent 类型的并发上限，未配置的类型为 MAX_AGENTS
+        'weather': 6
+    }
+    AGENT_RUNTIME_LOOPS = int(os.environ.get('AGENT_RUNTIME_LOOPS', '1'))  # agent 共享事件循环数量
+    STREAM_CHANNEL_SIZE = 256  # 流式事件通道缓冲区大小
+    STREAM_COALESCE_WINDOW = float(os.environ.get('STREAM_COALESCE_WINDOW', '0.03'))  # 流式分片合并窗口（秒），0 表示不合并
+    STREAM_COALESCE_MAX_BYTES = 2048  # 合并后单帧的最大字节数
+    ENV_CACHE_SIZE = int(os.environ.get('ENV_CACHE_SIZE', '100'))  # 房间环境缓存容量
+    ENV_CACHE_TTL = float(os.environ.get('ENV_CACHE_TTL', '1800'))  # 房间环境空闲过期时间（秒）
+    ENV_MEMORY_COMPACTION = os.environ.get('ENV_MEMORY_COMPACTION', 'summary')  # 房间环境记忆的压缩方式：summary / drop / off
+    ENV_MEMORY_KEEP_TURNS = int(os.environ.get('ENV_MEMORY_KEEP_TURNS', '10'))    # 原样保留的最近对话轮数
+    ENV_MEMORY_MAX_CHARS = int(os.environ.get('ENV_MEMORY_MAX_CHARS', '50000'))   # 每个记忆保留部分的字符上限
+    ENV_MEMORY_SUMMARY_CHARS = int(os.environ.get('ENV_MEMORY_SUMMARY_CHARS', '4000'))  # 折叠摘要的字符上限
+    # 启用回复缓存的 agent 类型及其 TTL（秒）和容量，如 {'repeater': {'ttl': 600, 'max_size': 500}}，默认不缓存。
+    # 缓存键只有消息文本，跨房间共享且不经过房间的环境和历史，只能列出回复与上下文无关的 agent
+    RESPONSE_CACHE = {}
+    RESPONSE_CACHE_TTL = 300   # 回复缓存的默认 TTL（秒）
+    RESPONSE_CACHE_SIZE = 256  # 回复缓存每个 agent 类型的默认容量
+
+    # agent 实现模块按需导入，列出的类型在启动时预先导入（逗号分隔，如 weather）
+    AGENT_PRELOAD = [t.strip() for t in os.environ.get('AGENT_PRELOAD', '').split(',') if t.strip()]
+    BASE_AGENT_POOL_SIZE = int(os.environ.get('BASE_AGENT_POOL_SIZE', '4'))  # 每个事件循环中每类 BaseAgent（agents/）的实例上限
+    CHAT_HISTORY_MAX_MESSAGES = int(os.environ.get('CHAT_HISTORY_MAX_MESSAGES', '100'))        # 聊天 agent 每个用户保留的消息数
+    CHAT_HISTORY_MAX_CHARS = int(os.environ.get('CHAT_HISTORY_MAX_CHARS', '20000'))            # 每个用户的对话历史字符上限
+    CHAT_HISTORY_MAX_USERS = int(os.environ.get('CHAT_HISTORY_MAX_USERS', '10000'))            # 每个实例保留的用户数，超出时淘汰最久未访问的用户
+    CHAT_HISTORY_MAX_TOTAL_CHARS = int(os.environ.get('CHAT_HISTORY_MAX_TOTAL_CHARS', '5000000'))  # 每个实例所有用户的字符总上限
+
+    # 压测用的合成 agent
+    SYNTHETIC_AGENT_ENABLED = os.environ.get('SYNTHETIC_AGENT_ENABLED', 'False').lower() == 'true'  # 是否注册合成 agent
+    SYNTHETIC_AGENT_CHUNKS = int(os.environ.get('SYNTHETIC_AGENT_CHUNKS', '50'))         # 每个回复的分片数
+    SYNTHETIC_AGENT_CHUNK_SIZE = int(os.environ.get('SYNTHETIC_AGENT_CHUNK_SIZE', '16'))  # 每个分片的字符数
+    SYNTHETIC_AGENT_DELAY = float(os.environ.get('SYNTHETIC_AGENT_DELAY', '0.01'))       # 分片之间的间隔（秒）
+
+    # 离线压测用的 LLM 替身
+    WEATHER_AGENT_LLM = os.environ.get('WEATHER_AGENT_LLM', '')  # 为 fake 时天气 agent 使用脚本回复的 FakeLLM
+    FAKE_LLM_SCRIPT = os.environ.get('FAKE_LLM_SCRIPT', '')      # 回复脚本（JSON）路径，为空时使用内置的回复
+    FAKE_LLM_LATENCY = float(os.environ.get('FAKE_LLM_LATENCY', '0.5'))        # 首块前的等待时间（秒）
+    FAKE_LLM_CHUNK_SIZE = int(os.environ.get('FAKE_LLM_CHUNK_SIZE', '8'))       # 每块的字符数
+    FAKE_LLM_CHUNK_DELAY = float(os.environ.get('FAKE_LLM_CHUNK_DELAY', '0.02'))  # 块之间的等待时间（秒）
+
+    # 房间 -> agent 解析缓存
+    ROOM_CACHE_SIZE = int(os.environ.get('ROOM_CACHE_SIZE', '10000'))  # 缓存的房间数上限，0 表示不缓存
+    ROOM_CACHE_TTL = float(os.environ.get('ROOM_CACHE_TTL', '300'))    # 缓存条目的有效期（秒），多进程部署时其他进程删除的房间最多在此期间内可见
+
+    # WebSocket 发送配置
+    OUTBOUND_QUEUE_SIZE = 256              # 每个连接的发送队列上限
+    OUTBOUND_OVERFLOW_POLICY = os.environ.get('OUTBOUND_OVERFLOW_POLICY', 'coalesce')  # drop / coalesce / disconnect
+    REPLAY_MAX_STREAMS = int(os.environ.get('REPLAY_MAX_STREAMS', '500'))    # 重放缓冲区最多保留的回复数
+    REPLAY_MAX_FRAMES = int(os.environ.get('REPLAY_MAX_FRAMES', '2048'))      # 每个回复最多保留的帧数
+    REPLAY_MAX_CHARS = int(os.environ.get('REPLAY_MAX_CHARS', '65536'))       # 每个回复最多保留的字符数
+    REPLAY_TTL = float(os.environ.get('REPLAY_TTL', '120'))                   # 回复结束后保留的时间（秒），客户端需在此之前重连
+    RESUME_GRACE = float(os.environ.get('RESUME_GRACE', '15'))                # 房间内最后一个连接断开后，等待重连多久再取消其发起的运行（秒），0 表示立即取消
+    BROKER_BACKEND = os.environ.get('BROKER_BACKEND', 'local')  # 房间消息广播后端：local（单进程）/ unix（同机多进程）
+    BROKER_SOCKET_PATH = os.environ.get('BROKER_SOCKET_PATH') or os.path.join(
+        os.environ.get('XDG_RUNTIME_DIR') or os.path.join(ROOT_DIR, 'instance'), 'multiagent', 'broker.sock'
+    )  # unix 后端的中转 socket 路径，默认放在 $XDG_RUNTIME_DIR（未设置时为 instance 目录）下仅当前用户可访问的子目录
+    BROKER_QUEUE_SIZE = int(os.environ.get('BROKER_QUEUE_SIZE', '1024'))  # unix 后端每个连接待发送帧的上限，满时丢弃发布或断开慢的进程
+
+    # 消息持久化配置
+    MESSAGE_WRITE_BEHIND = os.environ.get('MESSAGE_WRITE_BEHIND', 'False').lower() == 'true'  # 是否批量异步写入消息
+    MESSAGE_BATCH_SIZE = 100       # 每批最多写入的消息数量
+    MESSAGE_FLUSH_INTERVAL = 0.05  # 凑批的最长等待时间（秒）
+
+    # 消息保留与归档
+    RETENTION_TTL_DAYS = float(os.environ.get('RETENTION_TTL_DAYS', '30'))  # 消息在数据库中保留的天数，0 表示不限
+    RETENTION_MAX_ROWS = int(os.environ.get('RETENTION_MAX_ROWS', '5000'))  # 每个房间在数据库中保留的消息数，0 表示不限
+    RETENTION_ARCHIVE = os.environ.get('RETENTION_ARCHIVE', 'True').lower() == 'true'  # 清理前是否归档，归档的消息仍可通过历史接口读取
+    RETENTION = {           # 各 agent 类型的保留策略（ttl_days / max_rows / archive），未配置的项使用上面的默认值
+        'synthetic': {'ttl_days': 1, 'max_rows': 1000, 'archive': False}
+    }
+    RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', '300'))  # 后台清理的间隔（秒），0 表示不自动清理
+    RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', '500'))  # 清理和删除房间时每个事务处理的消息数
+    RETENTION_BATCH_PAUSE = float(os.environ.get('RETENTION_BATCH_PAUSE', '0.05'))  # 批次之间的间隔（秒），让出数据库写锁
+    RETENTION_MAX_BATCHES = int(os.environ.get('RETENTION_MAX_BATCHES', '200'))  # 每轮清理最多处理的批次数，剩余的下一轮继续
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(ROOT_DIR, 'data', 'archive'))  # 消息归档目录
+    ARCHIVE_SEGMENT_BYTES = int(os.environ.get('ARCHIVE_SEGMENT_BYTES', str(4 * 1024 * 1024)))  # 归档分段文件的大小上限
+
+    # 聊天记录导出与导入
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))  # 导出时每次查询读取的消息数
+    EXPORT_CHUNK_BYTES = int(os.environ.get('EXPORT_CHUNK_BYTES', str(64 * 1024)))  # 攒够多少字节发送一次
+    EXPORT_GZIP_LEVEL = int(os.environ.get('EXPORT_GZIP_LEVEL', '6'))  # gzip 压缩级别
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '1000'))  # 导入时每个事务写入的消息数
+    IMPORT_MAX_LINE_BYTES = int(os.environ.get('IMPORT_MAX_LINE_BYTES', str(4 * 1024 * 1024)))  # 导入数据单行的字节上限
+    IMPORT_MAX_BYTES = int(os.environ.get('IMPORT_MAX_BYTES', str(4 * 1024 * 1024 * 1024)))  # 导入数据解压后的总字节上限，0 表示不限制
 
     # 日志配置
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
@@ -0,0 +1,67 @@
+"""
+BaseAgent 适配器吞吐基准：在单个事件循环（单核）上并发执行 agents/ 中的轻量 agent
+
+不启动服务器、不访问数据库，直接调用适配器的 agenerate_response_stream，
+统计每秒完成的请求数、单次请求延迟和实例池的使用情况。
+
+用法：
+    python -m scripts.bench_base_agents --requests 20000 --concurrency 200
+    python -m scripts.bench_base_agents --agent hello --pool-size 1
+"""
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+
+from app.models.agents import agent_registry
+from config.settings import config
+from scripts.bench_ws_load import percentile
+
+
+async def run_benchmark(agent, requests: int, concurrency: int, rooms: int) -> dict:
+    latency = []
+    counter = iter(range(requests))
+
+    async def client(index: int) -> None:
+        room_id = f'room-{index % rooms}'
+        for i in counter:
+            started = time.perf_counter()
+            async for _event in agent.agenerate_response_stream(f'message {i}', room_id=room_id):
+                pass
+            latency.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        'elapsed': elapsed,
+        'rps': len(latency) / elapsed if elapsed else 0.0,
+        'latency': [percentile(latency, q) for q in (50, 95, 99)],
+        # 事件循环结束后实例池随之释放，在循环内读取
+        'pool': agent.get_pool().stats()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BaseAgent 适配器单核吞吐基准")
+    parser.add_argument("--agent", choices=['chat', 'hello'], default='hello', help="agent 类型")
+    parser.add_argument("--requests", type=int, default=20000, help="请求总数")
+    parser.add_argument("--concurrency", type=int, default=100, help="并发客户端数")
+    parser.add_argument("--rooms", type=int, default=100, help="房间数（chat 按房间记录对话历史）")
+    parser.add_argument("--pool-size", type=int, default=config.BASE_AGENT_POOL_SIZE, help="每个事件循环的实例上限")
+    args = parser.parse_args()
+
+    config.BASE_AGENT_POOL_SIZE = args.pool_size
+    agent_class = agent_registry.get_class(args.agent)
+    agent = agent_class(id=str(uuid4()), name=args.agent, type=args.agent)
+
+    result = asyncio.run(run_benchmark(agent, args.requests, args.concurrency, max(1, args.rooms)))
+    stats = result['pool']
+    print(f"agent={args.agent} requests={args.requests} concurrency={args.concurrency} pool={args.pool_size}")
+    print(f"throughput: {result['rps']:.0f} req/s ({result['elapsed']:.2f}s)")
+    print("latency us:  p50 {:8.1f}  p95 {:8.1f}  p99 {:8.1f}".format(*(v * 1e6 for v in result['latency'])))
+    print(f"pool: size {stats['size']}  processed {stats['processed']}  waited {stats['waited']}")
+
+
+if __name__ == "__main__":
+    main()
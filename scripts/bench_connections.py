@@ -0,0 +1,160 @@
+"""
+连接容量基准：对比线程模式（Flask + flask-sock）与 ASGI 模式下空闲 WebSocket 连接的资源占用
+
+分别启动两种服务器子进程（使用临时数据库），创建一个房间后建立 N 个空闲连接，
+读取服务器进程的 RSS 和线程数，计算每个连接的平均开销。
+
+用法：
+    python -m scripts.bench_connections --connections 500
+    python -m scripts.bench_connections --connections 2000 --mode asgi
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Optional
+
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'thread': (
+        "from app import create_app\n"
+        "app = create_app({config!r})\n"
+        "app.run(host='127.0.0.1', port={port}, threaded=True)\n"
+    ),
+    'asgi': (
+        "import uvicorn\n"
+        "from app import create_app\n"
+        "from app.asgi import create_asgi_app\n"
+        "api = create_asgi_app(create_app({config!r}))\n"
+        "uvicorn.run(api, host='127.0.0.1', port={port}, log_level='warning')\n"
+    ),
+}
+
+
+def start_server(mode: str, port: int, app_config: Optional[dict] = None, env: Optional[dict] = None) -> subprocess.Popen:
+    """在子进程中启动服务器，默认使用临时目录中的 SQLite 数据库"""
+    app_config = dict(app_config or {})
+    if 'DATABASE_URI' not in app_config:
+        workdir = tempfile.mkdtemp(prefix='bench_')
+        app_config['DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    return subprocess.Popen(
+        [sys.executable, '-c', SERVERS[mode].format(config=app_config, port=port)],
+        cwd=ROOT,
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+
+def stop_server(server: subprocess.Popen) -> None:
+    server.terminate()
+    try:
+        server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def read_process_status(pid: int) -> dict:
+    """从 /proc 读取进程的常驻内存（KB）和线程数"""
+    status = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'Threads'):
+                status[key] = int(value.split()[0])
+    return status
+
+
+def wait_for_server(base_url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'{base_url}/api/health', timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"服务器 {base_url} 未能启动")
+
+
+def create_room(base_url: str, agent_type: str = 'repeater') -> str:
+    request = urllib.request.Request(
+        f'{base_url}/api/chat/rooms',
+        data=json.dumps({'agent_type': agent_type}).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    return json.loads(urllib.request.urlopen(request).read())['roomId']
+
+
+async def open_connections(ws_url: str, count: int, concurrency: int) -> list:
+    """建立 count 个连接并读完欢迎消息，返回连接列表"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def connect():
+        async with semaphore:
+            ws = await websockets.connect(ws_url, open_timeout=30, ping_interval=None)
+            await ws.recv()
+            return ws
+
+    return await asyncio.gather(*(connect() for _ in range(count)))
+
+
+async def measure(mode: str, port: int, connections: int, concurrency: int, settle: float) -> dict:
+    server = start_server(mode, port)
+    base_url = f'http://127.0.0.1:{port}'
+    sockets = []
+    try:
+        await asyncio.to_thread(wait_for_server, base_url)
+        room_id = await asyncio.to_thread(create_room, base_url)
+        await asyncio.sleep(settle)
+        baseline = read_process_status(server.pid)
+
+        started = time.perf_counter()
+        sockets = await open_connections(f'ws://127.0.0.1:{port}/chat/{room_id}', connections, concurrency)
+        connect_time = time.perf_counter() - started
+        await asyncio.sleep(settle)
+        loaded = read_process_status(server.pid)
+
+        return {
+            'mode': mode,
+            'connections': len(sockets),
+            'connect_s': connect_time,
+            'rss_base_mb': baseline['VmRSS'] / 1024,
+            'rss_mb': loaded['VmRSS'] / 1024,
+            'rss_per_conn_kb': (loaded['VmRSS'] - baseline['VmRSS']) / max(1, len(sockets)),
+            'threads': loaded['Threads'],
+        }
+    finally:
+        await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+        stop_server(server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket 连接容量基准")
+    parser.add_argument("--connections", type=int, default=500, help="空闲连接数量")
+    parser.add_argument("--mode", choices=['thread', 'asgi', 'both'], default='both', help="服务器模式")
+    parser.add_argument("--port", type=int, default=5900, help="服务器端口")
+    parser.add_argument("--concurrency", type=int, default=50, help="同时进行的握手数量")
+    parser.add_argument("--settle", type=float, default=1.0, help="采样前等待的秒数")
+    args = parser.parse_args()
+
+    modes = ['thread', 'asgi'] if args.mode == 'both' else [args.mode]
+    for i, mode in enumerate(modes):
+        result = asyncio.run(measure(mode, args.port + i, args.connections, args.concurrency, args.settle))
+        print(
+            f"{result['mode']:>6}: {result['connections']} conns in {result['connect_s']:.2f}s  "
+            f"rss {result['rss_base_mb']:.1f} -> {result['rss_mb']:.1f} MB  "
+            f"({result['rss_per_conn_kb']:.1f} KB/conn)  threads {result['threads']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
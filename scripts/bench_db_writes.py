@@ -0,0 +1,157 @@
+"""
+数据库写入吞吐基准：对比 SQLite 的日志模式和同步级别
+
+每种配置在全新的子进程和临时 SQLite 数据库中运行（配置通过环境变量传给 Config）：
+多个写入线程通过 message_writer 同步写入聊天消息（每条消息一次提交，与 WebSocket 路径一致），
+同时多个读取线程按房间分页读取最近的历史消息。
+
+报告：
+- 写入吞吐（提交/秒）和提交延迟 p50/p95/p99
+- 读取吞吐（查询/秒）
+- "database is locked" 错误数
+
+配置：
+- rollback：默认回滚日志，synchronous=FULL（未设置 PRAGMA 时 SQLite 的默认行为）
+- wal-full：WAL，synchronous=FULL
+- wal-normal：WAL，synchronous=NORMAL，mmap（Config 的默认配置）
+
+用法：
+    python -m scripts.bench_db_writes --writers 8 --readers 4 --messages 500
+    python -m scripts.bench_db_writes --configs wal-normal
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from scripts.bench_connections import ROOT
+from scripts.bench_ws_load import percentile
+
+CONFIGS = {
+    'rollback': {'SQLITE_JOURNAL_MODE': '', 'SQLITE_SYNCHRONOUS': '', 'SQLITE_MMAP_SIZE': '0'},
+    'wal-full': {'SQLITE_JOURNAL_MODE': 'WAL', 'SQLITE_SYNCHRONOUS': 'FULL', 'SQLITE_MMAP_SIZE': '0'},
+    'wal-normal': {}
+}
+
+
+def run_worker(writers: int, readers: int, messages: int) -> dict:
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    from app import create_app
+    from app.core.message_writer import message_writer
+    from app.models import ChatMessage, db
+
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    flask_app = create_app({
+        'DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'MESSAGE_WRITE_BEHIND': False
+    })
+    client = flask_app.test_client()
+    rooms = [client.post('/api/chat/rooms', json={'agent_type': 'repeater'}).get_json()['roomId']
+             for _ in range(writers)]
+    with flask_app.app_context():
+        pragmas = {name: db.session.execute(text(f'PRAGMA {name}')).scalar()
+                   for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size')}
+
+    latencies = []
+    errors = {'locked': 0, 'other': 0}
+    reads = [0]
+    lock = threading.Lock()
+    writing = threading.Event()
+
+    def record_error(error: Exception) -> None:
+        with lock:
+            errors['locked' if 'locked' in str(error) else 'other'] += 1
+
+    def writer(room_id: str) -> None:
+        samples = []
+        with flask_app.app_context():
+            for i in range(messages):
+                started = time.perf_counter()
+                try:
+                    message_writer.write(room_id, str(uuid.uuid4()), 'message', f'message {i} ' + 'x' * 200, 'user')
+                    samples.append(time.perf_counter() - started)
+                except OperationalError as e:
+                    db.session.rollback()
+                    record_error(e)
+            db.session.remove()
+        with lock:
+            latencies.extend(samples)
+
+    def reader(index: int) -> None:
+        count = 0
+        with flask_app.app_context():
+            while writing.is_set():
+                try:
+                    ChatMessage.query.filter_by(room_id=rooms[count % len(rooms)]).order_by(
+                        ChatMessage.timestamp.desc(), ChatMessage.id.desc()
+                    ).limit(50).all()
+                    count += 1
+                except OperationalError as e:
+                    db.session.rollback()
+                    record_error(e)
+                db.session.commit()
+            db.session.remove()
+        with lock:
+            reads[0] += count
+
+    writing.set()
+    reader_threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    writer_threads = [threading.Thread(target=writer, args=(room_id,)) for room_id in rooms]
+    started = time.perf_counter()
+    for thread in reader_threads + writer_threads:
+        thread.start()
+    for thread in writer_threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    writing.clear()
+    for thread in reader_threads:
+        thread.join()
+
+    return {
+        'pragmas': pragmas,
+        'elapsed': elapsed,
+        'commits': len(latencies),
+        'reads': reads[0],
+        'latency': [percentile(latencies, q) for q in (50, 95, 99)],
+        'errors': errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 日志模式和同步级别的写入吞吐基准")
+    parser.add_argument("--writers", type=int, default=8, help="写入线程数（每个线程写一个房间）")
+    parser.add_argument("--readers", type=int, default=4, help="并发读取线程数")
+    parser.add_argument("--messages", type=int, default=500, help="每个写入线程写入的消息数")
+    parser.add_argument("--configs", default=','.join(CONFIGS), help="要对比的配置（逗号分隔）")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.writers, args.readers, args.messages)))
+        return
+
+    for name in [c.strip() for c in args.configs.split(',') if c.strip()]:
+        env = dict(os.environ, **CONFIGS[name])
+        output = subprocess.run(
+            [sys.executable, '-m', 'scripts.bench_db_writes', '--worker', '--writers', str(args.writers),
+             '--readers', str(args.readers), '--messages', str(args.messages)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"[{name}] {result['pragmas']}")
+        print(f"  writes:      {result['commits']} commits in {result['elapsed']:.2f}s  "
+              f"{result['commits'] / result['elapsed']:8.1f} commits/s")
+        print("  commit ms:   p50 {:8.2f}  p95 {:8.2f}  p99 {:8.2f}".format(*(v * 1000 for v in result['latency'])))
+        print(f"  reads:       {result['reads']} queries  {result['reads'] / result['elapsed']:8.1f} queries/s")
+        print(f"  errors:      locked {result['errors']['locked']}  other {result['errors']['other']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+聊天记录导出与导入基准：流式导出的内存占用、吞吐和对其他请求的影响
+
+在子进程中启动线程或 ASGI 模式的服务器（临时 SQLite 数据库），分两个阶段：
+- export：向一个房间批量写入 N 条消息，通过 HTTP 流式下载 /api/chat/rooms/<id>/export（可 gzip），
+  同时另一个线程持续请求 /api/health；报告导出耗时、字节数、每秒消息数、进程常驻内存的峰值增量
+  和 /api/health 的延迟
+- import：在全新的数据库中把导出的文件 POST 到 /api/chat/import，报告导入耗时、每秒消息数和内存峰值增量
+
+用法：
+    python -m scripts.bench_export --messages 1000000
+    python -m scripts.bench_export --messages 200000 --no-gzip
+    python -m scripts.bench_export --messages 1000000 --mode asgi
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from datetime import datetime, timedelta
+
+from scripts.bench_connections import ROOT, read_process_status
+from scripts.bench_room_cache import start_server
+from scripts.bench_ws_load import percentile
+
+
+class RssSampler:
+    """后台采样本进程的常驻内存峰值"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.baseline = read_process_status(os.getpid())['VmRSS']
+        self.peak = self.baseline
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, read_process_status(os.getpid())['VmRSS'])
+
+    def stop(self) -> float:
+        """停止采样，返回峰值相对开始时的增量（MB）"""
+        self._stop.set()
+        self._thread.join()
+        return (self.peak - self.baseline) / 1024
+
+
+def create_server(mode: str, port: int, batch_size: int):
+    from app import create_app
+
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    flask_app = create_app({
+        'DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'RETENTION_INTERVAL': 0,
+        'EXPORT_BATCH_SIZE': batch_size,
+        'IMPORT_BATCH_SIZE': batch_size
+    })
+    return flask_app, start_server(mode, flask_app, port)
+
+
+def run_export(mode: str, messages: int, port: int, use_gzip: bool, batch_size: int, path: str) -> dict:
+    from app.models import ChatMessage, db
+
+    flask_app, stop = create_server(mode, port, batch_size)
+    try:
+        client = flask_app.test_client()
+        room_id = client.post('/api/chat/rooms', json={'agent_type': 'repeater'}).get_json()['roomId']
+        started = datetime.utcnow() - timedelta(seconds=messages)
+        with flask_app.app_context():
+            for offset in range(0, messages, 10000):
+                db.session.execute(ChatMessage.__table__.insert(), [
+                    {'id': str(uuid.uuid4()), 'room_id': room_id, 'type': 'message' if i % 2 else 'response',
+                     'content': f'message {i} ' + 'x' * 100, 'role': 'user' if i % 2 else 'assistant',
+                     'timestamp': started + timedelta(seconds=i)}
+                    for i in range(offset, min(messages, offset + 10000))
+                ])
+                db.session.commit()
+
+        base_url = f'http://127.0.0.1:{port}/api'
+        health = []
+        exporting = threading.Event()
+        exporting.set()
+
+        def probe() -> None:
+            while exporting.is_set():
+                begin = time.perf_counter()
+                urllib.request.urlopen(f'{base_url}/health').read()
+                health.append(time.perf_counter() - begin)
+                time.sleep(0.01)
+
+        sampler = RssSampler()
+        prober = threading.Thread(target=probe)
+        prober.start()
+        begin = time.perf_counter()
+        size = 0
+        with urllib.request.urlopen(f"{base_url}/chat/rooms/{room_id}/export{'?gzip=1' if use_gzip else ''}") as response, \
+                open(path, 'wb') as f:
+            while True:
+                chunk = response.read(64 * 1024)
+                if not chunk:
+                    break
+                size += len(chunk)
+                f.write(chunk)
+        elapsed = time.perf_counter() - begin
+        exporting.clear()
+        prober.join()
+        rss_mb = sampler.stop()
+    finally:
+        stop()
+    return {
+        'elapsed': elapsed,
+        'bytes': size,
+        'rss_mb': rss_mb,
+        'health': [percentile(health, q) for q in (50, 99, 100)],
+        'health_requests': len(health)
+    }
+
+
+def run_import(mode: str, port: int, batch_size: int, path: str) -> dict:
+    _flask_app, stop = create_server(mode, port, batch_size)
+    try:
+        sampler = RssSampler()
+        begin = time.perf_counter()
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        with open(path, 'rb') as f:
+            connection.request('POST', '/api/chat/import', body=f,
+                               headers={'Content-Length': str(os.path.getsize(path)),
+                                        'Content-Type': 'application/x-ndjson'})
+            result = json.loads(connection.getresponse().read())
+        elapsed = time.perf_counter() - begin
+        rss_mb = sampler.stop()
+    finally:
+        stop()
+    return {'elapsed': elapsed, 'rss_mb': rss_mb, 'result': result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="聊天记录流式导出与导入基准")
+    parser.add_argument("--messages", type=int, default=1000000, help="房间的消息数")
+    parser.add_argument("--batch-size", type=int, default=1000, help="导出每次查询和导入每个事务的消息数")
+    parser.add_argument("--no-gzip", action="store_true", help="导出不压缩")
+    parser.add_argument("--port", type=int, default=5091, help="服务器端口")
+    parser.add_argument("--mode", choices=['thread', 'asgi'], default='thread', help="服务器模式")
+    parser.add_argument("--worker", choices=['export', 'import'], help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker == 'export':
+        print(json.dumps(run_export(args.mode, args.messages, args.port, not args.no_gzip, args.batch_size, args.path)))
+        return
+    if args.worker == 'import':
+        print(json.dumps(run_import(args.mode, args.port, args.batch_size, args.path)))
+        return
+
+    path = os.path.join(tempfile.mkdtemp(prefix='bench_'), 'export.ndjson' + ('' if args.no_gzip else '.gz'))
+    results = {}
+    for phase in ('export', 'import'):
+        command = [sys.executable, '-m', 'scripts.bench_export', '--worker', phase, '--path', path,
+                   '--messages', str(args.messages), '--batch-size', str(args.batch_size), '--port', str(args.port),
+                   '--mode', args.mode]
+        if args.no_gzip:
+            command.append('--no-gzip')
+        # 关闭 SQLite 内存映射，否则映射的数据库页面会计入常驻内存
+        env = dict(os.environ, SQLITE_MMAP_SIZE='0')
+        output = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+        results[phase] = json.loads(output.strip().splitlines()[-1])
+
+    export, imported = results['export'], results['import']
+    print(f"[{args.mode}] export: {args.messages} messages in {export['elapsed']:.2f}s  "
+          f"{args.messages / export['elapsed']:10.0f} msg/s  {export['bytes'] / 1024 / 1024:8.1f} MB  "
+          f"peak rss +{export['rss_mb']:.1f} MB")
+    print(f"  /api/health during export: {export['health_requests']} requests  "
+          "p50 {:8.2f} ms  p99 {:8.2f} ms  max {:8.2f} ms".format(*(v * 1000 for v in export['health'])))
+    print(f"[{args.mode}] import: {imported['result'].get('imported')} messages in {imported['elapsed']:.2f}s  "
+          f"{imported['result'].get('imported', 0) / imported['elapsed']:10.0f} msg/s  "
+          f"peak rss +{imported['rss_mb']:.1f} MB  {imported['result']}")
+
+
+if __name__ == "__main__":
+    main()
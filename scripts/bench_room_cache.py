@@ -0,0 +1,146 @@
+"""
+房间缓存基准：统计 WebSocket 每条消息触发的数据库查询数
+
+在子进程中启动服务器（线程模式或 ASGI 模式，临时 SQLite 数据库，不等待的合成 agent），
+用 SQLAlchemy 的 before_cursor_execute 事件按语句类型计数。
+一个客户端连接房间后顺序发送 N 条消息，每条消息等待回复结束，
+分别报告连接阶段和消息阶段的 SELECT / 写入语句数，以及每条消息的平均值。
+
+对比开启房间缓存与关闭（ROOM_CACHE_SIZE=0，每条消息都重新读取房间）两种情况。
+
+用法：
+    python -m scripts.bench_room_cache --messages 200
+    python -m scripts.bench_room_cache --mode asgi
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from scripts.bench_connections import ROOT
+
+
+def count_statements(engine) -> Counter:
+    """按语句的第一个关键字计数"""
+    from sqlalchemy import event
+
+    counts = Counter()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counts[statement.lstrip().split(None, 1)[0].upper()] += 1
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    return counts
+
+
+async def run_client(port: int, room_id: str, messages: int, counts: Counter) -> dict:
+    import websockets
+
+    ws = await websockets.connect(f'ws://127.0.0.1:{port}/chat/{room_id}')
+    await ws.recv()
+    connect_counts = Counter(counts)
+    counts.clear()
+
+    started = time.perf_counter()
+    for i in range(messages):
+        await ws.send(json.dumps({'type': 'message', 'content': f'message {i}'}))
+        while True:
+            frame = json.loads(await ws.recv())
+            if frame.get('is_end'):
+                break
+    elapsed = time.perf_counter() - started
+    await ws.close()
+    # 回复在结束帧之后写入数据库
+    await asyncio.sleep(0.5)
+    return {'connect': dict(connect_counts), 'messages': dict(counts), 'elapsed': elapsed}
+
+
+def start_server(mode: str, flask_app, port: int):
+    """在后台线程中启动服务器，返回停止函数"""
+    if mode == 'asgi':
+        import uvicorn
+
+        from app.asgi import create_asgi_app
+
+        server = uvicorn.Server(uvicorn.Config(create_asgi_app(flask_app), host='127.0.0.1', port=port,
+                                               log_level='warning'))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+
+        def stop():
+            server.should_exit = True
+        return stop
+
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', port, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.shutdown
+
+
+def run_worker(mode: str, messages: int, port: int) -> dict:
+    from app import create_app
+    from app.models import db, room_cache
+
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    flask_app = create_app({
+        'DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'SYNTHETIC_AGENT_ENABLED': True
+    })
+    with flask_app.app_context():
+        counts = count_statements(db.engine)
+
+    stop = start_server(mode, flask_app, port)
+    try:
+        client = flask_app.test_client()
+        room_id = client.post('/api/chat/rooms', json={'agent_type': 'synthetic'}).get_json()['roomId']
+        counts.clear()
+        result = asyncio.run(run_client(port, room_id, messages, counts))
+    finally:
+        stop()
+    result['room_cache'] = room_cache.stats()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="房间缓存：每条消息的数据库查询数")
+    parser.add_argument("--mode", choices=['thread', 'asgi', 'both'], default='both', help="服务器模式")
+    parser.add_argument("--messages", type=int, default=200, help="发送的消息数")
+    parser.add_argument("--port", type=int, default=5090, help="服务器端口")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.mode, args.messages, args.port)))
+        return
+
+    modes = ['thread', 'asgi'] if args.mode == 'both' else [args.mode]
+    runs = [(mode, label, size) for mode in modes for label, size in (('cache', None), ('no room cache', '0'))]
+    for mode, label, size in runs:
+        env = dict(os.environ, SYNTHETIC_AGENT_CHUNKS='8', SYNTHETIC_AGENT_DELAY='0')
+        env.pop('ROOM_CACHE_SIZE', None)
+        if size is not None:
+            env['ROOM_CACHE_SIZE'] = size
+        output = subprocess.run(
+            [sys.executable, '-m', 'scripts.bench_room_cache', '--worker', '--mode', mode,
+             '--messages', str(args.messages), '--port', str(args.port)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        per_message = {kind: count / args.messages for kind, count in sorted(result['messages'].items())}
+        print(f"[{mode}, {label}] {args.messages} messages in {result['elapsed']:.2f}s")
+        print(f"  connect:     {result['connect']}")
+        print(f"  messages:    {result['messages']}")
+        print("  per message: " + "  ".join(f"{kind} {value:.2f}" for kind, value in per_message.items()))
+        print(f"  room cache:  hits {result['room_cache']['hits']}  misses {result['room_cache']['misses']}")
+
+
+if __name__ == "__main__":
+    main()
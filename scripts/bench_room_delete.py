@@ -0,0 +1,142 @@
+"""
+删除房间基准：对比一条语句删除全部消息与后台分批删除对其他房间写入的影响
+
+每种模式在全新的子进程和临时 SQLite 数据库中运行：先向一个房间批量写入 N 条消息，
+多个写入线程持续向各自的房间同步写入消息（与 WebSocket 路径一致），然后删除大房间：
+- single：在请求中用一条 DELETE 语句删除全部消息再删除房间（分批删除之前的做法）
+- batched：DELETE /api/chat/rooms/<id> 标记删除后由后台任务分批删除
+
+报告：
+- 删除请求的耗时和删除完成的总耗时
+- 删除期间其他房间写入的提交数和提交延迟 p50/p99/最大值
+- "database is locked" 错误数
+
+用法：
+    python -m scripts.bench_room_delete --rows 200000 --writers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from scripts.bench_connections import ROOT
+from scripts.bench_ws_load import percentile
+
+
+def run_worker(mode: str, rows: int, writers: int) -> dict:
+    from sqlalchemy.exc import OperationalError
+
+    from app import create_app
+    from app.core.message_writer import message_writer
+    from app.core.retention import retention_manager
+    from app.models import ChatMessage, ChatRoom, db
+
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    flask_app = create_app({
+        'DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'MESSAGE_WRITE_BEHIND': False,
+        'RETENTION_INTERVAL': 0
+    })
+    client = flask_app.test_client()
+    room_id = client.post('/api/chat/rooms', json={'agent_type': 'repeater'}).get_json()['roomId']
+    rooms = [client.post('/api/chat/rooms', json={'agent_type': 'repeater'}).get_json()['roomId']
+             for _ in range(writers)]
+
+    started = datetime.utcnow() - timedelta(seconds=rows)
+    with flask_app.app_context():
+        for offset in range(0, rows, 10000):
+            db.session.execute(ChatMessage.__table__.insert(), [
+                {'id': str(uuid.uuid4()), 'room_id': room_id, 'type': 'message', 'content': 'x' * 200,
+                 'role': 'user', 'timestamp': started + timedelta(seconds=i)}
+                for i in range(offset, min(rows, offset + 10000))
+            ])
+            db.session.commit()
+
+    samples = []
+    errors = {'locked': 0, 'other': 0}
+    lock = threading.Lock()
+    running = threading.Event()
+    running.set()
+
+    def writer(writer_room: str) -> None:
+        with flask_app.app_context():
+            while running.is_set():
+                begin = time.perf_counter()
+                try:
+                    message_writer.write(writer_room, str(uuid.uuid4()), 'message', 'hello', 'user')
+                    with lock:
+                        samples.append((begin, time.perf_counter() - begin))
+                except OperationalError as e:
+                    db.session.rollback()
+                    with lock:
+                        errors['locked' if 'locked' in str(e) else 'other'] += 1
+            db.session.remove()
+
+    threads = [threading.Thread(target=writer, args=(writer_room,)) for writer_room in rooms]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+
+    delete_started = time.perf_counter()
+    if mode == 'single':
+        with flask_app.app_context():
+            ChatMessage.query.filter_by(room_id=room_id).delete()
+            db.session.delete(db.session.get(ChatRoom, room_id))
+            db.session.commit()
+        request_s = time.perf_counter() - delete_started
+    else:
+        client.delete(f'/api/chat/rooms/{room_id}')
+        request_s = time.perf_counter() - delete_started
+        while retention_manager.deletion_status(room_id)['status'] not in ('done', 'failed'):
+            time.sleep(0.01)
+    delete_s = time.perf_counter() - delete_started
+
+    running.clear()
+    for thread in threads:
+        thread.join()
+
+    latencies = [latency for begin, latency in samples if begin >= delete_started]
+    return {
+        'request_s': request_s,
+        'delete_s': delete_s,
+        'commits': len(latencies),
+        'latency': [percentile(latencies, q) for q in (50, 99, 100)],
+        'errors': errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="删除大房间对其他房间写入的影响")
+    parser.add_argument("--rows", type=int, default=200000, help="被删除房间的消息数")
+    parser.add_argument("--writers", type=int, default=4, help="并发写入其他房间的线程数")
+    parser.add_argument("--mode", choices=['single', 'batched', 'both'], default='both', help="删除方式")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.mode, args.rows, args.writers)))
+        return
+
+    modes = ['single', 'batched'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        output = subprocess.run(
+            [sys.executable, '-m', 'scripts.bench_room_delete', '--worker', '--mode', mode,
+             '--rows', str(args.rows), '--writers', str(args.writers)],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"[{mode}] delete {args.rows} messages: request {result['request_s'] * 1000:.1f} ms  "
+              f"done in {result['delete_s']:.2f}s")
+        print(f"  other rooms: {result['commits']} commits  "
+              "p50 {:8.2f} ms  p99 {:8.2f} ms  max {:8.2f} ms".format(*(v * 1000 for v in result['latency'])))
+        print(f"  errors:      locked {result['errors']['locked']}  other {result['errors']['other']}")
+
+
+if __name__ == "__main__":
+    main()
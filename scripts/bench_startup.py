@@ -0,0 +1,87 @@
+"""
+启动耗时基准：对比 agent 按需导入与启动时全部导入
+
+在全新的子进程中执行 import app 和 create_app（使用临时 SQLite 数据库），
+按需模式不导入任何 agent 实现模块，全部导入模式通过 AGENT_PRELOAD 预先导入所有声明的类型。
+
+报告：
+- import app 和 create_app 的耗时
+- 进程的常驻内存和已加载的模块数
+- 各 agent 类型的导入耗时
+
+用法：
+    python -m scripts.bench_startup --runs 5
+    python -m scripts.bench_startup --preload weather
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from scripts.bench_connections import ROOT
+
+PROBE = (
+    "import json, os, sys, time\n"
+    "started = time.perf_counter()\n"
+    "import app\n"
+    "imported = time.perf_counter()\n"
+    "from app.models.agents import agent_registry\n"
+    "preload = {preload!r}\n"
+    "flask_app = app.create_app({{'DATABASE_URI': {database!r}, 'SYNTHETIC_AGENT_ENABLED': True,\n"
+    "                            'AGENT_PRELOAD': preload if preload is not None else agent_registry.types()}})\n"
+    "created = time.perf_counter()\n"
+    "rss = 0\n"
+    "with open(f'/proc/{{os.getpid()}}/status') as f:\n"
+    "    for line in f:\n"
+    "        if line.startswith('VmRSS:'):\n"
+    "            rss = int(line.split()[1])\n"
+    "print(json.dumps({{'import_s': imported - started, 'create_s': created - imported, 'rss_kb': rss,\n"
+    "                  'modules': len(sys.modules), 'report': agent_registry.report()}}))\n"
+)
+
+
+def probe(preload, runs: int) -> list:
+    """执行 runs 次启动探测，preload 为 None 时导入全部 agent 类型"""
+    results = []
+    for _ in range(runs):
+        workdir = tempfile.mkdtemp(prefix='bench_')
+        database = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE.format(preload=preload, database=database)],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def summarize(label: str, results: list) -> None:
+    import_ms = statistics.median(r['import_s'] for r in results) * 1000
+    create_ms = statistics.median(r['create_s'] for r in results) * 1000
+    rss_mb = statistics.median(r['rss_kb'] for r in results) / 1024
+    modules = statistics.median(r['modules'] for r in results)
+    print(f"{label:>8}: import {import_ms:8.1f} ms  create_app {create_ms:8.1f} ms  "
+          f"total {import_ms + create_ms:8.1f} ms  rss {rss_mb:6.1f} MB  modules {modules:.0f}")
+    agent_ms = {}
+    for r in results:
+        for agent_type, ms in r['report']['import_ms'].items():
+            agent_ms.setdefault(agent_type, []).append(ms)
+    for agent_type, values in agent_ms.items():
+        print(f"{'':>10}{agent_type:<12}{statistics.median(values):8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="agent 按需导入的启动耗时基准")
+    parser.add_argument("--runs", type=int, default=3, help="每种模式的启动次数（取中位数）")
+    parser.add_argument("--preload", default="", help="按需模式下预先导入的类型（逗号分隔）")
+    args = parser.parse_args()
+
+    lazy = [t.strip() for t in args.preload.split(',') if t.strip()]
+    summarize('lazy', probe(lazy, args.runs))
+    summarize('eager', probe(None, args.runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+流式通道微基准：对比旧的 StreamPipe + JSON 桥接与新的 StreamChannel 类型化事件
+
+用法：
+    python -m scripts.bench_stream_channel --tokens 2000 --delay 0.002
+
+报告每个流式 token 消耗的 CPU 时间（进程 CPU 时间 / token 数）以及总耗时。
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from multiprocessing import Pipe
+
+from app.core.runtime import AgentRuntime
+from app.core.stream import StreamEvent
+
+try:
+    from metagpt.utils.stream_pipe import StreamPipe
+except ImportError:
+    class StreamPipe:
+        """与 metagpt.utils.stream_pipe.StreamPipe 相同的实现"""
+
+        def __init__(self, name=None):
+            self.name = name
+            self.parent_conn, self.child_conn = Pipe()
+
+        def set_message(self, msg):
+            self.parent_conn.send(msg)
+
+        def get_message(self, timeout: int = 3):
+            if self.child_conn.poll(timeout):
+                return self.child_conn.recv()
+            return None
+
+
+def run_legacy(tokens: int, delay: float) -> int:
+    """旧实现：每条消息一个线程 + asyncio.run，token 经 JSON 编解码"""
+    async def produce(stream_pipe: StreamPipe):
+        for i in range(tokens):
+            await asyncio.sleep(delay)
+            stream_pipe.set_message(json.dumps({"type": "result", "content": f"tok{i}"}))
+
+    stream_pipe = StreamPipe()
+    thread = threading.Thread(target=lambda: asyncio.run(produce(stream_pipe)))
+    thread.start()
+
+    received = 0
+    while thread.is_alive():
+        msg = stream_pipe.get_message()
+        if msg:
+            json.loads(msg)
+            received += 1
+    thread.join()
+    while True:
+        msg = stream_pipe.get_message(timeout=0)
+        if not msg:
+            break
+        json.loads(msg)
+        received += 1
+    return received
+
+
+def run_channel(runtime: AgentRuntime, tokens: int, delay: float) -> int:
+    """新实现：共享事件循环 + 有界通道，消费方阻塞等待，事件以对象传递"""
+    async def produce():
+        for i in range(tokens):
+            await asyncio.sleep(delay)
+            yield StreamEvent.result(f"tok{i}")
+
+    received = 0
+    for event in runtime.iterate(produce()):
+        if event.type == "result":
+            received += 1
+    return received
+
+
+def measure(name: str, func, tokens: int) -> None:
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    received = func()
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    print(f"{name:<10} tokens={received:<6} wall={wall:8.3f}s cpu={cpu:8.3f}s "
+          f"cpu/token={cpu / max(received, 1) * 1e6:8.1f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式通道 CPU 开销基准")
+    parser.add_argument("--tokens", type=int, default=2000, help="每次运行的 token 数量")
+    parser.add_argument("--delay", type=float, default=0.002, help="模拟的 token 间隔（秒）")
+    args = parser.parse_args()
+
+    runtime = AgentRuntime(num_loops=1)
+    try:
+        measure("legacy", lambda: run_legacy(args.tokens, args.delay), args.tokens)
+        measure("channel", lambda: run_channel(runtime, args.tokens, args.delay), args.tokens)
+    finally:
+        runtime.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+传输协议基准：对比默认 JSON 协议与紧凑增量协议每个回复的字节数
+
+用法：
+    python -m scripts.bench_wire_protocol --chunks 200 --chunk-size 4
+"""
+import argparse
+from uuid import uuid4
+
+from app.api.room.room import create_stream_message
+from app.core.protocol import PROTOCOL_DELTA, PROTOCOL_JSON, encode_message
+
+SAMPLE_TEXT = "北京今天晴，最高气温二十五度，最低气温十五度，西北风三到四级。Sunny, 25C high, 15C low. "
+
+
+def build_response_frames(chunks: int, chunk_size: int) -> list:
+    """按 process_agent_response 的方式构造一次流式回复的所有帧"""
+    msg_id = str(uuid4())
+    frames = [create_stream_message(msg_id, 'response', '开始查询天气：\n', 'assistant', is_thinking=True, seq=0)]
+    parts = []
+    for i in range(chunks):
+        start = (i * chunk_size) % len(SAMPLE_TEXT)
+        content = (SAMPLE_TEXT * 2)[start:start + chunk_size]
+        parts.append(content)
+        frames.append(create_stream_message(msg_id, 'response', content, 'assistant', seq=i + 1))
+    frames.append(create_stream_message(msg_id, 'response', ''.join(parts), 'assistant', is_end=True, seq=chunks + 1))
+    return frames
+
+
+def measure(frames: list, protocol: int) -> int:
+    return sum(len(encode_message(frame, protocol).encode('utf-8')) for frame in frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="传输协议字节数基准")
+    parser.add_argument("--chunks", type=int, default=200, help="每个回复的分片数量")
+    parser.add_argument("--chunk-size", type=int, default=4, help="每个分片的字符数")
+    args = parser.parse_args()
+
+    frames = build_response_frames(args.chunks, args.chunk_size)
+    json_bytes = measure(frames, PROTOCOL_JSON)
+    delta_bytes = measure(frames, PROTOCOL_DELTA)
+
+    print(f"frames/response: {len(frames)}")
+    print(f"protocol 1 (json):  {json_bytes:>9} bytes/response  {json_bytes / len(frames):8.1f} bytes/frame")
+    print(f"protocol 2 (delta): {delta_bytes:>9} bytes/response  {delta_bytes / len(frames):8.1f} bytes/frame")
+    print(f"reduction: {1 - delta_bytes / json_bytes:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+WebSocket 负载基准：多房间、多客户端的流式回复延迟和吞吐
+
+在子进程中以临时 SQLite 数据库启动服务器并注册合成 agent，通过 POST /api/chat/rooms
+创建 N 个房间，把 M 个客户端平均分配到各房间。每个房间由第一个客户端依次发送消息
+（同一时间只有一个回复在途），房间内所有客户端都记录收到的帧。
+
+报告：
+- 首个分片延迟（发送消息到收到第一个流式帧）p50/p95/p99
+- 端到端延迟（发送消息到收到结束帧）p50/p95/p99
+- 所有客户端每秒收到的帧数
+- 服务器进程的峰值 RSS 和线程数
+
+用法：
+    python -m scripts.bench_ws_load --rooms 20 --clients 100 --messages 10
+    python -m scripts.bench_ws_load --mode asgi --chunks 200 --chunk-size 4 --delay 0.005 --protocol 2
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import websockets
+
+from scripts.bench_connections import create_room, read_process_status, start_server, stop_server, wait_for_server
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def parse_frame(raw: str) -> dict:
+    """把两种协议的帧统一为 (kind, msg_id)：kind 为 chunk / end / other"""
+    frame = json.loads(raw)
+    if 't' in frame:
+        kind = {'d': 'chunk', 'k': 'chunk', 'e': 'end'}.get(frame['t'], 'other')
+        return {'kind': kind, 'id': frame.get('i')}
+    if frame.get('is_stream'):
+        return {'kind': 'end' if frame.get('is_end') else 'chunk', 'id': frame.get('id')}
+    return {'kind': 'other', 'id': frame.get('id')}
+
+
+class RoomDriver:
+    """一个房间的客户端：第一个客户端发送消息，所有客户端记录帧到达时间"""
+
+    def __init__(self, ws_url: str, clients: int, messages: int, payload: str, timeout: float):
+        self.ws_url = ws_url
+        self.clients = clients
+        self.messages = messages
+        self.payload = payload
+        self.timeout = timeout
+        self.frames = 0
+        self.ttfc = []
+        self.latency = []
+        self.errors = 0
+
+    async def listen(self, ws, sent_at: dict, done: asyncio.Queue = None) -> None:
+        """接收帧直到连接关闭；sent_at['t'] 为当前在途消息的发送时间"""
+        first_seen = set()
+        async for raw in ws:
+            self.frames += 1
+            frame = parse_frame(raw)
+            if frame['kind'] == 'other' or sent_at.get('t') is None:
+                continue
+            now = time.perf_counter()
+            # 增量协议中非首帧只有短 id，用前缀区分
+            key = (frame['id'] or '')[:8]
+            if key not in first_seen:
+                first_seen.add(key)
+                self.ttfc.append(now - sent_at['t'])
+            if frame['kind'] == 'end':
+                self.latency.append(now - sent_at['t'])
+                first_seen.discard(key)
+                if done is not None:
+                    done.put_nowait(key)
+
+    async def run(self) -> None:
+        sockets = []
+        listeners = []
+        sent_at = {'t': None}
+        done: asyncio.Queue = asyncio.Queue()
+        try:
+            for i in range(self.clients):
+                ws = await websockets.connect(self.ws_url, open_timeout=30, ping_interval=None, max_size=None)
+                sockets.append(ws)
+                listeners.append(asyncio.create_task(self.listen(ws, sent_at, done if i == 0 else None)))
+
+            sender = sockets[0]
+            for _ in range(self.messages):
+                sent_at['t'] = time.perf_counter()
+                await sender.send(json.dumps({'type': 'message', 'content': self.payload}))
+                try:
+                    await asyncio.wait_for(done.get(), self.timeout)
+                except asyncio.TimeoutError:
+                    self.errors += 1
+            # 等待其他客户端收完最后一个结束帧
+            await asyncio.sleep(0.2)
+        finally:
+            for ws in sockets:
+                await ws.close()
+            await asyncio.gather(*listeners, return_exceptions=True)
+
+
+async def sample_rss(pid: int, peak: dict, stop: asyncio.Event, interval: float = 0.2) -> None:
+    while not stop.is_set():
+        try:
+            status = read_process_status(pid)
+        except OSError:
+            return
+        peak['rss'] = max(peak.get('rss', 0), status['VmRSS'])
+        peak['threads'] = max(peak.get('threads', 0), status['Threads'])
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_benchmark(args) -> dict:
+    env = {
+        'SYNTHETIC_AGENT_CHUNKS': str(args.chunks),
+        'SYNTHETIC_AGENT_CHUNK_SIZE': str(args.chunk_size),
+        'SYNTHETIC_AGENT_DELAY': str(args.delay),
+        'MESSAGE_WRITE_BEHIND': 'true' if args.write_behind else 'false',
+        'SCHEDULER_MAX_QUEUE': str(max(100, args.rooms * 2)),
+    }
+    server = start_server(args.mode, args.port, {'SYNTHETIC_AGENT_ENABLED': True}, env=env)
+    base_url = f'http://127.0.0.1:{args.port}'
+    try:
+        await asyncio.to_thread(wait_for_server, base_url)
+        room_ids = [await asyncio.to_thread(create_room, base_url, 'synthetic') for _ in range(args.rooms)]
+
+        per_room = [args.clients // args.rooms + (1 if i < args.clients % args.rooms else 0) for i in range(args.rooms)]
+        query = f'?protocol={args.protocol}' if args.protocol != 1 else ''
+        drivers = [
+            RoomDriver(f'ws://127.0.0.1:{args.port}/chat/{room_id}{query}', max(1, clients),
+                       args.messages, args.payload, args.timeout)
+            for room_id, clients in zip(room_ids, per_room)
+        ]
+
+        peak = {}
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(server.pid, peak, stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(driver.run() for driver in drivers))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampler
+
+        ttfc = [v for d in drivers for v in d.ttfc]
+        latency = [v for d in drivers for v in d.latency]
+        frames = sum(d.frames for d in drivers)
+        return {
+            'elapsed': elapsed,
+            'samples': len(latency),
+            'errors': sum(d.errors for d in drivers),
+            'frames': frames,
+            'frames_per_s': frames / elapsed if elapsed else 0.0,
+            'ttfc': [percentile(ttfc, q) for q in (50, 95, 99)],
+            'latency': [percentile(latency, q) for q in (50, 95, 99)],
+            'rss_mb': peak.get('rss', 0) / 1024,
+            'threads': peak.get('threads', 0),
+        }
+    finally:
+        stop_server(server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket 负载与延迟基准")
+    parser.add_argument("--rooms", type=int, default=10, help="房间数量")
+    parser.add_argument("--clients", type=int, default=50, help="客户端总数，平均分配到各房间")
+    parser.add_argument("--messages", type=int, default=5, help="每个房间发送的消息数")
+    parser.add_argument("--mode", choices=['thread', 'asgi'], default='thread', help="服务器模式")
+    parser.add_argument("--protocol", type=int, choices=[1, 2], default=1, help="WebSocket 传输协议版本")
+    parser.add_argument("--chunks", type=int, default=50, help="合成 agent 每个回复的分片数")
+    parser.add_argument("--chunk-size", type=int, default=16, help="合成 agent 每个分片的字符数")
+    parser.add_argument("--delay", type=float, default=0.01, help="合成 agent 分片之间的间隔（秒）")
+    parser.add_argument("--payload", default="benchmark", help="发送的消息内容")
+    parser.add_argument("--write-behind", action="store_true", help="开启批量异步写入")
+    parser.add_argument("--timeout", type=float, default=60.0, help="单个回复的超时时间（秒）")
+    parser.add_argument("--port", type=int, default=5950, help="服务器端口")
+    args = parser.parse_args()
+    args.rooms = max(1, args.rooms)
+
+    result = asyncio.run(run_benchmark(args))
+    print(f"mode={args.mode} protocol={args.protocol} rooms={args.rooms} clients={args.clients} "
+          f"messages/room={args.messages} chunks={args.chunks}x{args.chunk_size} delay={args.delay}s")
+    print(f"samples: {result['samples']} ({result['errors']} timed out) in {result['elapsed']:.2f}s")
+    print("ttfc ms:     p50 {:8.1f}  p95 {:8.1f}  p99 {:8.1f}".format(*(v * 1000 for v in result['ttfc'])))
+    print("latency ms:  p50 {:8.1f}  p95 {:8.1f}  p99 {:8.1f}".format(*(v * 1000 for v in result['latency'])))
+    print(f"frames: {result['frames']}  ({result['frames_per_s']:.0f} frames/s)")
+    print(f"server peak rss: {result['rss_mb']:.1f} MB  threads: {result['threads']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+TeamLeader 路径的离线计时与性能分析
+
+用确定性的 FakeLLM 替代真实 LLM，反复执行 WeatherAgent 的完整流式路径
+（_process_response → BaseEnv.publish_message → TeamLeader.run），统计各阶段耗时：
+
+- env_publish      BaseEnv.publish_message
+- message_copy     BaseEnv.move_message_info_to_content（消息深拷贝）
+- role_run         TeamLeader.run
+- stream_callback  stream_pipe_log（LLM 流式输出回调）
+- llm_simulated    FakeLLM 中模拟的等待时间
+
+各阶段为包含时间（role_run 包含其中的发布和回调）。
+编排开销 = 总耗时 - 模拟的 LLM 等待时间，用于发现 agent 编排本身的性能回退。
+
+用法：
+    python -m scripts.profile_team_leader --iterations 50
+    python -m scripts.profile_team_leader --latency 0 --chunk-delay 0 --profile team_leader.prof
+    python -m scripts.profile_team_leader --script replies.json --fresh-env
+"""
+import argparse
+import asyncio
+import contextlib
+import cProfile
+import functools
+import io
+import os
+import pstats
+import time
+from collections import defaultdict
+from uuid import uuid4
+
+from metagpt.roles.di.team_leader import TeamLeader
+
+from app.models.agents.weather import weather_agent
+from app.models.agents.weather.weather_agent import WeatherAgent
+from app.models.environment.base import BaseEnv
+from app.models.llm import FakeLLM, install_llm
+
+
+class StageTimer:
+    """通过包装函数统计各阶段的调用次数和累计耗时"""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self._patches = []
+
+    def record(self, stage: str, elapsed: float) -> None:
+        self.totals[stage] += elapsed
+        self.counts[stage] += 1
+
+    def patch(self, owner, name: str, stage: str) -> None:
+        original = getattr(owner, name)
+        if asyncio.iscoroutinefunction(original):
+            @functools.wraps(original)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - started)
+        else:
+            @functools.wraps(original)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - started)
+        self._patches.append((owner, name, original))
+        setattr(owner, name, wrapper)
+
+    def restore(self) -> None:
+        while self._patches:
+            owner, name, original = self._patches.pop()
+            setattr(owner, name, original)
+
+
+def build_agent(llm: FakeLLM, fresh_env: bool) -> WeatherAgent:
+    agent = WeatherAgent(id=str(uuid4()), name="天气Agent", type="weather")
+
+    def build_env() -> BaseEnv:
+        env = BaseEnv()
+        team_leader = TeamLeader(name="TeamLeader")
+        install_llm(team_leader, llm)
+        env.add_role(team_leader)
+        return env
+
+    agent.build_env = build_env
+    if not fresh_env:
+        agent.env = build_env()
+    return agent
+
+
+async def run_iterations(agent: WeatherAgent, message: str, iterations: int, fresh_env: bool, timer: StageTimer) -> int:
+    events = 0
+    for _ in range(iterations):
+        if fresh_env:
+            agent.env = agent.build_env()
+        started = time.perf_counter()
+        async for _event in agent.agenerate_response_stream(message):
+            events += 1
+        timer.record('total', time.perf_counter() - started)
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TeamLeader 路径的离线计时与性能分析")
+    parser.add_argument("--iterations", type=int, default=20, help="执行次数")
+    parser.add_argument("--message", default="北京今天天气怎么样", help="用户消息")
+    parser.add_argument("--script", default="", help="FakeLLM 回复脚本（JSON）路径")
+    parser.add_argument("--latency", type=float, default=0.0, help="FakeLLM 首块前的等待时间（秒）")
+    parser.add_argument("--chunk-size", type=int, default=8, help="FakeLLM 每块的字符数")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="FakeLLM 块之间的等待时间（秒）")
+    parser.add_argument("--fresh-env", action="store_true", help="每次执行都重建环境（默认复用，记忆会累积）")
+    parser.add_argument("--profile", default="", help="把 cProfile 结果写入该文件")
+    parser.add_argument("--top", type=int, default=25, help="打印 cProfile 中累计耗时最多的函数数量")
+    parser.add_argument("--verbose", action="store_true", help="保留流式回调和调试输出")
+    args = parser.parse_args()
+
+    replies, rules = FakeLLM.load_script(args.script) if args.script else (None, None)
+    llm = FakeLLM(replies=replies, rules=rules, latency=args.latency,
+                  chunk_size=args.chunk_size, chunk_delay=args.chunk_delay)
+    agent = build_agent(llm, args.fresh_env)
+
+    timer = StageTimer()
+    timer.patch(BaseEnv, 'publish_message', 'env_publish')
+    timer.patch(BaseEnv, 'move_message_info_to_content', 'message_copy')
+    timer.patch(TeamLeader, 'run', 'role_run')
+    # set_llm_stream_logfunc 注册的回调按名字查找 stream_pipe_log，替换模块属性即可
+    timer.patch(weather_agent, 'stream_pipe_log', 'stream_callback')
+
+    profiler = cProfile.Profile() if args.profile else None
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    try:
+        with output:
+            if profiler:
+                profiler.enable()
+            events = asyncio.run(run_iterations(agent, args.message, args.iterations, args.fresh_env, timer))
+            if profiler:
+                profiler.disable()
+    finally:
+        timer.restore()
+
+    total = timer.totals['total']
+    timer.totals['llm_simulated'] = llm.simulated_time
+    timer.counts['llm_simulated'] = llm.calls
+
+    print(f"iterations: {args.iterations}  events: {events}  llm calls: {llm.calls}")
+    print(f"{'stage':<16}{'calls':>8}{'total ms':>12}{'ms/iter':>10}{'us/call':>10}")
+    for stage in ('total', 'role_run', 'env_publish', 'message_copy', 'stream_callback', 'llm_simulated'):
+        calls = timer.counts[stage]
+        elapsed = timer.totals[stage]
+        print(f"{stage:<16}{calls:>8}{elapsed * 1000:>12.2f}{elapsed * 1000 / args.iterations:>10.2f}"
+              f"{(elapsed / calls * 1e6 if calls else 0):>10.1f}")
+    overhead = total - llm.simulated_time
+    print(f"orchestration overhead: {overhead * 1000 / args.iterations:.2f} ms/iter")
+
+    if profiler:
+        profiler.dump_stats(args.profile)
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(args.top)
+        print(stream.getvalue())
+        print(f"cProfile 结果已写入 {args.profile}")
+
+
+if __name__ == "__main__":
+    main()